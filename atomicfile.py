@@ -0,0 +1,63 @@
+import os, sys
+import errno
+import thread
+
+###########################################################################
+# Atomic file replacement.
+###########################################################################
+#
+# Caches shared by concurrent invocations (state snapshot, timing histograms,
+# file and link indexes) are written to a temporary file next to the target
+# which is then renamed over it, readers either see the old or the new file
+# but never a partial one. On Windows os.rename() refuses to replace existing
+# files and removing the target first leaves a window without any file (and
+# fails if a reader has it open), MoveFileEx() replaces it in one step.
+
+MOVEFILE_REPLACE_EXISTING = 0x1
+
+
+def replace(src, dst):
+    """
+    Rename ``src`` to ``dst``, replacing ``dst`` if it exists.
+    """
+    if sys.platform != "win32":
+        os.rename(src, dst)
+        return
+    import ctypes
+    encoding = sys.getfilesystemencoding()
+    if not ctypes.windll.kernel32.MoveFileExW(
+            src if isinstance(src, unicode) else src.decode(encoding),
+            dst if isinstance(dst, unicode) else dst.decode(encoding),
+            MOVEFILE_REPLACE_EXISTING):
+        raise ctypes.WinError()
+
+
+def write(filename, data):
+    """
+    Atomically replace ``filename`` with ``data`` (str), creating its folder
+    if needed.
+    """
+    dirname = os.path.dirname(filename)
+    if dirname:
+        try:
+            os.makedirs(dirname)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    # Unique per thread, concurrent writers never share a temporary file.
+    tmpname = "%s.%d-%d.tmp" % (filename, os.getpid(), thread.get_ident())
+    f = open(tmpname, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    try:
+        replace(tmpname, filename)
+    except OSError:
+        os.remove(tmpname)
+        raise
+
+
+###########################################################################
+# The End.
+###########################################################################
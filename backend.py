@@ -0,0 +1,26 @@
+import os, sys
+
+###########################################################################
+# Platform abstraction layer.
+###########################################################################
+#
+# Kept apart from dropbox.py so that main.py can hand launches over to a
+# running resolver daemon (see daemon.py) without importing the URI engine.
+#
+# Backends can be picked explicitly via DROPBOX_URI_PLATFORM, for instance
+# "headless" to run on servers without any UI (see platform_headless.py) or
+# "recording" to record all platform calls (see platform_recording.py).
+
+if os.environ.get("DROPBOX_URI_PLATFORM"):
+    platform = __import__("platform_%s" % os.environ["DROPBOX_URI_PLATFORM"])
+elif sys.platform == "win32":
+    import platform_win32 as platform
+elif sys.platform == "darwin":
+    import platform_mac as platform
+else:
+    raise NotImplementedError("Unsupported platform (set DROPBOX_URI_PLATFORM=headless)")
+
+
+###########################################################################
+# The End.
+###########################################################################
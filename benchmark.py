@@ -0,0 +1,1782 @@
+import os, sys
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+###########################################################################
+# Synthetic Dropbox state fixtures.
+###########################################################################
+
+ROOT_NS = 1000
+FIXTURE_NAMES = [u"Projects", u"Design", u"Avst\xe4mning", u"Marketing", u"Reports"]
+
+
+def create_fixtures(rootdir, mounts=50, depth=3, files=5):
+    """
+    Create a fake Dropbox installation below ``rootdir``: a ``config.db`` and
+    ``filecache.db`` (only the ``config`` and ``mount_table`` schemas used by
+    dropbox.py) plus a Dropbox folder with ``mounts`` shared folders, each
+    nested ``depth`` levels deep with ``files`` files per level. Returns the
+    list of generated files in shared folders.
+    """
+    home = os.path.join(rootdir, "home")
+    dropbox_path = os.path.join(rootdir, "Dropbox")
+    for dbdir in (os.path.join(home, ".dropbox"),
+                  os.path.join(rootdir, "appdata", "Dropbox")):
+        if not os.path.exists(dbdir):
+            os.makedirs(dbdir)
+
+    con = sqlite3.connect(os.path.join(home, ".dropbox", "config.db"))
+    con.execute("CREATE TABLE config (key TEXT PRIMARY KEY, value TEXT)")
+    con.executemany("INSERT INTO config VALUES (?, ?)",
+                    [("root_ns", ROOT_NS), ("dropbox_path", dropbox_path)])
+    con.commit()
+    con.close()
+
+    con = sqlite3.connect(os.path.join(home, ".dropbox", "filecache.db"))
+    con.execute("CREATE TABLE mount_table (target_ns INTEGER PRIMARY KEY, server_path TEXT)")
+    paths = []
+    for n in range(mounts):
+        name = u"%s %d" % (FIXTURE_NAMES[n % len(FIXTURE_NAMES)], n)
+        con.execute("INSERT INTO mount_table VALUES (?, ?)",
+                    (ROOT_NS + 1 + n, u"%d:/%s" % (ROOT_NS, name)))
+        folder = os.path.join(dropbox_path, name)
+        for level in range(depth):
+            folder = os.path.join(folder, u"Level %d" % level)
+            os.makedirs(folder)
+            for i in range(files):
+                filename = os.path.join(folder, u"File %d.txt" % i)
+                open(filename, "wb").close()
+                paths.append(filename)
+    con.commit()
+    con.close()
+
+    for filename in ("config.db", "filecache.db"):
+        shutil.copy(os.path.join(home, ".dropbox", filename),
+                    os.path.join(rootdir, "appdata", "Dropbox", filename))
+    return paths
+
+
+def use_fixtures(rootdir):
+    """
+    Point the platform modules at the fixtures in ``rootdir``.
+    """
+    os.environ["HOME"] = os.path.join(rootdir, "home")
+    os.environ["APPDATA"] = os.path.join(rootdir, "appdata")
+    os.environ["XDG_CACHE_HOME"] = os.path.join(rootdir, "cache")
+    os.environ.setdefault("DROPBOX_URI_PLATFORM", "headless")
+
+
+###########################################################################
+# Timing helpers.
+###########################################################################
+
+def timeit(func, repeat=20):
+    """
+    Call ``func`` ``repeat`` times and return (min, median) seconds per call.
+    """
+    timings = []
+    for n in range(repeat):
+        t = time.time()
+        func()
+        timings.append(time.time() - t)
+    timings.sort()
+    return timings[0], timings[len(timings) // 2]
+
+
+def sizeof(obj, seen=None):
+    """
+    Approximate deep memory footprint of ``obj`` in bytes.
+    """
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen) for (k, v) in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += sizeof(obj.__dict__, seen)
+    return size
+
+
+# Timings reported by the current run, (benchmark, name, min, median) in ms.
+results = []
+current = None
+
+
+def report(name, timings):
+    print "%-40s min %8.3f ms   median %8.3f ms" % (
+        name, timings[0] * 1000.0, timings[1] * 1000.0)
+    results.append({"benchmark": current, "name": name,
+                    "min_ms": timings[0] * 1000.0, "median_ms": timings[1] * 1000.0})
+
+
+def write_results(filename, options):
+    """
+    Save all reported timings together with the fixture settings and the
+    current commit as JSON so that runs can be compared between commits.
+    """
+    import json
+    try:
+        commit = subprocess.Popen(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE).communicate()[0].strip()
+    except OSError:
+        commit = None
+    f = open(filename, "wb")
+    try:
+        json.dump({"commit": commit or None, "python": sys.version.split()[0],
+                   "platform": os.environ.get("DROPBOX_URI_PLATFORM"),
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "fixtures": {"mounts": options.mounts, "depth": options.depth,
+                                "files": options.files},
+                   "results": results}, f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+
+
+###########################################################################
+# Benchmarks.
+###########################################################################
+
+def bench_daemon(rootdir, paths, runs=10, clients=4, window=200):
+    """
+    Compare the in-process mount table lookup done by dropbox.main() with a
+    round-trip to the resolver daemon, then time main.py launches linking
+    one item without and with "main.py --daemon" running (which they hand
+    over to it) and check that the daemon coalesces concurrent launches, also
+    with a launch which runs in-process, and records their timings.
+    """
+    import dropbox, daemon, timing
+
+    if sys.platform == "win32":
+        address = r"\\.\pipe\DropboxURI-benchmark"
+    else:
+        address = os.path.join(rootdir, "daemon.sock")
+
+    selection = paths[::max(1, len(paths) // 10)]
+
+    def in_process():
+        dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders()).map_paths(selection)
+
+    def via_daemon():
+        client = daemon.connect(address)
+        client.map_paths(selection)
+        client.close()
+
+    server = subprocess.Popen(
+        [sys.executable, "-c", "import daemon; daemon.serve(%r)" % address],
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        for n in range(100):
+            if daemon.connect(address) is not None:
+                break
+            time.sleep(0.05)
+        else:
+            raise RuntimeError("Resolver daemon failed to start")
+        report("dropbox.main lookup (in-process)", timeit(in_process))
+        report("resolver daemon lookup", timeit(via_daemon))
+    finally:
+        server.terminate()
+        server.wait()
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    output = os.path.join(rootdir, "daemon-output.txt")
+    env = dict(os.environ, DROPBOX_URI_PLATFORM="headless", DROPBOX_URI_OUTPUT=output,
+               DROPBOX_URI_BURST_WINDOW="0")
+    devnull = open(os.devnull, "wb")
+    index = dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+    namespace = index.find_path(paths[0])[0]
+    selection = [path for path in paths if index.find_path(path)[0] == namespace][:clients + 1]
+    written = []
+
+    def launch(path, env=env):
+        return subprocess.Popen([sys.executable, "main.py", path.encode("utf-8")],
+                                cwd=cwd, env=env, stdout=devnull, stderr=devnull)
+
+    def read_output(count=0, timeout=10.0):
+        # The daemon keeps the output file open, only ever append to it. It
+        # acknowledges launches before running them, wait for ``count`` links.
+        deadline = time.time() + timeout
+        while True:
+            lines = open(output, "rb").read().splitlines() if os.path.exists(output) else []
+            if len(lines) - len(written) >= count or time.time() >= deadline:
+                break
+            time.sleep(0.05)
+        new = lines[len(written):]
+        written.extend(new)
+        return new
+
+    def in_process(path, env):
+        # Bypasses the daemon like main.py does when the hand over fails.
+        code = ("import sys, dropbox; sys.argv[:] = ['main.py', %r]; "
+                "dropbox.main(%r, False, 'main.py')" % (path.encode("utf-8"), cwd))
+        return subprocess.Popen([sys.executable, "-c", code],
+                                cwd=cwd, env=env, stdout=devnull, stderr=devnull)
+
+    def serve(env):
+        server = subprocess.Popen([sys.executable, "main.py", "--daemon"], cwd=cwd, env=env,
+                                  stdout=devnull, stderr=devnull)
+        for n in range(100):
+            client = daemon.connect()
+            if client is not None:
+                client.close()
+                return server
+            time.sleep(0.05)
+        server.terminate()
+        raise RuntimeError("Resolver daemon failed to start")
+
+    read_output()
+    without_daemon = timeit(lambda: launch(selection[0]).wait(), runs)
+    read_output()
+    timings = os.path.join(os.environ["XDG_CACHE_HOME"], "dropbox-uri", "timings.hist")
+    if os.path.exists(timings):
+        os.remove(timings)
+    server = serve(env)
+    try:
+        with_daemon = timeit(lambda: launch(selection[0]).wait(), runs)
+        launched = len(read_output(runs))
+    finally:
+        server.terminate()
+        server.wait()
+    recorded = timing.read(timings).get("total", {})
+    burst_env = dict(env, DROPBOX_URI_BURST_WINDOW=str(window))
+    server = serve(burst_env)
+    try:
+        procs = [launch(path, burst_env) for path in selection[:-1]]
+        procs.append(in_process(selection[-1], burst_env))
+        for proc in procs:
+            proc.wait()
+        coalesced = read_output(1)
+        # Give stray second links (double runs) a chance to show up.
+        time.sleep(0.5)
+        coalesced.extend(read_output())
+    finally:
+        server.terminate()
+        server.wait()
+        devnull.close()
+    report("main.py launch (in-process)", without_daemon)
+    report("main.py launch (handed to daemon)", with_daemon)
+    print "%d concurrent launches (one in-process), %d (bundle) links written" % (
+        len(selection), len(coalesced))
+    if launched != runs:
+        raise RuntimeError("Daemon wrote %d links for %d launches" % (launched, runs))
+    if sum(recorded.itervalues()) != runs:
+        raise RuntimeError("Daemon recorded %d timings for %d launches" % (
+            sum(recorded.itervalues()), runs))
+    if len(coalesced) != 1:
+        raise RuntimeError("Expected one bundle link, got %r" % coalesced)
+    items = dropbox.decode_dropbox_bundle(coalesced[0][len(dropbox.SHARE_URL_PREFIX):])[1]
+    if len(items) != len(selection):
+        raise RuntimeError("Bundle link has %d of %d items" % (len(items), len(selection)))
+
+
+def bench_index(rootdir, paths, mounts=5000):
+    """
+    Compare the linear first-match scan over the mount list with the longest
+    prefix SharedFolderIndex lookups on a large (admin sized) mount table.
+    """
+    import dropbox
+
+    dropbox_path = os.path.join(rootdir, "Dropbox")
+    shared_folders = [(unicode(ROOT_NS + 1 + n), os.path.join(dropbox_path, u"Team %05d" % n))
+                      for n in range(mounts)]
+    selection = [os.path.join(dropbox_path, u"Team %05d" % n, u"Level 0", u"File.txt")
+                 for n in range(0, mounts, mounts // 100)]
+    lowered = [(namespace, path.lower()) for (namespace, path) in shared_folders]
+
+    def linear():
+        for arg in selection:
+            for (namespace, shared_path) in lowered:
+                if arg.lower().startswith(shared_path):
+                    break
+
+    index = dropbox.SharedFolderIndex(shared_folders)
+
+    report("linear scan (%d mounts, %d args)" % (mounts, len(selection)), timeit(linear))
+    report("SharedFolderIndex.map_paths", timeit(lambda: index.map_paths(selection)))
+    report("SharedFolderIndex build", timeit(lambda: dropbox.SharedFolderIndex(shared_folders), 5))
+    print "memory: list of tuples %d KB, index %d KB" % (
+        sizeof(lowered) // 1024, sizeof(index) // 1024)
+
+    # Composing the decomposed folder name shortens the path by as much as
+    # decomposing U+0344 in the file name lengthens it, offsets still differ.
+    cafe = os.path.join(dropbox_path, u"Caf\xe9")
+    index = dropbox.SharedFolderIndex(shared_folders + [(u"1", cafe)])
+    path = os.path.join(dropbox_path, u"Cafe\u0301", u"\u0344.txt")
+    match = index.find_path(path)
+    if match != (u"1", os.sep + u"\u0344.txt"):
+        raise RuntimeError("Unexpected match for %r: %r" % (path, match))
+
+
+def bench_snapshot(rootdir, paths):
+    """
+    Compare reading Dropbox state from SQLite with the mmap'ed snapshot and
+    verify that touching a database invalidates the snapshot.
+    """
+    import dropbox
+
+    dropbox.get_dropbox_state()
+    report("read state from SQLite", timeit(dropbox.read_dropbox_state))
+    report("read state from snapshot", timeit(dropbox.get_dropbox_state))
+
+    filecache = dropbox.platform.get_dropbox_dbfile("filecache.db")
+    con = sqlite3.connect(filecache)
+    con.execute("INSERT INTO mount_table VALUES (?, ?)", (ROOT_NS - 1, u"%d:/Fresh" % ROOT_NS))
+    con.commit()
+    con.close()
+    st = os.stat(filecache)
+    os.utime(filecache, (st.st_atime, st.st_mtime + 10))
+    mounts = dropbox.get_dropbox_state()[1]
+    if (unicode(ROOT_NS - 1), u"%d:/Fresh" % ROOT_NS) not in mounts:
+        raise RuntimeError("Snapshot not invalidated after touching filecache.db")
+    print "snapshot invalidated after touching filecache.db: ok"
+
+
+STRESS_WRITER = """\
+import sqlite3, sys, time
+con = sqlite3.connect(sys.argv[1], isolation_level=None)
+deadline = time.time() + float(sys.argv[2])
+n = 0
+while time.time() < deadline:
+    con.execute("BEGIN EXCLUSIVE")
+    con.execute("DELETE FROM mount_table WHERE target_ns < 0")
+    con.execute("INSERT INTO mount_table VALUES (?, ?)", (-1 - n, u"%d:/Stress" % n))
+    time.sleep(0.01)
+    con.execute("COMMIT")
+    n += 1
+"""
+
+
+def bench_stress(rootdir, paths, duration=3.0):
+    """
+    Read Dropbox state in a loop while another process keeps on taking
+    exclusive locks on filecache.db, every read must succeed.
+    """
+    import dropbox
+
+    filecache = dropbox.platform.get_dropbox_dbfile("filecache.db")
+    writer = subprocess.Popen([sys.executable, "-c", STRESS_WRITER, filecache, str(duration)])
+    reads, failures = 0, 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        try:
+            dropbox.read_dropbox_state()
+            reads += 1
+        except (sqlite3.OperationalError, dropbox.DropboxWarning), e:
+            print "read failed: %s" % e
+            failures += 1
+    writer.wait()
+    print "%d reads against a concurrent writer, %d failures" % (reads, failures)
+    if failures:
+        raise RuntimeError("Dropbox state reads failed under lock contention")
+
+
+LAZY_PROBE = """\
+import os, sys, time, resource, threading
+import dropbox
+strategy, count, batch = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+dropbox_path = dropbox.get_dropbox_path()
+paths = [os.path.join(dropbox_path, u"Team %05d" % n, u"Item.txt")
+         for n in range(0, count, max(1, count // batch))][:batch]
+t = time.time()
+if strategy == "index":
+    lookup = dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+else:
+    lookup = dropbox.SharedFolderQuery()
+load = time.time() - t
+t = time.time()
+assert None not in lookup.map_paths(paths)
+lookup.find_namespace(u"%d" % (count // 2))
+elapsed = time.time() - t
+# Lookups from other threads (linkserver's request handlers) must work too.
+errors = []
+def worker():
+    try:
+        assert lookup.find_path(paths[-1]) is not None
+    except Exception, e:
+        errors.append(e)
+threads = [threading.Thread(target=worker) for n in range(4)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+assert not errors, errors
+print "%.3f %.3f %d" % (load * 1000, elapsed * 1000,
+                        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+NFD_PROBE = """\
+import sys, unicodedata
+import dropbox
+path = unicodedata.normalize("NFD", sys.argv[1].decode("utf-8"))
+index = dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+query = dropbox.SharedFolderQuery()
+assert query.find_path(path) is not None, path
+assert query.find_path(path) == index.find_path(path), (query.find_path(path), index.find_path(path))
+"""
+
+
+def bench_lazy(rootdir, paths, mounts=100000, batches=(1, 100, 2000)):
+    """
+    Compare loading a huge mount table into a SharedFolderIndex with pushing
+    lookups of ``batches`` of paths down to SQLite (SharedFolderQuery), in
+    separate processes so that peak RSS can be compared. Also checks that
+    both agree on decomposed (NFD) paths below a Dropbox folder with an
+    accented name.
+    """
+    bigdir = os.path.join(rootdir, "lazy")
+    create_fixtures(bigdir, mounts=0)
+    con = sqlite3.connect(os.path.join(bigdir, "home", ".dropbox", "filecache.db"))
+    con.executemany("INSERT INTO mount_table VALUES (?, ?)",
+                    ((n, u"%d:/Team %05d" % (ROOT_NS, n)) for n in range(mounts)))
+    con.commit()
+    con.close()
+
+    env = dict(os.environ, HOME=os.path.join(bigdir, "home"),
+               APPDATA=os.path.join(bigdir, "appdata"))
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    for batch in batches:
+        for strategy in ("index", "query"):
+            output = subprocess.Popen([sys.executable, "-c", LAZY_PROBE, strategy, str(mounts),
+                                       str(batch)], cwd=cwd, env=env,
+                                      stdout=subprocess.PIPE).communicate()[0]
+            load, elapsed, maxrss = output.split()
+            print "%-8s (%d mounts, %4d items) load %8s ms   lookups %8s ms   peak RSS %6s KB" % (
+                strategy, mounts, batch, load, elapsed, maxrss)
+
+    accented = os.path.join(rootdir, "accented")
+    path = create_fixtures(accented, mounts=1, depth=1, files=1)[0]
+    dropbox_path = os.path.join(accented, u"Jos\xe9 Dropbox")
+    os.rename(os.path.join(accented, "Dropbox"), dropbox_path)
+    path = path.replace(os.path.join(accented, "Dropbox"), dropbox_path)
+    con = sqlite3.connect(os.path.join(accented, "home", ".dropbox", "config.db"))
+    con.execute("UPDATE config SET value = ? WHERE key = 'dropbox_path'", (dropbox_path,))
+    con.commit()
+    con.close()
+    env = dict(os.environ, HOME=os.path.join(accented, "home"),
+               APPDATA=os.path.join(accented, "appdata"))
+    subprocess.check_call([sys.executable, "-c", NFD_PROBE, path.encode("utf-8")],
+                          cwd=cwd, env=env)
+
+
+def bench_bulk(rootdir, paths, count=1000000):
+    """
+    Time bulk.py streaming ``count`` NUL delimited paths through to JSON Lines
+    and CSV output.
+    """
+    dropbox_path = os.path.join(rootdir, "Dropbox")
+    listing = os.path.join(rootdir, "paths.txt")
+    f = open(listing, "wb")
+    for n in range(count):
+        mount = n % len(paths) // 15
+        f.write(os.path.join(dropbox_path, FIXTURE_NAMES[mount % len(FIXTURE_NAMES)] + u" %d" % mount,
+                             u"Deliverables", u"Item %d.pdf" % n).encode("utf-8"))
+        f.write("\0")
+    f.close()
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    for fmt in ("jsonl", "csv"):
+        devnull = open(os.devnull, "wb")
+        t = time.time()
+        subprocess.check_call([sys.executable, "bulk.py", "-0", "--format", fmt, listing],
+                              cwd=cwd, stdout=devnull)
+        devnull.close()
+        print "bulk.py --format %-5s %d paths in %.2f s" % (fmt, count, time.time() - t)
+
+
+def bench_treeindex(rootdir, paths, dirs=2000, files=20):
+    """
+    Time a full build of the link index of a shared folder with ``dirs`` x
+    ``files`` items, a no-change re-run and a re-run after adding a file,
+    then check that a shared folder nested in it is left to its own index.
+    """
+    import json
+    import dropbox, treeindex
+
+    folder = os.path.join(rootdir, "Dropbox", FIXTURE_NAMES[0] + u" 0", u"Tree")
+    for n in range(dirs):
+        dirname = os.path.join(folder, u"Group %d" % (n % 50), u"Folder %d" % n)
+        os.makedirs(dirname)
+        for i in range(files):
+            open(os.path.join(dirname, u"Item %d.pdf" % i), "wb").close()
+    output = os.path.join(rootdir, "index.json")
+    manifest = os.path.join(rootdir, "treeindex.manifest")
+
+    def run(name):
+        t = time.time()
+        changed = treeindex.build([folder], output, "json", manifest)
+        print "%-32s %8.3f s  (%d directories listed)" % (name, time.time() - t, changed)
+
+    run("full build (%d items)" % (dirs * files))
+    run("no-change re-run")
+    open(os.path.join(folder, u"Group 7", u"Folder 7", u"New.pdf"), "wb").close()
+    run("re-run after adding a file")
+
+    nested = os.path.join(folder, u"Group 3", u"Folder 3")
+    filecache = dropbox.platform.get_dropbox_dbfile("filecache.db")
+    con = sqlite3.connect(filecache)
+    con.execute("INSERT INTO mount_table VALUES (?, ?)", (ROOT_NS - 2, u"%d:/%s 0/Tree/Group 3/Folder 3"
+                                                          % (ROOT_NS, FIXTURE_NAMES[0])))
+    con.commit()
+    try:
+        run("re-run with a nested shared folder")
+    finally:
+        con.execute("DELETE FROM mount_table WHERE target_ns = ?", (ROOT_NS - 2,))
+        con.commit()
+        con.close()
+    leaked = [item["path"] for item in json.load(open(output, "rb"))
+              if (item["path"] + os.sep).startswith(nested + os.sep)]
+    if leaked:
+        raise RuntimeError("Nested shared folder linked via its parent: %r" % leaked[:3])
+
+
+EXPLORE_PROBE = """\
+import sys
+import dropbox
+count = int(sys.argv[1])
+index = dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+paths = [line.decode("utf-8") for line in sys.stdin.read().splitlines()][:count]
+uris = [dropbox.PROTOCOL_URI_PREFIX + dropbox.encode_dropbox_uri(*index.find_path(path))
+        for path in paths]
+dropbox.explore_paths([filename for filenames in index.resolve_uris(uris)
+                       for filename in filenames])
+explored = sum(len(args[1]) for (name, args) in dropbox.platform.calls)
+print "%d %d %d" % (len(paths), dropbox.platform.count("explore_paths"), explored)
+"""
+
+
+def bench_explore(rootdir, paths, count=200):
+    """
+    Count file browser helpers spawned when exploring ``count`` URIs spread
+    over a few folders, using the recording platform backend.
+    """
+    env = dict(os.environ, DROPBOX_URI_PLATFORM="recording")
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, "-c", EXPLORE_PROBE, str(count)], cwd=cwd, env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output = proc.communicate("\n".join(path.encode("utf-8") for path in paths))[0]
+    items, helpers, explored = [int(n) for n in output.split()]
+    folders = len(set(os.path.dirname(path) for path in paths[:count]))
+    print "%d items in %d folders: %d helpers spawned (was %d)" % (
+        items, folders, helpers, items)
+    if helpers != folders or explored != items:
+        raise RuntimeError("Expected one helper per folder revealing every item")
+
+
+RTF_GOLDEN = [
+    (u"<a href='http://www.sharedropbox.com/MTAwMXwvYS50eHQ'>a.txt</a>",
+     '{\\field{\\*\\fldinst{HYPERLINK "http://www.sharedropbox.com/MTAwMXwvYS50eHQ"}}'
+     '{\\fldrslt a.txt}}'),
+    (u"<a href='x'>Avst\xe4mning/\u20ac {1}\\</a><br><a href=\"y\">\U0001F600</a>",
+     '{\\field{\\*\\fldinst{HYPERLINK "x"}}{\\fldrslt Avst\\u228?mning/\\u8364? \\{1\\}\\\\}}'
+     '\\line\n{\\field{\\*\\fldinst{HYPERLINK "y"}}{\\fldrslt \\u-10179?\\u-8704?}}'),
+    (u"Q&amp;A &lt;b&gt; &#x263a; &bogus; \"quoted\"\ttab",
+     'Q&A <b> \\u9786? &bogus; \\\'22quoted\\\'22\\tab tab'),
+]
+
+
+def bench_rtf(rootdir, paths, count=10000):
+    """
+    Check the in-process HTML to RTF conversion used for the Mac OS X
+    clipboard against golden output and time it for ``count`` links.
+    """
+    import platform_mac
+
+    for (html, body) in RTF_GOLDEN:
+        rtf = platform_mac.html_to_rtf(html)
+        if rtf != platform_mac.RTF_HEADER + body + platform_mac.RTF_FOOTER:
+            raise RuntimeError("Unexpected RTF for %r: %r" % (html, rtf))
+    print "%d golden conversions ok" % len(RTF_GOLDEN)
+
+    html = u"<br>".join(u"<a href='http://www.sharedropbox.com/%s'>%s</a>" % (
+        "MTAwMXwvUHJvamVjdHMvTGV2ZWwgMC9GaWxlIDAudHh0", os.path.basename(paths[n % len(paths)]))
+        for n in range(count))
+    report("html_to_rtf (%d links, %d KB)" % (count, len(html) // 1024),
+           timeit(lambda: platform_mac.html_to_rtf(html), repeat=10))
+
+
+LOAD_CLIENT = """\
+import sys, time, httplib
+host, port, count, uri = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+conn = httplib.HTTPConnection(host, port)
+for n in range(count):
+    conn.request("GET", "/" + uri if n % 2 else "/%s?format=json" % uri)
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 200, response.status
+    assert response.getheader("Vary") == "Accept", response.getheader("Vary")
+print "ok"
+"""
+
+
+def bench_linkserver(rootdir, paths, clients=4, count=5000):
+    """
+    Load test linkserver.py: ``clients`` processes each sending ``count``
+    requests over a single keep-alive connection, then check that --resolve
+    picks up shared folders added while it is running.
+    """
+    import json, urllib2
+    import dropbox
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, DROPBOX_URI_PLATFORM="headless")
+    server = subprocess.Popen([sys.executable, "linkserver.py", "--port", "0"],
+                              cwd=cwd, env=env, stdout=subprocess.PIPE)
+    try:
+        host, port = server.stdout.readline().split("//")[1].strip("/\n").split(":")
+        uri = "MTAwMXwvUHJvamVjdHMgMC9MZXZlbCAwL0ZpbGUgMC50eHQ"
+        t = time.time()
+        procs = [subprocess.Popen([sys.executable, "-c", LOAD_CLIENT, host, port, str(count), uri],
+                                  stdout=subprocess.PIPE) for n in range(clients)]
+        results = [proc.communicate()[0].strip() for proc in procs]
+        elapsed = time.time() - t
+    finally:
+        server.terminate()
+        rusage = os.wait4(server.pid, 0)[2]
+    if results != ["ok"] * clients:
+        raise RuntimeError("Load test clients failed")
+    # Clients compete with the server for the CPU, server CPU time tells how
+    # many requests/s a single dedicated core would handle.
+    cpu = rusage.ru_utime + rusage.ru_stime
+    print "%d requests from %d keep-alive clients in %.2f s (%d requests/s)" % (
+        clients * count, clients, elapsed, clients * count / elapsed)
+    print "server CPU time %.2f s (%d requests/s per core)" % (cpu, clients * count / cpu)
+
+    namespace = u"%d" % (max(int(ns) for (ns, path) in dropbox.get_dropbox_shared_folders()) + 1)
+    link = dropbox.encode_dropbox_uri(namespace, u"/File.txt")
+    added = os.path.join(dropbox.get_dropbox_path(), u"Added Later")
+    if not os.path.exists(added):
+        os.makedirs(added)
+        open(os.path.join(added, u"File.txt"), "wb").close()
+    server = subprocess.Popen([sys.executable, "linkserver.py", "--port", "0", "--resolve"],
+                              cwd=cwd, env=env, stdout=subprocess.PIPE)
+    con = sqlite3.connect(dropbox.platform.get_dropbox_dbfile("filecache.db"))
+    try:
+        address = server.stdout.readline().split("//")[1].strip("/\n")
+
+        def lookup():
+            request = urllib2.Request("http://%s/%s" % (address, link),
+                                      headers={"Accept": "application/json"})
+            return json.loads(urllib2.urlopen(request).read())["filename"]
+        before = lookup()
+        # Bump the mtime too, the fingerprint may not tell writes within the
+        # same second apart on coarse file systems.
+        con.execute("INSERT INTO mount_table VALUES (?, ?)",
+                    (int(namespace), u"%d:/Added Later" % ROOT_NS))
+        con.commit()
+        mtime = time.time() + 2
+        os.utime(dropbox.platform.get_dropbox_dbfile("filecache.db"), (mtime, mtime))
+        after = lookup()
+    finally:
+        con.execute("DELETE FROM mount_table WHERE target_ns = ?", (int(namespace),))
+        con.commit()
+        con.close()
+        server.terminate()
+        server.wait()
+    print "--resolve before/after adding a shared folder: %r, %r" % (before, after)
+    if before is not None or after is None or not after.endswith(u"File.txt"):
+        raise RuntimeError("Link server didn't reload the shared folders")
+
+
+def make_path_corpus(count, seed=1):
+    """
+    Return ``count`` realistic relative paths (deep project trees, camera
+    uploads, office documents, unicode names).
+    """
+    import random
+    rnd = random.Random(seed)
+    roots = [u"Projects/Client %d", u"Documents/Reports/20%02d", u"Camera Uploads",
+             u"Design/Assets/Images", u"Marketing/Campaign %d/Final", u"Shared/Avst\xe4mning %d"]
+    names = [u"Invoice 20%02d-%03d.pdf", u"20%02d-05-03 12.%02d.10.jpg", u"Screenshot %d %d.png",
+             u"Quarterly Report Q%d - v%d.docx", u"Budget %d (%d).xlsx", u"\u8cc7\u6599 %d-%d.txt",
+             u"Copy of Untitled %d %d.pptx", u"IMG_%04d%d.mov"]
+    paths = []
+    for n in range(count):
+        root = rnd.choice(roots)
+        root = root % rnd.randint(1, 30) if "%" in root else root
+        subdirs = u"".join(u"/Level %d" % rnd.randint(0, 9) for i in range(rnd.randint(0, 3)))
+        paths.append(u"/%s%s/%s" % (root, subdirs, rnd.choice(names) % (
+            rnd.randint(10, 30), rnd.randint(0, 999))))
+    return paths
+
+
+def random_path(rnd):
+    """
+    Return a random path mixing URI tokens, separators, control and astral
+    characters (for round-trip checks).
+    """
+    import dropbox
+    alphabet = [u"/", u"\\", u"|", u"\x00", u"\x01", u"\x1f", u"a", u"\xe4", u"\u20ac",
+                u"\U0001F600", u"."] + [token.decode("ascii") for token in dropbox.URI_TOKENS]
+    return u"".join(rnd.choice(alphabet) for n in range(rnd.randint(0, 40)))
+
+
+def bench_uri(rootdir, paths, count=20000):
+    """
+    Round-trip check of the v1 and v2 URI formats on random paths and compare
+    link sizes and codec speed on a realistic path corpus.
+    """
+    import random
+    import dropbox
+    rnd = random.Random(42)
+    for n in range(count):
+        namespace = unicode(rnd.choice([0, 1, 127, 128, 1001, 2 ** 31, 2 ** 64 + 3]))
+        path = random_path(rnd).replace(u"/", os.sep)
+        for version in (1, 2):
+            uri = dropbox.encode_dropbox_uri(namespace, path, version)
+            if not dropbox.is_valid_dropbox_uri(dropbox.PROTOCOL_URI_PREFIX + uri):
+                raise RuntimeError("Invalid v%d URI for %r" % (version, path))
+            if dropbox.decode_dropbox_uri(uri) != (namespace, path):
+                raise RuntimeError("v%d round-trip failed for %r" % (version, path))
+    print "%d random v1/v2 round-trips ok" % count
+
+    corpus = [path.replace(u"/", os.sep) for path in make_path_corpus(count)]
+    namespace = u"1234567890"
+    for version in (1, 2):
+        uris = [dropbox.encode_dropbox_uri(namespace, path, version) for path in corpus]
+        print "v%d average link length %5.1f chars" % (
+            version, sum(len(uri) for uri in uris) / float(len(uris)))
+        report("v%d encode (%d paths)" % (version, count), timeit(
+            lambda: [dropbox.encode_dropbox_uri(namespace, path, version) for path in corpus], 5))
+        report("v%d decode (%d paths)" % (version, count), timeit(
+            lambda: [dropbox.decode_dropbox_uri(uri) for uri in uris], 5))
+
+
+def bench_audit(rootdir, paths, count=200000):
+    """
+    Compare decoding ``count`` URIs (v1, v2 and 1% bundles, 5% truncated, a
+    few with embedded or trailing newlines) with the batch codec against a
+    loop over is_valid_dropbox_uri() + decode_dropbox_bundle().
+    """
+    import dropbox
+    corpus = make_path_corpus(1000)
+    uris = []
+    for n in range(count):
+        uri = dropbox.encode_dropbox_uri(u"%d" % (1234567890 + n % 50),
+                                         corpus[n % len(corpus)], 1 + n % 2)
+        if n % 20 == 0:
+            uri = uri[:-1]
+        elif n % 997 == 0:
+            uri = uri[:4] + "\n" + uri[4:]
+        elif n % 991 == 0:
+            uri = uri + "\n"
+        elif n % 100 == 1:
+            uri = dropbox.encode_dropbox_bundle(u"1001", corpus[n % 997:n % 997 + 3])[0][0]
+        uris.append(dropbox.PROTOCOL_URI_PREFIX + uri)
+
+    def loop():
+        rows = []
+        for uri in uris:
+            try:
+                if dropbox.is_valid_dropbox_uri(uri):
+                    (namespace, paths) = dropbox.decode_dropbox_bundle(
+                        uri[len(dropbox.PROTOCOL_URI_PREFIX):])
+                    rows.append((namespace, tuple(paths) if dropbox.is_bundle_uri(uri) else paths[0]))
+                    continue
+            except ValueError:
+                pass
+            rows.append(None)
+        return rows
+
+    expected = loop()
+    namespaces, paths, valid = dropbox.decode_dropbox_uris(uris)
+    if [(ns, path) if ok else None for (ns, path, ok) in zip(namespaces, paths, valid)] != expected:
+        raise RuntimeError("Batch decoding differs from decode_dropbox_bundle()")
+    for (name, func) in [("loop", loop), ("batch", lambda: dropbox.decode_dropbox_uris(uris))]:
+        t = timeit(func, 3)[0]
+        print "%-6s %d URIs in %.3f s (%d URIs/s)" % (name, count, t, count / t)
+
+
+PHASES_PROBE = """\
+import json, os, sys, time
+t = time.time()
+import dropbox
+phases = {"import": time.time() - t}
+from dropbox import platform
+platform.set_handler("explore", lambda folder, filenames: None)
+paths = [line.decode("utf-8") for line in sys.stdin.read().splitlines()]
+
+t = time.time()
+platform.setup(dropbox.PROGRAM_TITLE, os.getcwd().decode("utf-8"), False)
+phases["setup"] = time.time() - t
+
+t = time.time()
+shared_folders = dropbox.get_dropbox_shared_folders()
+phases["get_dropbox_shared_folders"] = time.time() - t
+
+t = time.time()
+index = dropbox.SharedFolderIndex(shared_folders)
+matches = index.map_paths(paths)
+phases["map_paths (per argument)"] = (time.time() - t) / len(paths)
+
+t = time.time()
+uris = [dropbox.PROTOCOL_URI_PREFIX + dropbox.encode_dropbox_uri(*match) for match in matches]
+phases["encode_dropbox_uri"] = (time.time() - t) / len(paths)
+
+t = time.time()
+for uri in uris:
+    assert dropbox.is_valid_dropbox_uri(uri)
+resolver = dropbox.DropboxURIResolver(lambda: index)
+dropbox.explore_paths([filename for result in resolver.resolve_many(uris)
+                       for filename in result["filenames"]])
+phases["resolve_many + explore_paths (per URI)"] = (time.time() - t) / len(paths)
+print json.dumps(phases)
+"""
+
+PHASES = ["import", "setup", "get_dropbox_shared_folders", "map_paths (per argument)",
+          "encode_dropbox_uri", "resolve_many + explore_paths (per URI)"]
+
+
+def bench_phases(rootdir, paths, runs=10):
+    """
+    Time each phase of generating and opening links (import, setup, loading
+    the mount table, mapping arguments, encoding, validating and resolving
+    URIs) in ``runs`` fresh processes on the headless backend.
+    """
+    import json
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, DROPBOX_URI_PLATFORM="headless")
+    listing = "\n".join(path.encode("utf-8") for path in paths)
+    timings = dict((phase, []) for phase in PHASES)
+    for n in range(runs):
+        output = subprocess.Popen([sys.executable, "-c", PHASES_PROBE], cwd=cwd, env=env,
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE
+                                  ).communicate(listing)[0]
+        for (phase, seconds) in json.loads(output).items():
+            timings[phase].append(seconds)
+    for phase in PHASES:
+        values = sorted(timings[phase])
+        report(phase, (values[0], values[len(values) // 2]))
+
+
+STARTUP_PROBE = """\
+import os, sys
+sys.argv = ["main.py"] + sys.argv[1:]
+import dropbox
+dropbox.main(os.getcwd().decode("utf-8"), False, "main.py")
+deferred = sys.argv[1:] and os.environ["DEFERRED_MODULES"].split(",")
+print ",".join(name for name in deferred if sys.modules.get(name) is not None)
+"""
+
+# Modules which must not be imported when linking an item with a warm state
+# snapshot (no daemon running, no setup required).
+DEFERRED_MODULES = ["sqlite3", "tempfile", "base64", "socket", "multiprocessing",
+                    "logging.handlers", "htmlentitydefs", "shutil"]
+
+# Launch overhead on top of a bare interpreter start-up (python -c pass).
+STARTUP_BUDGET_MS = 60.0
+
+
+def bench_startup(rootdir, paths, runs=10):
+    """
+    Check that a launch linking one item doesn't import modules only needed
+    by other code paths and stays within STARTUP_BUDGET_MS on top of the
+    interpreter start-up. Python 2 has no "-X importtime" so the import check
+    is done via sys.modules instead.
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, DROPBOX_URI_PLATFORM="headless",
+               DEFERRED_MODULES=",".join(DEFERRED_MODULES))
+    devnull = open(os.devnull, "wb")
+    try:
+        def launch(argv):
+            proc = subprocess.Popen([sys.executable] + argv, cwd=cwd, env=env,
+                                    stdout=subprocess.PIPE, stderr=devnull)
+            output = proc.communicate()[0]
+            if proc.returncode != 0:
+                raise RuntimeError("Launch failed: %s" % " ".join(argv))
+            return output
+        filename = paths[0].encode("utf-8")
+        launch(["main.py", filename]) # Warm up the state snapshot.
+        imported = launch(["-c", STARTUP_PROBE, filename]).splitlines()[-1]
+        baseline = timeit(lambda: launch(["-c", "pass"]), runs)
+        timings = timeit(lambda: launch(["main.py", filename]), runs)
+    finally:
+        devnull.close()
+    report("interpreter start-up", baseline)
+    report("main.py (link one item)", timings)
+    overhead = (timings[1] - baseline[1]) * 1000.0
+    print "start-up overhead %.1f ms (budget %.1f ms)" % (overhead, STARTUP_BUDGET_MS)
+    if imported:
+        raise RuntimeError("Deferred modules imported at start-up: %s" % imported)
+    if overhead > STARTUP_BUDGET_MS:
+        raise RuntimeError("Start-up budget exceeded")
+
+
+def bench_logging(rootdir, paths, count=2000, stall=0.0005):
+    """
+    Time resolving and exploring links (one debug message per URI) with
+    logging disabled and with file logging, written synchronously or by
+    logqueue's background writer, to a regular and to a slow disk (each
+    write stalling for ``stall`` seconds, e.g. network home folders), then
+    check that records put by concurrent threads are all written.
+    """
+    import logging
+    import dropbox
+    import logqueue
+    import threading
+    from logging.handlers import RotatingFileHandler
+
+    class SlowFileHandler(RotatingFileHandler):
+        def emit(self, record):
+            time.sleep(stall)
+            RotatingFileHandler.emit(self, record)
+
+    dropbox.platform.set_handler("explore", lambda folder, filenames: None)
+    index = dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+    uris = [dropbox.PROTOCOL_URI_PREFIX + dropbox.encode_dropbox_uri(*index.find_path(path))
+            for path in paths[:count]]
+    resolver = dropbox.DropboxURIResolver(lambda: index)
+    logfile = os.path.join(rootdir, "bench.log")
+    hot_path = lambda: [dropbox.explore_paths(result["filenames"])
+                        for result in resolver.resolve_many(uris)]
+
+    root = logging.getLogger()
+    saved = (root.handlers[:], root.level)
+    try:
+        root.handlers = []
+        root.setLevel(logging.WARNING)
+        report("logging disabled (%d URIs)" % len(uris), timeit(hot_path, 5))
+        root.setLevel(logging.DEBUG)
+        for (disk, handler_class) in [("", RotatingFileHandler), ("slow ", SlowFileHandler)]:
+            handler = handler_class(logfile, maxBytes=512*1024)
+            root.handlers = [handler]
+            report("synchronous %sfile logging" % disk, timeit(hot_path, 5))
+            handler.close()
+            root.handlers = []
+            listener = logqueue.start([handler_class(logfile, maxBytes=512*1024)])
+            report("queued %sfile logging" % disk, timeit(hot_path, 5))
+            t = time.time()
+            listener.stop()
+            root.handlers = []
+            print "draining the log queue took %.3f ms" % ((time.time() - t) * 1000.0)
+    finally:
+        root.handlers, root.level = saved
+        dropbox.platform.set_handler("explore", None)
+
+    # Concurrent producers (resolver daemon threads) must never leave the
+    # writer asleep with records queued.
+    written = []
+
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            written.append(record)
+    queue = logqueue.RecordQueue()
+    listener = logqueue.QueueListener(queue, ListHandler())
+    listener.start()
+    record = logging.LogRecord("bench", logging.INFO, __file__, 0, "msg", None, None)
+
+    def produce():
+        for n in xrange(count):
+            queue.put(record)
+    threads = [threading.Thread(target=produce) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    deadline = time.time() + 5.0
+    while len(written) < 8 * count and time.time() < deadline:
+        time.sleep(0.01)
+    print "%d of %d records from 8 threads written before shutdown" % (len(written), 8 * count)
+    listener.stop()
+    if len(written) != 8 * count:
+        raise AssertionError("Writer missed a wake-up, %d records left queued" % len(queue.records))
+
+
+def bench_timing(rootdir, paths, runs=50):
+    """
+    Cost of the phase timing spans and of saving them to the histogram file
+    after every invocation, then link ``runs`` items via main.py and check
+    that the CLI dump reports percentiles for every phase.
+    """
+    import json
+    import math
+    import random
+    import timing
+
+    def spans(n=1000):
+        for i in xrange(n):
+            with timing.span("bench"):
+                pass
+    t = timeit(spans)
+    report("1000 timing spans", t)
+    print "overhead per span %.2f us" % (t[0] * 1000.0)
+
+    histfile = os.path.join(rootdir, "cache", "bench.hist")
+    rnd = random.Random(17)
+    histograms = {}
+    for n in range(timing.HISTORY_SIZE):
+        timing.merge(histograms, {"bench": rnd.expovariate(1.0 / 0.010)})
+    timing.write(histfile, histograms)
+    median = timing.percentile(timing.read(histfile)["bench"], 50)
+    print "exponential(10 ms) p50 %.2f ms (expected %.2f ms)" % (median * 1000.0,
+                                                                  10.0 * math.log(2))
+    if abs(median - 0.010 * math.log(2)) > 0.2 * 0.010 * math.log(2):
+        raise AssertionError("Histogram p50 is off")
+
+    def save():
+        timing.phases.update(("phase%d" % n, 0.001 * n) for n in range(8))
+        timing.save(histfile)
+    report("save 8 phases to histogram", timeit(save))
+
+    cachefile = os.path.join(os.environ["XDG_CACHE_HOME"], "dropbox-uri", "timings.hist")
+    if os.path.exists(cachefile):
+        os.remove(cachefile)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    devnull = open(os.devnull, "wb")
+    try:
+        for path in paths[:runs]:
+            subprocess.check_call([sys.executable, "main.py", path.encode("utf-8")],
+                                  cwd=cwd, stdout=devnull, stderr=devnull)
+    finally:
+        devnull.close()
+    output = subprocess.Popen([sys.executable, "main.py", "--timings"], cwd=cwd,
+                              stdout=subprocess.PIPE).communicate()[0]
+    summary = json.loads(output)
+    for phase in ("total", "args", "load", "encode", "clipboard"):
+        if summary.get(phase, {}).get("count") != runs:
+            raise AssertionError("Missing samples for %s: %r" % (phase, summary))
+    for (phase, stats) in sorted(summary.items()):
+        print "%-40s p50 %8.3f ms   p95 %8.3f ms   p99 %8.3f ms" % (
+            phase, stats["p50"], stats["p95"], stats["p99"])
+
+
+def bench_fileindex(rootdir, paths, dirs=100, files=200):
+    """
+    Resolve links to moved, renamed and deleted items in a shared folder
+    with ``dirs`` * ``files`` extra files: building the name index, lookups
+    and incremental refreshes, plus checks of where each link ends up.
+    """
+    import dropbox, fileindex
+
+    index = dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+    namespace, shared_path = sorted(index.namespaces.items())[-1]
+    archive = os.path.join(shared_path, u"Archive")
+    if not os.path.exists(archive):
+        for d in range(dirs):
+            folder = os.path.join(archive, u"Box %03d" % d)
+            os.makedirs(folder)
+            for f in range(files):
+                open(os.path.join(folder, u"Item %03d-%03d.txt" % (d, f)), "wb").close()
+    original = os.path.join(archive, u"Box 001", u"Item 001-001.txt")
+    open(original, "wb").write("x" * 100)
+    fileindex.indexes.clear()
+    if os.path.exists(fileindex.get_index_file(namespace)):
+        os.remove(fileindex.get_index_file(namespace))
+
+    def link(filename):
+        return dropbox.PROTOCOL_URI_PREFIX + dropbox.encode_dropbox_uri(
+            *index.find_path(filename))
+
+    resolver = dropbox.DropboxURIResolver(lambda: index)
+
+    def resolve(uri):
+        return resolver.resolve_many([uri])[0]["filename"]
+
+    t = time.time()
+    tree = fileindex.load_index(namespace, shared_path)
+    tree.refresh()
+    fileindex.save_index(tree)
+    print "indexed %d names in %.1f ms" % (len(tree.names), (time.time() - t) * 1000.0)
+    report("refresh (nothing changed)", timeit(tree.refresh, 5))
+
+    # Same name elsewhere too, the size remembered for the old path decides.
+    decoy = os.path.join(archive, u"Box 002", u"Item 001-001.txt")
+    moved = os.path.join(archive, u"Box 099", u"Item 001-001.txt")
+    uri = link(original)
+    open(decoy, "wb").write("y" * 10)
+    tree.refresh()
+    os.rename(original, moved)
+    deleted = os.path.join(archive, u"Box 003", u"Item 003-003.txt")
+    gone = link(deleted)
+    os.remove(deleted)
+    # A lone namesake elsewhere (other size, no folder in common) isn't it.
+    budget = os.path.join(archive, u"Box 004", u"Budget.xlsx")
+    namesake = os.path.join(shared_path, u"Budget.xlsx")
+    open(budget, "wb").write("z" * 20)
+    tree.refresh()
+    deleted_budget = link(budget)
+    os.remove(budget)
+    open(namesake, "wb").write("z" * 30)
+
+    fileindex.indexes.clear()
+    t = time.time()
+    found = resolve(uri)
+    print "first lookup after the move (refresh) %.3f ms" % ((time.time() - t) * 1000.0)
+    if found != moved:
+        raise RuntimeError("Moved item resolved to %r" % found)
+    report("lookup of moved item", timeit(lambda: resolve(uri), 200))
+    t = time.time()
+    found = resolve(gone)
+    print "first lookup after the delete (refresh) %.3f ms" % ((time.time() - t) * 1000.0)
+    if found != os.path.dirname(deleted):
+        raise RuntimeError("Deleted item resolved to %r" % found)
+    # Misses are remembered, repeated lookups must not walk the tree again.
+    generation = fileindex.indexes[namespace].generation
+    report("lookup of deleted item", timeit(lambda: resolve(gone), 200))
+    if fileindex.indexes[namespace].generation != generation:
+        raise RuntimeError("Repeated misses refreshed the index")
+    found = resolve(deleted_budget)
+    if found != os.path.dirname(budget):
+        raise RuntimeError("Deleted item with a lone namesake resolved to %r" % found)
+
+    # An unusable cache folder must not break resolving.
+    cachedir = os.path.dirname(fileindex.get_index_file(namespace))
+    os.rename(cachedir, cachedir + ".bak")
+    open(cachedir, "wb").close()
+    try:
+        fileindex.indexes.clear()
+        found = resolve(gone)
+    finally:
+        os.remove(cachedir)
+        os.rename(cachedir + ".bak", cachedir)
+    if found != os.path.dirname(deleted):
+        raise RuntimeError("Deleted item resolved to %r without a cache" % found)
+
+    os.remove(namesake)
+    os.rename(moved, original)
+    os.remove(decoy)
+    open(deleted, "wb").close()
+
+
+def bench_args(rootdir, paths, count=1000, latency=0.002):
+    """
+    Vet a selection of ``count`` arguments (some of them duplicates, some
+    missing) on a stand-in slow file system where every existence check
+    takes ``latency`` seconds, like on network shares.
+    """
+    import threading
+    import dropbox
+
+    lock = threading.Lock()
+    stats = []
+
+    def slow_exists(path):
+        time.sleep(latency)
+        with lock:
+            stats.append(path)
+        return os.path.exists(path)
+
+    selection = paths[:count]
+    args = selection + selection[:count // 10] + [path + u".missing" for path in selection[:10]]
+    expected = [path for path in args if not path.endswith(u".missing")]
+
+    def previous():
+        # platform.get_argv() and dropbox.main() both checked every argument.
+        checked = [arg for arg in args if slow_exists(arg)]
+        return [arg for arg in checked if slow_exists(arg)]
+
+    for (name, func) in [("stat twice per argument (before)", previous),
+                         ("vet_arguments (1 thread)",
+                          lambda: dropbox.vet_arguments(args, slow_exists, 1)[1]),
+                         ("vet_arguments (%d threads)" % dropbox.STAT_JOBS,
+                          lambda: dropbox.vet_arguments(args, slow_exists)[1])]:
+        del stats[:]
+        t = time.time()
+        result = func()
+        report(name, (time.time() - t,) * 2)
+        print "%d arguments, %d stat calls" % (len(args), len(stats))
+        if result != expected:
+            raise RuntimeError("Vetted paths differ from the selection")
+    if len(stats) != len(set(args)):
+        raise RuntimeError("Paths were checked more than once")
+
+
+BURST_PROBE = """\
+import json, os, sys, time
+import dropbox
+def write(html, text):
+    start = time.time()
+    time.sleep(float(os.environ.get("BURST_WRITE_DELAY", "0")))
+    f = open(os.environ["BURST_OUTPUT"], "ab")
+    f.write(json.dumps({"pid": os.getpid(), "links": text.splitlines(),
+                        "start": start, "end": time.time()}) + "\\n")
+    f.close()
+dropbox.platform.set_handler("clipboard", write)
+dropbox.main(os.getcwd().decode("utf-8"), False, None)
+"""
+
+
+def bench_burst(rootdir, paths, clients=8, items=25, window=200):
+    """
+    Launch ``clients`` processes at once, each linking its own slice of a
+    selection (like Explorer's "Send To" does), and check that their links
+    end up in a single clipboard write even though a malformed message is
+    sent to the leader. Then again with slow clipboard writes and a
+    straggler launched after the burst, whose clipboard write must wait for
+    the leader's.
+    """
+    import json
+    import dropbox, burst, daemon
+
+    output = os.path.join(rootdir, "burst.jsonl")
+    if os.path.exists(output):
+        os.remove(output)
+    env = dict(os.environ, BURST_OUTPUT=output, DROPBOX_URI_BURST_WINDOW=str(window))
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    selection = paths[:clients * items]
+    index = dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+    expected = set(index.find_path(path) for path in selection)
+
+    t = time.time()
+    procs = [subprocess.Popen([sys.executable, "-c", BURST_PROBE] +
+                              [path.encode("utf-8") for path in selection[n::clients]],
+                              cwd=cwd, env=env)
+             for n in range(clients)]
+    deadline = time.time() + 1.0
+    while time.time() < deadline:
+        try:
+            conn = burst.connect(burst.get_burst_address())
+        except EnvironmentError:
+            time.sleep(0.01)
+            continue
+        try:
+            daemon.send_message(conn, 42)
+            if conn.poll(0.5) and daemon.recv_message(conn) == "ok":
+                raise AssertionError("Leader acknowledged malformed arguments")
+        except EOFError:
+            pass
+        finally:
+            conn.close()
+        break
+    else:
+        raise AssertionError("No burst leader to send malformed arguments to")
+    for proc in procs:
+        proc.wait()
+    elapsed = time.time() - t
+    writes = [json.loads(line) for line in open(output, "rb")]
+    print "%d launches, %d clipboard writes with %d (bundle) links in %.0f ms (window %d ms)" % (
+        clients, len(writes), sum(len(write["links"]) for write in writes),
+        elapsed * 1000.0, window)
+    if len(writes) != 1:
+        raise AssertionError("Expected a single clipboard write, got %d" % len(writes))
+    linked = set()
+    for link in writes[0]["links"]:
+        (namespace, rel_paths) = dropbox.decode_dropbox_bundle(
+            link[len(dropbox.SHARE_URL_PREFIX):])
+        linked.update((namespace, rel_path) for rel_path in rel_paths)
+    if linked != expected:
+        raise AssertionError("Links missing from the clipboard write")
+
+    os.remove(output)
+    env["BURST_WRITE_DELAY"] = "1.0"
+    procs = [subprocess.Popen([sys.executable, "-c", BURST_PROBE] +
+                              [path.encode("utf-8") for path in selection[n::clients]],
+                              cwd=cwd, env=env)
+             for n in range(clients)]
+    time.sleep(0.6)
+    procs.append(subprocess.Popen([sys.executable, "-c", BURST_PROBE,
+                                   paths[clients * items].encode("utf-8")], cwd=cwd, env=env))
+    for proc in procs:
+        proc.wait()
+    writes = sorted((json.loads(line) for line in open(output, "rb")),
+                    key=lambda write: write["start"])
+    print "straggler: %d clipboard writes, %s" % (len(writes), ", ".join(
+        "%d links at +%.0f ms" % (len(write["links"]), (write["start"] - writes[0]["start"]) * 1000.0)
+        for write in writes))
+    for (prev, next) in zip(writes, writes[1:]):
+        if next["start"] < prev["end"]:
+            raise AssertionError("Clipboard writes of two bursts overlapped")
+
+
+def bench_resolver(rootdir, paths, threads=8, batch=50):
+    """
+    Call one shared DropboxURIResolver from a pool of ``threads`` threads,
+    each request encoding or resolving ``batch`` items, and check the
+    results against single-threaded calls and that changing the Dropbox
+    state triggers exactly one reload.
+    """
+    from multiprocessing.pool import ThreadPool
+    import dropbox
+
+    loads = []
+
+    def load():
+        loads.append(time.time())
+        return dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+    resolver = dropbox.DropboxURIResolver(load)
+    batches = [paths[n:n + batch] for n in range(0, len(paths), batch)]
+    expected = [resolver.encode_many(items) for items in batches]
+    uri_batches = [[link["uri"] for link in links] for links in expected]
+
+    def request(n):
+        links = resolver.encode_many(batches[n])
+        resolved = resolver.resolve_many(uri_batches[n])
+        return links == expected[n] and [r["filename"] for r in resolved] == batches[n]
+
+    pool = ThreadPool(threads)
+    try:
+        report("%d requests of %d items (1 thread)" % (len(batches), batch),
+               timeit(lambda: map(request, range(len(batches))), 5))
+        report("%d requests of %d items (%d threads)" % (len(batches), batch, threads),
+               timeit(lambda: pool.map(request, range(len(batches))), 5))
+        if not all(pool.map(request, range(len(batches)))):
+            raise AssertionError("Concurrent results differ")
+        # Touch the databases, the next calls (from all threads) reload once.
+        for dbfile in resolver.sources[::2]:
+            t = os.stat(dbfile).st_mtime + 1
+            os.utime(dbfile, (t, t))
+        del loads[:]
+        if not all(pool.map(request, range(len(batches)))) or len(loads) != 1:
+            raise AssertionError("Expected one reload, got %d" % len(loads))
+    finally:
+        pool.close()
+        pool.join()
+    errors = resolver.encode_many([u"/not/shared"]) + resolver.resolve_many([u"dropbox:bogus"])
+    if not all("error" in result for result in errors):
+        raise AssertionError("Expected per item errors")
+    print "%d items per request, %d reload after the state changed" % (batch, len(loads))
+
+
+STANDIN_WORKER = """\
+import json, os, sys
+# Stand-in for the AppleScript worker: "compiles" the scripts it is passed
+# and logs every command it is asked to run.
+scripts = sys.argv[1:]
+log = open(os.environ["WORKER_LOG"], "ab")
+for line in iter(sys.stdin.readline, ""):
+    request = json.loads(line)
+    log.write("%d %d %s\\n" % (os.getpid(), len(scripts), json.dumps(request)))
+    log.flush()
+    if request[0] in ("reveal", "dialog"):
+        sys.stdout.write("{}\\n")
+    else:
+        sys.stdout.write(json.dumps({"error": "Unknown command"}) + "\\n")
+    sys.stdout.flush()
+"""
+
+
+def bench_osaworker(rootdir, paths, calls=50):
+    """
+    Drive the persistent AppleScript worker of platform_mac with a stand-in
+    worker (works on any OS): check the protocol and lifecycle (on demand
+    start, reuse, idle shutdown and restart after a crash) and compare its
+    latency with spawning a helper per call like osascript was.
+    """
+    import json
+    import platform_mac
+
+    script = os.path.join(rootdir, "standin_worker.py")
+    open(script, "wb").write(STANDIN_WORKER)
+    log = os.path.join(rootdir, "worker.log")
+    os.environ["WORKER_LOG"] = log
+    os.environ["DROPBOX_URI_OSA_WORKER"] = "%s %s" % (sys.executable, script)
+    platform_mac._worker = None
+    worker = platform_mac.get_worker()
+    try:
+        folder = os.path.dirname(paths[0])
+        items = [path for path in paths if os.path.dirname(path) == folder]
+        platform_mac.explore_paths(folder, items)
+        platform_mac.show_warning_message(u"Share Dropbox", u"Avst\xe4mning \"quoted\"!")
+        if worker.spawned != 1:
+            raise AssertionError("Expected the worker to be started once")
+        entries = [line.split(" ", 2) for line in open(log, "rb").read().splitlines()]
+        requests = [json.loads(entry[2]) for entry in entries]
+        if (len(set(entry[0] for entry in entries)) != 1 or entries[0][1] != "2" or
+            requests != [["reveal"] + items,
+                         ["dialog", u"Share Dropbox", u"Avst\xe4mning \"quoted\"!", 2, 30]]):
+            raise AssertionError("Unexpected worker requests: %r" % entries)
+
+        def spawn_per_call():
+            p = subprocess.Popen([sys.executable, script, platform_mac.FINDER_SELECT_SCRIPT],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            p.communicate(json.dumps(["reveal", paths[0]]) + "\n")
+        report("spawn a helper per call", timeit(spawn_per_call, calls))
+        report("persistent worker call", timeit(
+            lambda: platform_mac.explore_paths(folder, [paths[0]]), calls))
+
+        # Idle shutdown, the next call starts a new worker.
+        worker.idle_timeout = 0.05
+        platform_mac.explore_paths(folder, [paths[0]])
+        time.sleep(0.2)
+        if worker.proc is not None:
+            raise AssertionError("Idle worker wasn't shut down")
+        platform_mac.explore_paths(folder, [paths[0]])
+        # A crashed worker is replaced transparently.
+        worker.proc.kill()
+        worker.proc.wait()
+        platform_mac.explore_paths(folder, [paths[0]])
+        if worker.spawned != 3:
+            raise AssertionError("Expected 3 worker starts, got %d" % worker.spawned)
+        print "%d worker starts for %d calls (idle shutdown and crash included)" % (
+            worker.spawned, len(open(log, "rb").read().splitlines()))
+    finally:
+        worker.stop()
+        platform_mac._worker = None
+        del os.environ["DROPBOX_URI_OSA_WORKER"]
+
+
+STANDIN_DIALOG = """\
+import os, sys, time
+# Stand-in dialog: the user takes a while to click OK.
+time.sleep(float(os.environ["DIALOG_DELAY"]))
+log = open(os.environ["DIALOG_LOG"], "ab")
+log.write("%s\\n" % " ".join(sys.argv[1:3]))
+log.close()
+"""
+
+
+def bench_dialogs(rootdir, paths, runs=5, delay=0.5, clients=5):
+    """
+    Wall-clock time of a launch ending in a warning with dialogs turned off,
+    modal and detached (using a stand-in dialog which takes ``delay``
+    seconds to be dismissed), then check that ``clients`` concurrent
+    launches failing alike show a single dialog, that failing again later
+    shows another one and that a launch which can't claim its dialog
+    (unwritable cache) still shows it.
+    """
+    import dropbox
+    script = os.path.join(rootdir, "standin_dialog.py")
+    open(script, "wb").write(STANDIN_DIALOG)
+    log = os.path.join(rootdir, "dialogs.log")
+    dialogs = os.path.join(os.environ["XDG_CACHE_HOME"], "dropbox-uri", "dialogs")
+    env = dict(os.environ, DROPBOX_URI_PLATFORM="headless", DIALOG_LOG=log,
+               DIALOG_DELAY=str(delay),
+               DROPBOX_URI_DIALOG_COMMAND="%s %s" % (sys.executable, script))
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    unshared = os.path.join(rootdir, "home")
+    devnull = open(os.devnull, "wb")
+
+    def launch(mode):
+        if os.path.exists(dialogs):
+            shutil.rmtree(dialogs)
+        return subprocess.Popen([sys.executable, "main.py", unshared], cwd=cwd, stderr=devnull,
+                                env=dict(env, DROPBOX_URI_DIALOGS=mode))
+    for mode in ("off", "modal", "detached"):
+        report("launch with dialogs %s" % mode, timeit(lambda: launch(mode).wait(), runs))
+    time.sleep(delay * 2)
+
+    if os.path.exists(log):
+        os.remove(log)
+    if os.path.exists(dialogs):
+        shutil.rmtree(dialogs)
+    procs = [subprocess.Popen([sys.executable, "main.py", unshared], cwd=cwd, env=env,
+                              stderr=devnull)
+             for n in range(clients)]
+    for proc in procs:
+        proc.wait()
+    time.sleep(delay * 2)
+    shown = open(log, "rb").read().splitlines()
+    print "%d concurrent failing launches, %d dialog shown" % (clients, len(shown))
+    if len(shown) != 1:
+        raise AssertionError("Expected one dialog, got %r" % shown)
+
+    # A separate user action once the burst is over.
+    time.sleep(dropbox.DIALOG_DEDUP_WINDOW)
+    subprocess.Popen([sys.executable, "main.py", unshared], cwd=cwd, env=env,
+                     stderr=devnull).wait()
+    time.sleep(delay * 2)
+    shown = open(log, "rb").read().splitlines()
+    print "failing launch %.0f s later, %d dialogs shown in total" % (
+        dropbox.DIALOG_DEDUP_WINDOW, len(shown))
+    if len(shown) != 2:
+        raise AssertionError("Expected a second dialog, got %r" % shown)
+
+    os.remove(log)
+    shutil.rmtree(dialogs)
+    open(dialogs, "wb").close()
+    try:
+        subprocess.Popen([sys.executable, "main.py", unshared], cwd=cwd, env=env,
+                         stderr=devnull).wait()
+        time.sleep(delay * 2)
+    finally:
+        os.remove(dialogs)
+        devnull.close()
+    shown = open(log, "rb").read().splitlines() if os.path.exists(log) else []
+    print "failing launch with an unwritable cache, %d dialog shown" % len(shown)
+    if len(shown) != 1:
+        raise AssertionError("Expected one dialog, got %r" % shown)
+
+
+BUNDLE_PROBE = """\
+import json, os, sys
+import dropbox
+def write(html, text):
+    print json.dumps(text.splitlines())
+dropbox.platform.set_handler("clipboard", write)
+dropbox.main(os.getcwd().decode("utf-8"), False, None)
+"""
+
+
+def bench_bundle(rootdir, paths, sizes=(10, 1000, 10000)):
+    """
+    Size and speed of encoding and decoding bundle URIs of ``sizes`` items
+    against one plain URI per item, then link a selection via main.py and
+    open the resulting links again (recording platform backend) to check
+    that one launch reveals every item with one action per folder.
+    """
+    import json
+    import dropbox
+    folder = u"/Projects/Avst\xe4mning 2011/Final"
+    for count in sizes:
+        items = [u"%s/Group %d/IMG_%05d.jpg" % (folder, n // 500, n) for n in range(count)]
+        uris = [dropbox.encode_dropbox_uri(u"1001", item) for item in items]
+        bundles = dropbox.encode_dropbox_bundle(u"1001", items)
+        print "%5d items: %d URIs (%d KB) vs %d bundles (%d KB, longest %d chars)" % (
+            count, len(uris), sum(map(len, uris)) // 1024, len(bundles),
+            sum(len(data) for (data, rel_paths) in bundles) // 1024,
+            max(len(data) for (data, rel_paths) in bundles))
+        decoded = []
+        for (data, rel_paths) in bundles:
+            if not dropbox.is_valid_dropbox_uri(dropbox.PROTOCOL_URI_PREFIX + data):
+                raise AssertionError("Bundle URI rejected")
+            decoded.extend(dropbox.decode_dropbox_bundle(data)[1])
+        if sorted(decoded) != sorted(items):
+            raise AssertionError("Bundles of %d items don't round-trip" % count)
+        repeat = max(1, 1000 // count)
+        report("encode %d items (URIs)" % count,
+               timeit(lambda: [dropbox.encode_dropbox_uri(u"1001", item) for item in items],
+                      repeat))
+        report("encode %d items (bundles)" % count,
+               timeit(lambda: dropbox.encode_dropbox_bundle(u"1001", items), repeat))
+        report("decode %d items (URIs)" % count,
+               timeit(lambda: [dropbox.decode_dropbox_uri(data) for data in uris], repeat))
+        report("decode %d items (bundles)" % count,
+               timeit(lambda: [dropbox.decode_dropbox_bundle(data) for (data, p) in bundles],
+                      repeat))
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    selection = paths[:200]
+    output = subprocess.Popen([sys.executable, "-c", BUNDLE_PROBE] +
+                              [path.encode("utf-8") for path in selection],
+                              cwd=cwd, stdout=subprocess.PIPE).communicate()[0]
+    links = json.loads(output)
+    uris = [dropbox.PROTOCOL_URI_PREFIX + link[len(dropbox.SHARE_URL_PREFIX):] for link in links]
+    env = dict(os.environ, DROPBOX_URI_PLATFORM="recording")
+    explored = []
+    for uri in uris:
+        probe = EXPLORE_RECORDER % uri
+        output = subprocess.Popen([sys.executable, "-c", probe], cwd=cwd, env=env,
+                                  stdout=subprocess.PIPE).communicate()[0]
+        explored.extend(json.loads(output))
+    items = sum(len(filenames) for filenames in explored)
+    folders = len(set(os.path.dirname(path) for path in selection))
+    print "%d items in %d folders: %d links, %d launches, %d reveal actions" % (
+        len(selection), folders, len(links), len(uris), len(explored))
+    if (set(filename for filenames in explored for filename in filenames) != set(selection)
+        or items != len(selection) or len(explored) != folders):
+        raise AssertionError("Expected one reveal per folder covering the selection")
+
+
+EXPLORE_RECORDER = """\
+import json, os, sys
+import dropbox
+sys.argv = ["main.py", %r]
+dropbox.main(os.getcwd().decode("utf-8"), False, "main.py")
+print json.dumps([args[1] for (name, args) in dropbox.platform.calls if name == "explore_paths"])
+"""
+
+
+# Gzipped size of jQuery 1.6.2 (minified) which open.html loaded from the
+# Google CDN before the build step (approximate, we measure offline).
+# Link path the htaccess rewrites to open.html (like any sharedropbox.com link).
+STATIC_LINK = "/AuoHL0xldmVsIDA"
+STATIC_REF_RE = re.compile(r"""<script[^>]*\ssrc=["']([^"']+)["']"""
+                           r"""|<link[^>]*\shref=["']([^"']+\.css)["']""")
+
+
+def serve_static(root, negotiate):
+    """
+    Serve folder ``root`` on a local port like htaccess does on the web host:
+    links are rewritten to open.html and, if ``negotiate``, precompressed
+    variants are served to clients accepting them. Returns the server, shut
+    it down when done.
+    """
+    import threading
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+    class Handler(SimpleHTTPRequestHandler):
+        encoding = None
+
+        def translate_path(self, path):
+            path = path.split("?", 1)[0]
+            if re.match(r"^/[0-9a-zA-Z_\-]+$", path):
+                path = "/open.html"
+            filename = os.path.join(root, *path.lstrip("/").split("/"))
+            accepted = self.headers.get("Accept-Encoding", "")
+            if negotiate and re.search(r"\.(html|css|js|ico)$", filename):
+                for (encoding, extension) in (("br", ".br"), ("gzip", ".gz")):
+                    if encoding in accepted and os.path.isfile(filename + extension):
+                        self.encoding = encoding
+                        return filename + extension
+            return filename
+
+        def guess_type(self, path):
+            if self.encoding:
+                path = os.path.splitext(path)[0]
+            return SimpleHTTPRequestHandler.guess_type(self, path)
+
+        def end_headers(self):
+            if self.encoding:
+                self.send_header("Content-Encoding", self.encoding)
+            SimpleHTTPRequestHandler.end_headers(self)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def fetch_page(server, path, accept):
+    """
+    Fetch ``path`` from ``server`` followed by the scripts and stylesheets
+    it loads from the same host (one at a time, like blocking scripts).
+    Returns (decoded page, [(path, bytes received)], [external references]).
+    """
+    import httplib, urlparse, zlib
+    (host, port) = server.server_address
+    transfers, external, page = [], [], None
+    queue = [path]
+    while queue:
+        url = queue.pop(0)
+        conn = httplib.HTTPConnection(host, port)
+        try:
+            conn.request("GET", url, headers={"Accept-Encoding": accept})
+            response = conn.getresponse()
+            body = response.read()
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise AssertionError("GET %s: %d" % (url, response.status))
+        transfers.append((url, len(body)))
+        if page is None:
+            encoding = response.getheader("Content-Encoding")
+            if encoding == "gzip":
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            elif encoding == "br":
+                import brotli
+                body = brotli.decompress(body)
+            page = body
+            for ref in ["".join(match) for match in STATIC_REF_RE.findall(page)]:
+                if "//" in ref:
+                    external.append(ref)
+                else:
+                    queue.append(urlparse.urljoin(url, ref))
+    return page, transfers, external
+
+
+def bench_static(rootdir, paths):
+    """
+    Serve the source tree and the buildstatic.py output from a local HTTP
+    server and report the bytes received and the time it took to fetch the
+    landing page of a link (until its redirect script can run) and the
+    front page with everything they load from the site, plus checks of the
+    build output. External scripts (CDN) aren't fetched, only listed.
+    """
+    import buildstatic
+    output = os.path.join(rootdir, "site")
+    t = time.time()
+    sizes = buildstatic.build(output)
+    print "built %d files in %.1f ms" % (len(sizes), (time.time() - t) * 1000.0)
+    accept = "br, gzip" if buildstatic.brotli is not None else "gzip"
+
+    served = {}
+    for (label, root, negotiate) in (("source", buildstatic.SOURCE_DIR, False),
+                                     ("built", output, True)):
+        server = serve_static(root, negotiate)
+        try:
+            for (page, path) in (("landing page", STATIC_LINK), ("front page", "/index.html")):
+                (text, transfers, external) = fetch_page(server, path, accept)
+                served[(label, page)] = text
+                print "%-6s %-12s %6d bytes in %d requests: %s%s" % (
+                    label, page, sum(size for (url, size) in transfers), len(transfers),
+                    ", ".join("%s %d" % transfer for transfer in transfers),
+                    " (external, not fetched: %s)" % ", ".join(external) if external else "")
+                report("%s %s (local HTTP)" % (label, page),
+                       timeit(lambda: fetch_page(server, path, accept)))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    built = open(os.path.join(output, "open.html"), "rb").read()
+    if served[("built", "landing page")] != built:
+        raise AssertionError("Served landing page doesn't match open.html")
+    if "<script src" in built or "jquery" in built.lower():
+        raise AssertionError("open.html still loads external scripts")
+    import gzip
+    if gzip.GzipFile(os.path.join(output, "open.html.gz")).read() != built:
+        raise AssertionError("open.html.gz doesn't match open.html")
+    index = open(os.path.join(output, "index.html"), "rb").read()
+    for ref in ("js/browser.js", "css/jquery.lightbox-0.5.css"):
+        if ref in index:
+            raise AssertionError("index.html still refers to %s" % ref)
+    for name in ("js/jquery.lightbox-0.5.min.js", "images/lightbox-blank.gif"):
+        if name not in sizes or buildstatic.fingerprint(name, open(os.path.join(
+                buildstatic.SOURCE_DIR, name), "rb").read()) not in sizes:
+            raise AssertionError("Missing plain or fingerprinted copy of %s" % name)
+
+
+BENCHMARKS = [
+    ("phases", bench_phases),
+    ("startup", bench_startup),
+    ("daemon", bench_daemon),
+    ("index", bench_index),
+    ("snapshot", bench_snapshot),
+    ("stress", bench_stress),
+    ("lazy", bench_lazy),
+    ("bulk", bench_bulk),
+    ("treeindex", bench_treeindex),
+    ("explore", bench_explore),
+    ("rtf", bench_rtf),
+    ("linkserver", bench_linkserver),
+    ("uri", bench_uri),
+    ("audit", bench_audit),
+    ("logging", bench_logging),
+    ("timing", bench_timing),
+    ("fileindex", bench_fileindex),
+    ("args", bench_args),
+    ("burst", bench_burst),
+    ("resolver", bench_resolver),
+    ("osaworker", bench_osaworker),
+    ("dialogs", bench_dialogs),
+    ("bundle", bench_bundle),
+    ("static", bench_static),
+]
+
+
+def main(argv):
+    import optparse
+    global current
+    parser = optparse.OptionParser(usage="%prog [options] [BENCHMARK ...]")
+    parser.add_option("--json", metavar="FILE", help="write results as JSON to FILE")
+    parser.add_option("--mounts", type="int", default=50, help="shared folders in fixtures")
+    parser.add_option("--depth", type="int", default=3, help="folder depth of shared folders")
+    parser.add_option("--files", type="int", default=5, help="files per folder level")
+    (options, args) = parser.parse_args(argv[1:])
+    names = [name for (name, func) in BENCHMARKS]
+    for name in args:
+        if name not in names:
+            parser.error("unknown benchmark %s (choose from %s)" % (name, ", ".join(names)))
+    selected = args or names
+    rootdir = tempfile.mkdtemp(prefix="dropbox-uri-bench-")
+    try:
+        paths = create_fixtures(rootdir, options.mounts, options.depth, options.files)
+        use_fixtures(rootdir)
+        for (name, func) in BENCHMARKS:
+            if name in selected:
+                print "== %s" % name
+                current = name
+                func(rootdir, paths)
+    finally:
+        shutil.rmtree(rootdir)
+    if options.json:
+        write_results(options.json, options)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+
+###########################################################################
+# The End.
+###########################################################################
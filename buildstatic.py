@@ -0,0 +1,285 @@
+import os, sys
+import gzip
+import hashlib
+import optparse
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+###########################################################################
+# Build the sharedropbox.com web front end (static/) for deployment.
+###########################################################################
+#
+# Copies static/ to the output folder and on the way:
+#
+#  - minifies the inline <script> and <style> blocks of every page and
+#    inlines small local scripts so that pages need no extra requests,
+#  - adds a fingerprinted copy (name.<hash>.ext) of every other asset and
+#    points the pages at it, see htaccess for their far-future cache headers
+#    (the plain copies are kept for references made by scripts),
+#  - writes gzip (and brotli, if the brotli module is installed) compressed
+#    variants of text files which htaccess serves to clients accepting them.
+#
+#   python buildstatic.py [-o build/static]
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DEFAULT_OUTPUT = os.path.join("build", "static")
+
+# Local scripts up to this size are inlined into the pages using them.
+INLINE_SCRIPT_LIMIT = 4096
+FINGERPRINT_SIZE = 8
+COMPRESSED_EXTENSIONS = (".html", ".css", ".js", ".ico")
+MIN_COMPRESS_SIZE = 256
+
+
+###########################################################################
+# Minification.
+###########################################################################
+#
+# Deliberately conservative, only comments and redundant whitespace are
+# removed (newlines are kept wherever automatic semicolon insertion might
+# depend on them), names and code stay as they are.
+
+JS_TOKEN_RE = re.compile(r'''("(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')'''
+                         r'''|(/\*.*?\*/|//[^\n]*)|(\s+)|(/)|([^"'/\s]+)''', re.S)
+JS_REGEX_RE = re.compile(r"/(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/[a-z]*")
+JS_PUNCTUATION = "{}()[];,=:<>!&|?*%^~."
+# Characters after which a "/" starts a regular expression (not a division).
+JS_REGEX_PREFIX = "(,=:[!&|?{};+-*%<>~^"
+JS_CONTINUATION_BEFORE = "{;,(=:[!&|?+-*%<>"
+JS_CONTINUATION_AFTER = "})],;.?:=&|"
+
+
+def minify_js(source):
+    """
+    Return ``source`` without comments and redundant whitespace.
+    """
+    out = []
+    pending = None  # Whitespace (" " or "\n") seen since the last token.
+    pos = 0
+    while pos < len(source):
+        match = JS_TOKEN_RE.match(source, pos)
+        (string, comment, space, slash, other) = match.groups()
+        token = match.group(0)
+        if comment or space:
+            newline = "\n" in token or token.startswith("//")
+            pending = "\n" if newline or pending == "\n" else " "
+            pos = match.end()
+            continue
+        if slash:
+            last = "".join(out).rstrip()[-1:]
+            regex = JS_REGEX_RE.match(source, pos)
+            if regex and (not last or last in JS_REGEX_PREFIX or
+                          "".join(out).endswith(("return", "typeof"))):
+                token = regex.group(0)
+        if pending and out:
+            prev, next = out[-1][-1], token[0]
+            if pending == "\n":
+                if not (prev in JS_CONTINUATION_BEFORE or next in JS_CONTINUATION_AFTER):
+                    out.append("\n")
+            elif prev in "+-" and next in "+-" or prev == "/" or next == "/":
+                out.append(" ")
+            elif not (prev in JS_PUNCTUATION or next in JS_PUNCTUATION or
+                      prev in "+-" or next in "+-"):
+                out.append(" ")
+        pending = None
+        out.append(token)
+        pos = pos + len(token)
+    return "".join(out)
+
+
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+CSS_SPACE_RE = re.compile(r"\s*([{};,>])\s*|(:)\s+|\s+")
+
+
+def minify_css(source):
+    """
+    Return ``source`` without comments and redundant whitespace.
+    """
+    source = CSS_COMMENT_RE.sub("", source)
+    source = CSS_SPACE_RE.sub(lambda m: m.group(1) or m.group(2) or " ", source)
+    return source.replace(";}", "}").strip()
+
+
+HTML_BLOCK_RE = re.compile(r"(<script\b[^>]*>)(.*?)(</script>)|(<style\b[^>]*>)(.*?)(</style>)"
+                           r"|(<pre\b.*?</pre>)", re.S | re.I)
+HTML_SPACE_RE = re.compile(r"\s+")
+
+
+def minify_html(source):
+    """
+    Collapse whitespace of ``source`` (except in <pre>) and minify its
+    inline scripts and style sheets.
+    """
+    def collapse(text):
+        return HTML_SPACE_RE.sub(lambda m: "\n" if "\n" in m.group(0) else " ", text)
+    chunks, pos = [], 0
+    for match in HTML_BLOCK_RE.finditer(source):
+        chunks.append(collapse(source[pos:match.start()]))
+        if match.group(1):
+            chunks.append(match.group(1) + minify_js(match.group(2)) + match.group(3))
+        elif match.group(4):
+            chunks.append(match.group(4) + minify_css(match.group(5)) + match.group(6))
+        else:
+            chunks.append(match.group(7))
+        pos = match.end()
+    chunks.append(collapse(source[pos:]))
+    return "".join(chunks).strip() + "\n"
+
+
+###########################################################################
+# Build.
+###########################################################################
+
+LOCAL_SCRIPT_RE = re.compile(r"""<script\b[^>]*\bsrc=["']([^"':]+)["'][^>]*>\s*</script>""", re.I)
+ASSET_REF_RE = re.compile(r"""\b(src|href)=(["'])([^"'#?:]+)\2""", re.I)
+CSS_URL_RE = re.compile(r"""url\(\s*(["']?)([^"')#?:]+)\1\s*\)""")
+
+
+def read(filename):
+    f = open(filename, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def write(filename, data):
+    dirname = os.path.dirname(filename)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    f = open(filename, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def fingerprint(name, data):
+    """
+    Return ``name`` with the hash of its content ``data`` (name.<hash>.ext).
+    """
+    base, ext = os.path.splitext(name)
+    return "%s.%s%s" % (base, hashlib.sha1(data).hexdigest()[:FINGERPRINT_SIZE], ext)
+
+
+def gzip_data(data):
+    import cStringIO
+    buf = cStringIO.StringIO()
+    # Fixed mtime so that rebuilding unchanged files gives identical output.
+    f = gzip.GzipFile(filename="", mode="wb", compresslevel=9, fileobj=buf, mtime=0)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return buf.getvalue()
+
+
+def list_files(rootdir):
+    """
+    Return paths (relative to ``rootdir``, "/" separated) of all files.
+    """
+    names = []
+    for (dirpath, dirnames, filenames) in os.walk(rootdir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.relpath(os.path.join(dirpath, filename), rootdir)
+            names.append(path.replace(os.sep, "/"))
+    return names
+
+
+def build_page(name, html, files, assets):
+    """
+    Return page ``name`` with small local scripts inlined, references to
+    fingerprinted ``assets`` rewritten and minified.
+    """
+    folder = os.path.dirname(name)
+
+    def resolve(ref):
+        return os.path.normpath(os.path.join(folder, ref)).replace(os.sep, "/")
+
+    def inline(match):
+        path = resolve(match.group(1))
+        if path in files and len(files[path]) <= INLINE_SCRIPT_LIMIT:
+            return "<script>%s</script>" % files[path].replace("</script", "<\\/script")
+        return match.group(0)
+
+    def rewrite(match):
+        (attr, quote, ref) = match.groups()
+        path = resolve(ref)
+        if path not in assets:
+            return match.group(0)
+        return "%s=%s%s%s" % (attr, quote, ref[:len(ref) - len(os.path.basename(ref))] +
+                              os.path.basename(assets[path]), quote)
+    html = LOCAL_SCRIPT_RE.sub(inline, html)
+    html = ASSET_REF_RE.sub(rewrite, html)
+    return minify_html(html)
+
+
+def build(output, source=SOURCE_DIR):
+    """
+    Build site ``source`` into folder ``output`` (replaced), returns dict of
+    output filename (relative) to size in bytes.
+    """
+    files = dict((name, read(os.path.join(source, name))) for name in list_files(source))
+    pages = sorted(name for name in files if name.endswith(".html"))
+    outputs = {}
+
+    # Fingerprint style sheets last, their content refers to other assets.
+    assets = {}
+    for name in sorted(files, key=lambda name: (name.endswith(".css"), name)):
+        if name in pages or name == "htaccess":
+            continue
+        data = files[name]
+        if name.endswith(".css"):
+            folder = os.path.dirname(name)
+
+            def rewrite_url(match):
+                ref = match.group(2)
+                path = os.path.normpath(os.path.join(folder, ref)).replace(os.sep, "/")
+                if path not in assets:
+                    return match.group(0)
+                return "url(%s)" % (ref[:len(ref) - len(os.path.basename(ref))] +
+                                    os.path.basename(assets[path]))
+            data = minify_css(CSS_URL_RE.sub(rewrite_url, data))
+        outputs[name] = outputs[assets.setdefault(name, fingerprint(name, data))] = data
+
+    for name in pages:
+        outputs[name] = build_page(name, files[name], files, assets)
+    outputs[".htaccess"] = files["htaccess"]
+
+    for name in list(outputs):
+        if name.endswith(COMPRESSED_EXTENSIONS) and len(outputs[name]) >= MIN_COMPRESS_SIZE:
+            outputs[name + ".gz"] = gzip_data(outputs[name])
+            if brotli is not None:
+                outputs[name + ".br"] = brotli.compress(outputs[name])
+
+    if os.path.exists(output):
+        shutil.rmtree(output)
+    for (name, data) in outputs.items():
+        write(os.path.join(output, *name.split("/")), data)
+    return dict((name, len(data)) for (name, data) in outputs.items())
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-o", "--output", default=DEFAULT_OUTPUT,
+                      help="folder to build the site into (replaced)")
+    (options, args) = parser.parse_args(argv[1:])
+    sizes = build(options.output)
+    print "Built %d files (%d KB) into %s%s" % (
+        len(sizes), sum(sizes.values()) // 1024, options.output,
+        "" if brotli is not None else " (no brotli module, gzip variants only)")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+
+###########################################################################
+# The End.
+###########################################################################
@@ -0,0 +1,139 @@
+import os, sys
+import csv
+import itertools
+import json
+import optparse
+
+import dropbox
+
+###########################################################################
+# Streaming bulk encoding of Dropbox URIs (for scripts).
+###########################################################################
+#
+# Reads paths (newline or NUL delimited) from stdin or a file and writes one
+# JSON Lines or CSV row per path to stdout as soon as it has been mapped.
+# Items which can't be linked are reported in the "error" column instead of
+# aborting the whole batch. Example:
+#
+#   find ~/Dropbox/Shared/Deliverables -print0 | python bulk.py -0 --format csv
+
+READ_CHUNK_SIZE = 64 * 1024
+
+CSV_COLUMNS = ["path", "uri", "url", "error"]
+
+
+def iter_paths(f, delimiter="\n"):
+    """
+    Yield raw (undecoded) paths from file object ``f`` split on ``delimiter``
+    without reading the whole input into memory.
+    """
+    if delimiter == "\n":
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line:
+                yield line
+        return
+    pending = ""
+    while True:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        items = (pending + chunk).split(delimiter)
+        pending = items.pop()
+        for item in items:
+            if item:
+                yield item
+    if pending:
+        yield pending
+
+
+def normalize_path(path):
+    """
+    Same as os.path.abspath(os.path.normpath(path)) but skips the (costly)
+    normalization for paths which are obviously normalized already.
+    """
+    if (os.path.isabs(path) and not path.endswith(os.sep)
+        and (os.sep + ".") not in path and (os.sep + os.sep) not in path
+        and not (os.altsep and os.altsep in path)):
+        return path
+    return os.path.abspath(os.path.normpath(path))
+
+
+def iter_links(index, paths, encoding=None):
+    """
+    Map raw ``paths`` via shared folder ``index`` and yield (path, uri, error)
+    tuples, ``uri`` is None for items which couldn't be linked.
+    """
+    encoding = encoding or sys.getfilesystemencoding() or "utf-8"
+
+    def decode(paths):
+        for raw in paths:
+            try:
+                yield (normalize_path(raw.decode(encoding)), None)
+            except UnicodeDecodeError, e:
+                yield (raw.decode(encoding, "replace"), "Undecodable path: %s" % e)
+
+    items, lookups = itertools.tee(decode(paths))
+    matches = index.find_paths(path if error is None else u"" for (path, error) in lookups)
+    encode = dropbox.encode_dropbox_uri
+    for ((path, error), match) in itertools.izip(items, matches):
+        if error:
+            yield (path, None, error)
+        elif match is None:
+            yield (path, None, "Not located in a shared folder")
+        else:
+            yield (path, encode(*match), None)
+
+
+def write_jsonl(out, links):
+    write, escape = out.write, json.encoder.encode_basestring_ascii
+    for (path, uri, error) in links:
+        if uri:
+            write('{"path": %s, "uri": "%s", "url": "%s%s", "error": null}\n' % (
+                escape(path), uri, dropbox.SHARE_URL_PREFIX, uri))
+        else:
+            write('{"path": %s, "uri": null, "url": null, "error": %s}\n' % (
+                escape(path), escape(error)))
+
+
+def write_csv(out, links):
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+    for (path, uri, error) in links:
+        url = dropbox.SHARE_URL_PREFIX + uri if uri else ""
+        writer.writerow([path.encode("utf-8"), uri or "", url, error or ""])
+
+
+WRITERS = {
+    "jsonl" : write_jsonl,
+    "csv"   : write_csv,
+}
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [options] [FILE]")
+    parser.add_option("-0", "--null", action="store_true", default=False,
+                      help="paths are NUL delimited (find -print0)")
+    parser.add_option("-f", "--format", choices=sorted(WRITERS), default="jsonl",
+                      help="output format: jsonl (default) or csv")
+    (options, args) = parser.parse_args(argv[1:])
+
+    f = open(args[0], "rb") if args else sys.stdin
+    try:
+        # Always materialize the mount table, batches are large enough for
+        # the in-memory index to beat per item SQLite queries.
+        index = dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+        paths = iter_paths(f, "\0" if options.null else "\n")
+        WRITERS[options.format](sys.stdout, iter_links(index, paths))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+
+###########################################################################
+# The End.
+###########################################################################
@@ -0,0 +1,213 @@
+import os, sys
+import logging
+import threading
+import time
+
+import daemon
+from backend import platform
+
+###########################################################################
+# Burst coalescing (single-instance mode for multi-item selections).
+###########################################################################
+#
+# Explorer's "Send To" menu and the Automator service may start a separate
+# process for every few items of a single selection, each of which would
+# overwrite the clipboard written by the others. Instead the first process
+# takes a lock and becomes the leader: it listens on a local socket and
+# collects the arguments of every process launched until none arrived for
+# the debounce window, the others forward their arguments and exit. The
+# leader then links everything in one go and writes the clipboard once, and
+# only then releases the lock (launches arriving in the meantime wait for
+# it instead of leading a burst whose clipboard write ours would overwrite).
+
+# Followers give up and run on their own after this many seconds.
+FORWARD_TIMEOUT = 2.0
+# Debounce windows are never extended beyond this many seconds.
+MAX_WINDOW = 1.0
+RETRY_INTERVAL = 0.01
+
+
+def get_burst_address():
+    return platform.get_daemon_address() + "-burst"
+
+
+def acquire_lock(filename):
+    """
+    Return an open ``filename`` locked exclusively by this process (until
+    closed) or None if another process holds the lock.
+    """
+    dirname = os.path.dirname(filename)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    f = open(filename, "a+b")
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        f.close()
+        return None
+    return f
+
+
+def connect(address):
+    if sys.platform == "win32":
+        from multiprocessing.connection import Client
+        return Client(address)
+    return daemon._connect_unix(address)
+
+
+def forward(args):
+    """
+    Hand ``args`` to the leader, returns True once acknowledged.
+    """
+    import socket
+    try:
+        conn = connect(get_burst_address())
+    except (IOError, OSError, socket.error):
+        return False
+    try:
+        daemon.send_message(conn, args)
+        return conn.poll(FORWARD_TIMEOUT) and daemon.recv_message(conn) == "ok"
+    except (IOError, OSError, EOFError, socket.error):
+        return False
+    finally:
+        conn.close()
+
+
+def is_arguments(args):
+    """
+    Return True if ``args`` (received from a follower) is a list of
+    command-line arguments.
+    """
+    return isinstance(args, list) and all(isinstance(arg, unicode) for arg in args)
+
+
+class Collector(object):
+    """
+    Accepts the arguments forwarded by followers on ``listener`` in a
+    background thread until stopped.
+    """
+    def __init__(self, listener):
+        self.listener = listener
+        self.bursts = []
+        self.arrived = threading.Event()
+        self.thread = threading.Thread(target=self.accept, name="BurstCollector")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def accept(self):
+        while True:
+            conn = self.listener.accept()
+            try:
+                args = daemon.recv_message(conn)
+                if args is None:
+                    break
+                if not is_arguments(args):
+                    # Not from one of our followers, don't acknowledge it.
+                    logging.warning("Ignoring malformed burst arguments: %r", args)
+                    continue
+                self.bursts.append(args)
+                daemon.send_message(conn, "ok")
+                self.arrived.set()
+            except (IOError, OSError, EOFError):
+                logging.exception("Burst follower connection failed")
+            finally:
+                conn.close()
+
+    def stop(self):
+        """
+        Stop accepting (later followers notice the missing acknowledgement
+        and retry) and return the list of forwarded argument lists.
+        """
+        conn = connect(get_burst_address())
+        try:
+            daemon.send_message(conn, None)
+        finally:
+            conn.close()
+        self.thread.join()
+        return self.bursts
+
+
+def lead(args, window):
+    """
+    Collect arguments forwarded until none arrived for ``window`` seconds,
+    returns ``args`` followed by the forwarded ones in order of arrival.
+    """
+    from multiprocessing.connection import Listener
+    address = get_burst_address()
+    if sys.platform != "win32":
+        if os.path.exists(address):
+            # Left behind by a crashed leader, we hold the lock.
+            os.unlink(address)
+        umask = os.umask(0077)
+        try:
+            listener = Listener(address, backlog=daemon.LISTEN_BACKLOG)
+        finally:
+            os.umask(umask)
+    else:
+        listener = Listener(address, backlog=daemon.LISTEN_BACKLOG)
+    try:
+        collector = Collector(listener)
+        deadline = time.time() + MAX_WINDOW
+        while collector.arrived.wait(min(window, max(0.0, deadline - time.time()))):
+            collector.arrived.clear()
+            if time.time() >= deadline:
+                break
+        bursts = collector.stop()
+    finally:
+        listener.close()
+    logging.debug("Coalesced %d launches", len(bursts) + 1)
+    merged = list(args)
+    for burst in bursts:
+        merged.extend(burst)
+    return merged
+
+
+class Burst(object):
+    """
+    Context manager holding the burst lock (if any) of the leader of a burst
+    of launches, yields all of their arguments ``args``.
+    """
+    def __init__(self, args, lock=None):
+        self.args = args
+        self.lock = lock
+
+    def __enter__(self):
+        return self.args
+
+    def __exit__(self, *exc_info):
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+
+
+def coalesce(args, window):
+    """
+    Return a Burst with all arguments of the burst of launches ``args``
+    belongs to if this process is the leader or None if they were forwarded
+    to the leader (this process should then exit). The leader must finish
+    linking them (writing the clipboard) before exiting the Burst.
+    """
+    deadline = time.time() + FORWARD_TIMEOUT
+    while time.time() < deadline:
+        lock = acquire_lock(platform.get_cache_file("burst.lock"))
+        if lock is not None:
+            try:
+                return Burst(lead(args, window), lock)
+            except:
+                lock.close()
+                raise
+        if forward(args):
+            return None
+        time.sleep(RETRY_INTERVAL)
+    logging.debug("Burst leader unavailable, going solo")
+    return Burst(args)
+
+
+###########################################################################
+# The End.
+###########################################################################
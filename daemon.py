@@ -0,0 +1,272 @@
+import os, sys
+import logging
+import threading
+import time
+
+from backend import platform
+
+###########################################################################
+# Resolver daemon (opt-in) which keeps the mount table in memory.
+###########################################################################
+#
+# Besides serving lookups to dropbox.get_shared_folders() the daemon runs
+# whole launches handed over by main.py, which then needs neither the URI
+# engine (dropbox.py) nor any logging or platform setup. Importing this module
+# doesn't import dropbox.py either, only the daemon itself needs it.
+#
+# Messages are JSON (never pickles, which would let whoever squats on the
+# well-known socket or pipe name run code in our process) sent as length
+# prefixed frames of multiprocessing.connection.
+
+CONNECT_TIMEOUT = 0.25
+CONNECT_RETRY_INTERVAL = 0.01
+REQUEST_TIMEOUT = 5.0
+LISTEN_BACKLOG = 128
+
+
+def send_message(conn, message):
+    import json
+    conn.send_bytes(json.dumps(message))
+
+
+def recv_message(conn):
+    """
+    Return the next message received on ``conn``, raises EOFError if the
+    peer closed the connection and IOError if the message isn't JSON.
+    """
+    import json
+    try:
+        return json.loads(conn.recv_bytes())
+    except ValueError, e:
+        raise IOError("Malformed message: %s" % e)
+
+
+class Launches(object):
+    """
+    Runs the launches (command-line arguments) handed over by main.py
+    against the daemon's ``resolver`` in the background, warnings and errors
+    are shown as dialogs by the daemon. Link creation is coalesced by
+    burst.coalesce() just like in-process launches do, which therefore join
+    the bursts collected by the daemon (and vice versa), and launches are
+    linked one at a time so that their clipboard writes can't interleave.
+    """
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self.linking = threading.Lock()
+
+    def link(self, args):
+        """
+        Link ``args`` and add the timings of the launch to the histograms
+        (like dropbox.main() does for in-process launches).
+        """
+        import dropbox, timing
+        with self.linking:
+            with timing.span("total"):
+                dropbox.report_errors(dropbox.link_arguments, args, self.resolver)
+            try:
+                timing.save(platform.get_cache_file("timings.hist"))
+            except EnvironmentError:
+                logging.exception("Could not save timings")
+
+    def run(self, args):
+        import dropbox, burst
+        window = dropbox.get_burst_window(args)
+        if not window:
+            self.link(args)
+            return
+        leader = burst.coalesce(args, window)
+        if leader is None:
+            return
+        # Keep the burst lock until the clipboard has been written.
+        with leader as args:
+            logging.debug("Linking a burst of %d arguments", len(args))
+            self.link(args)
+
+    def start(self, args):
+        """
+        Run the launch ``args`` in a background thread.
+        """
+        t = threading.Thread(target=self.run, args=(args,), name="Launch")
+        t.daemon = True
+        t.start()
+
+
+def handle_request(state, request, launches=None):
+    """
+    Dispatch a single ``(command, args)`` request and return a ``(status,
+    result)`` reply. Warnings are passed back to the client verbatim so they
+    can be displayed via UI on the client end.
+    """
+    import dropbox
+    command, args = request
+    try:
+        if command == "ping":
+            return ("ok", None)
+        if command == "encode":
+            return ("ok", state.get_shared_folders().map_paths(args))
+        if command == "resolve":
+            return ("ok", state.get_shared_folders().resolve_uris(args))
+        if command == "run" and launches is not None:
+            # Acknowledged as soon as accepted, the launch may take a while
+            # (e.g. waiting for its burst, refreshing a file index).
+            launches.start(args)
+            return ("ok", None)
+        return ("error", "Unknown command: %s" % command)
+    except (dropbox.DropboxWarning, ValueError), e:
+        return ("warning", str(e))
+
+
+def handle_connection(state, conn, launches=None):
+    try:
+        while True:
+            try:
+                request = recv_message(conn)
+            except EOFError:
+                break
+            send_message(conn, handle_request(state, request, launches))
+    except:
+        logging.exception("Resolver daemon connection failed")
+    finally:
+        conn.close()
+
+
+def serve(address=None):
+    """
+    Run the resolver daemon listening on ``address`` (defaults to the platform
+    specific local socket or named pipe) until interrupted.
+    """
+    address = address or platform.get_daemon_address()
+    if sys.platform != "win32":
+        if os.path.exists(address):
+            if connect(address) is not None:
+                raise RuntimeError("Resolver daemon already running: %s" % address)
+            os.unlink(address)
+        os.umask(0077)
+    from multiprocessing.connection import Listener
+    import dropbox
+    state = dropbox.DropboxURIResolver()
+    launches = Launches(state)
+    listener = Listener(address, backlog=LISTEN_BACKLOG)
+    logging.debug("Resolver daemon listening on %s", address)
+    try:
+        while True:
+            conn = listener.accept()
+            t = threading.Thread(target=handle_connection, args=(state, conn, launches))
+            t.daemon = True
+            t.start()
+    finally:
+        listener.close()
+
+
+###########################################################################
+# Thin client used by dropbox.get_shared_folders() and main.py.
+###########################################################################
+
+class DaemonClient(object):
+    """
+    Proxy with the same interface as dropbox.SharedFolderIndex which forwards
+    all lookups to a running resolver daemon.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def request(self, command, args=None):
+        send_message(self.conn, (command, args))
+        if not self.conn.poll(REQUEST_TIMEOUT):
+            raise RuntimeError("Resolver daemon request timed out")
+        status, result = recv_message(self.conn)
+        if status == "warning":
+            import dropbox
+            raise dropbox.DropboxWarning(result)
+        if status != "ok":
+            raise RuntimeError(result)
+        return result
+
+    def map_paths(self, paths):
+        if not paths:
+            return []
+        return self.request("encode", paths)
+
+    def resolve_uris(self, uris):
+        if not uris:
+            return []
+        return self.request("resolve", uris)
+
+    def run(self, args):
+        """
+        Have the daemon run a launch with command-line arguments ``args``,
+        returns False if the daemon didn't get it or doesn't run launches.
+        Once the launch has been sent it must not be run by anybody else
+        (even if this raises), the daemon may have accepted it anyway.
+        """
+        try:
+            send_message(self.conn, ("run", args))
+        except (IOError, OSError), e:
+            logging.getLogger().debug("Resolver daemon unreachable: %s", e)
+            return False
+        if not self.conn.poll(REQUEST_TIMEOUT):
+            raise RuntimeError("Resolver daemon request timed out")
+        status, result = recv_message(self.conn)
+        if status != "ok":
+            logging.getLogger().debug("Resolver daemon refused launch: %s", result)
+            return False
+        return True
+
+    def close(self):
+        self.conn.close()
+
+
+def _connect_unix(address):
+    # Connect by hand, multiprocessing.connection.Client() keeps on retrying
+    # for 20s against stale sockets left behind by a crashed daemon. A full
+    # listen backlog fails at once (EAGAIN on Linux, ECONNREFUSED on Mac OS
+    # X, like stale sockets) so we retry for up to CONNECT_TIMEOUT seconds.
+    import _multiprocessing, errno, socket
+    deadline = time.time() + CONNECT_TIMEOUT
+    while True:
+        s = socket.socket(socket.AF_UNIX)
+        try:
+            s.settimeout(CONNECT_TIMEOUT)
+            try:
+                s.connect(address)
+            except socket.error, e:
+                if (e.errno not in (errno.EAGAIN, errno.ECONNREFUSED) or
+                    time.time() >= deadline):
+                    raise
+                time.sleep(CONNECT_RETRY_INTERVAL)
+                continue
+            s.settimeout(None)
+            return _multiprocessing.Connection(os.dup(s.fileno()))
+        finally:
+            s.close()
+
+
+def connect(address=None):
+    """
+    Return a DaemonClient connected to the resolver daemon or None if the
+    daemon isn't running.
+    """
+    address = address or platform.get_daemon_address()
+    if sys.platform != "win32" and not os.path.exists(address):
+        return None
+    # Only pay for importing the socket machinery if a daemon might be up.
+    import socket
+    try:
+        if sys.platform == "win32":
+            from multiprocessing.connection import Client
+            conn = Client(address)
+        else:
+            conn = _connect_unix(address)
+        client = DaemonClient(conn)
+        client.request("ping")
+        return client
+    except (IOError, OSError, EOFError, RuntimeError, socket.error), e:
+        # Not logging.debug(), main.py may not have set up logging yet and
+        # that would install a default console handler.
+        logging.getLogger().debug("Resolver daemon unavailable: %s", e)
+        return None
+
+
+###########################################################################
+# The End.
+###########################################################################
@@ -1,22 +1,17 @@
 import os, sys
 import logging
-import sqlite3
 import re
+import threading
+import time
+import unicodedata
+
+import snapshot
+import timing
+from backend import platform
 
 PROGRAM_TITLE = "Share Dropbox"
 PROTOCOL_URI_PREFIX = "dropbox:"
-
-###########################################################################
-# Platform abstraction layer.
-###########################################################################
-
-if sys.platform == "win32":
-    import platform_win32 as platform
-elif sys.platform == "darwin":
-    import platform_mac as platform
-else:
-    raise NotImplementedError("Unsupported platform")
-
+SHARE_URL_PREFIX = "http://www.sharedropbox.com/"
 
 ###########################################################################
 # Exceptions
@@ -33,19 +28,204 @@ class DropboxWarning(RuntimeError):
 # Utilities.
 ###########################################################################
 
+SNAPSHOT_CONFIG_KEYS = ("root_ns", "dropbox_path")
+
+BUSY_TIMEOUT = 2.0
+LAZY_MOUNT_THRESHOLD = 10000
+# Selections of more items load the mount table even if it is huge (every
+# batch of candidate paths costs SharedFolderQuery a scan of the table).
+LAZY_MAX_LOOKUPS = 5000
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER.
+MAX_QUERY_VARIABLES = 999
+FIND_CACHE_SIZE = 4096
+BUSY_RETRIES = 5
+
+
+class DropboxState(object):
+    """
+    Read-only reader for the Dropbox client databases. A single connection
+    opens ``filecache.db`` and attaches ``config.db`` so that both are read
+    within the same transaction and therefore from one consistent snapshot,
+    even while the Dropbox client is busy writing to them. Lock contention is
+    handled by SQLite's busy timeout and, as a last resort, by retrying.
+    Threads share the connection, transactions are serialized by ``lock``
+    (per-thread connections would be freed while their threads exit, which
+    can deadlock with the interpreter shutting down, and short-lived threads
+    like linkserver's request handlers would open one each).
+    """
+    def __init__(self, config_dbfile=None, filecache_dbfile=None, timeout=BUSY_TIMEOUT):
+        self.config_dbfile = config_dbfile or platform.get_dropbox_dbfile("config.db")
+        self.filecache_dbfile = filecache_dbfile or platform.get_dropbox_dbfile("filecache.db")
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self.con = None
+
+    def connect(self):
+        """
+        Return the shared connection, must be called with ``lock`` held.
+        """
+        import sqlite3
+        con = self.con
+        if con is None:
+            for dbfile in (self.config_dbfile, self.filecache_dbfile):
+                if not os.path.exists(dbfile):
+                    raise IOError("Could not locate Dropbox DB %s" % dbfile)
+            # Python 2's sqlite3 can't open "file:...?mode=ro" URIs so we
+            # rely on query_only to guarantee we never write to the DBs.
+            con = sqlite3.connect(self.filecache_dbfile, timeout=self.timeout,
+                                  isolation_level=None, check_same_thread=False)
+            con.execute("PRAGMA query_only = 1")
+            con.execute("ATTACH DATABASE ? AS config", (self.config_dbfile,))
+            self.con = con
+        return con
+
+    def close(self):
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+                self.con = None
+
+    def transaction(self, func):
+        """
+        Run ``func(con)`` inside a read transaction, retrying with back-off
+        if the databases stay locked beyond the busy timeout.
+        """
+        import sqlite3
+        for n in range(BUSY_RETRIES):
+            try:
+                with self.lock:
+                    con = self.connect()
+                    con.execute("BEGIN")
+                    try:
+                        return func(con)
+                    finally:
+                        con.execute("COMMIT")
+            except sqlite3.OperationalError, e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                logging.debug("Dropbox DB busy (attempt %d): %s", n + 1, e)
+                self.close()
+                time.sleep(0.05 * 2 ** n)
+        raise DropboxWarning("Dropbox databases are locked, please try again")
+
+    def read_config(self, con, keys):
+        placeholders = ", ".join("?" * len(keys))
+        return dict((key, unicode(value)) for (key, value) in con.execute(
+            "SELECT key, value FROM config.config WHERE key IN (%s)" % placeholders, keys))
+
+    def read_mounts(self, con):
+        return [(unicode(namespace), server_path) for (namespace, server_path) in
+                con.execute("SELECT target_ns, server_path FROM main.mount_table")]
+
+    def count_mounts(self):
+        return self.transaction(
+            lambda con: con.execute("SELECT COUNT(*) FROM main.mount_table").fetchone()[0])
+
+    def select_in(self, query, values):
+        """
+        Return all rows of ``query`` (with a "%s" for the placeholders of an
+        IN list) for ``values``, queried in chunks of MAX_QUERY_VARIABLES
+        within a single transaction.
+        """
+        values = list(values)
+
+        def select(con):
+            rows = []
+            for n in range(0, len(values), MAX_QUERY_VARIABLES):
+                chunk = values[n:n + MAX_QUERY_VARIABLES]
+                rows.extend(con.execute(query % ", ".join("?" * len(chunk)), chunk))
+            return rows
+        return self.transaction(select) if values else []
+
+    def find_mounts(self, server_paths):
+        """
+        Return (namespace, server_path) of all mounts whose server path is
+        one of ``server_paths`` (compared case-insensitively).
+        """
+        # No index covers server_path (let alone with NOCASE) and we mustn't
+        # create one, so every chunk is a scan of the table.
+        return [(unicode(namespace), server_path) for (namespace, server_path) in self.select_in(
+            "SELECT target_ns, server_path FROM main.mount_table "
+            "WHERE server_path COLLATE NOCASE IN (%s)", server_paths)]
+
+    def find_namespaces(self, namespaces):
+        """
+        Return dict of namespace to server path for the mounts ``namespaces``
+        which exist.
+        """
+        return dict((unicode(namespace), server_path) for (namespace, server_path) in
+                    self.select_in("SELECT target_ns, server_path FROM main.mount_table "
+                                   "WHERE target_ns IN (%s)", namespaces))
+
+    def get_config(self, keys):
+        return self.transaction(lambda con: self.read_config(con, keys))
+
+    def read(self):
+        """
+        Return (config, mounts) for SNAPSHOT_CONFIG_KEYS and the mount table.
+        """
+        return self.transaction(lambda con: (self.read_config(con, SNAPSHOT_CONFIG_KEYS),
+                                             self.read_mounts(con)))
+
+
+def read_dropbox_state():
+    """
+    Read the config keys we care about and the mount table straight from the
+    Dropbox databases, returns (config, mounts).
+    """
+    state = DropboxState()
+    try:
+        return state.read()
+    finally:
+        state.close()
+
+
+def get_dropbox_state():
+    """
+    Return (config, mounts) served from the mmap'ed state snapshot which is
+    only rebuilt from the Dropbox databases when they have changed.
+    """
+    return snapshot.load(
+        platform.get_cache_file("state.snapshot"),
+        [platform.get_dropbox_dbfile("config.db"),
+         platform.get_dropbox_dbfile("filecache.db")],
+        read_dropbox_state)
+
+
 def get_dropbox_shared_folders():
-    local_ns = get_dropbox_root_ns()
-    local_path = get_dropbox_path()
-    con = sqlite3.connect(platform.get_dropbox_dbfile("filecache.db"))
-    con.row_factory = sqlite3.Row
-    return [(unicode(row["target_ns"]),
-             os.path.normpath(row["server_path"].replace("%s:" % local_ns, local_path).lower()))
-            for row in con.execute("SELECT * FROM mount_table")]
+    config, mounts = get_dropbox_state()
+    local_ns = config["root_ns"]
+    local_path = os.path.normpath(config["dropbox_path"])
+    return [(namespace,
+             os.path.normpath(server_path.replace("%s:" % local_ns, local_path)))
+            for (namespace, server_path) in mounts]
+
+
+def get_dropbox_mount_count():
+    """
+    Return size of the mount table, using the snapshot if it is up-to-date.
+    """
+    count = snapshot.peek_mount_count(
+        platform.get_cache_file("state.snapshot"),
+        [platform.get_dropbox_dbfile("config.db"),
+         platform.get_dropbox_dbfile("filecache.db")])
+    if count is None:
+        state = DropboxState()
+        try:
+            count = state.count_mounts()
+        finally:
+            state.close()
+    return count
 
 
 def get_dropbox_config(key):
-    con = sqlite3.connect(platform.get_dropbox_dbfile("config.db"))
-    return con.execute("SELECT * FROM config WHERE config.key=?", (key,)).fetchone()[1]
+    if key in SNAPSHOT_CONFIG_KEYS:
+        return get_dropbox_state()[0][key]
+    state = DropboxState()
+    try:
+        return state.get_config([key])[key]
+    finally:
+        state.close()
 
 
 def get_dropbox_root_ns():
@@ -56,93 +236,1076 @@ def get_dropbox_path():
     return os.path.normpath(get_dropbox_config('dropbox_path'))
 
 
+###########################################################################
+# Shared folder index.
+###########################################################################
+
+def fold_path(path):
+    """
+    Case-fold and NFC normalize ``path`` so that lookups work regardless of
+    case and of HFS+ handing us decomposed (NFD) filenames.
+    """
+    return unicodedata.normalize("NFC", path).lower()
+
+
+class SharedFolderIndex(object):
+    """
+    Index over the (namespace, shared path) tuples returned by
+    get_dropbox_shared_folders(). Paths are keyed by their folded form so that
+    mapping a local path to its shared folder is a longest-prefix match which
+    costs one dict lookup per path component (nested mounts resolve to the
+    innermost shared folder). Resolver daemon clients (see daemon.py) expose
+    the very same map_paths() and resolve_uris() interface, the latter returns
+    the list of local filenames of every URI (bundle URIs link many items).
+    """
+    def __init__(self, shared_folders):
+        self.paths = {}
+        # Hashes of the folded names of all shared folders, only used to rule
+        # out that an item is a shared folder (much smaller than the names).
+        self.names = set()
+        self.namespaces = {}
+        for (namespace, shared_path) in shared_folders:
+            folded = fold_path(shared_path)
+            if folded == shared_path:
+                folded = shared_path
+            self.paths[folded] = namespace
+            self.names.add(hash(folded[folded.rfind(os.sep) + 1:]))
+            self.namespaces[namespace] = shared_path
+
+    def __len__(self):
+        return len(self.namespaces)
+
+    def find_path(self, path):
+        """
+        Return (namespace, relative path) of the innermost shared folder
+        containing local ``path`` or None if it isn't shared.
+        """
+        normalized = unicodedata.normalize("NFC", path)
+        if normalized == path:
+            # Common case, the path is NFC already and lower() maps every
+            # character to exactly one (Python 2 only does simple case
+            # mapping) so offsets into the folded path match the original
+            # ones and we can probe the ancestors by slicing at each
+            # separator (right to left).
+            folded = normalized.lower()
+            end = len(folded)
+            while end > 0:
+                namespace = self.paths.get(folded[:end])
+                if namespace is not None:
+                    return (namespace, path[end:])
+                end = folded.rfind(os.sep, 0, end)
+            return None
+        parts = path.split(os.sep)
+        folded = [fold_path(part) for part in parts]
+        for n in range(len(parts), 0, -1):
+            namespace = self.paths.get(os.sep.join(folded[:n]))
+            if namespace is not None:
+                return (namespace, path[len(os.sep.join(parts[:n])):])
+        return None
+
+    def find_paths(self, paths):
+        """
+        Generator version of find_path() for long runs of ``paths`` which
+        only looks up each parent folder once (selections and batches tend to
+        have lots of items in the same folder).
+        """
+        parents = {}
+        for path in paths:
+            (head, sep, tail) = path.rpartition(os.sep)
+            match = parents.get(head, False)
+            if match is False:
+                if len(parents) >= FIND_CACHE_SIZE:
+                    parents.clear()
+                match = parents[head] = self.find_path(head)
+            if hash(fold_path(tail)) in self.names:
+                # Item might be a (nested) shared folder itself.
+                yield self.find_path(path)
+            elif match is None:
+                yield None
+            else:
+                yield (match[0], match[1] + os.sep + tail)
+
+    def find_namespace(self, namespace):
+        """
+        Return local path of shared folder ``namespace`` or None if missing.
+        """
+        return self.namespaces.get(namespace)
+
+    def map_paths(self, paths):
+        return list(self.find_paths(paths))
+
+    def resolve_uris(self, uris):
+        return [resolve_dropbox_items(self, uri) for uri in uris]
+
+
 ###########################################################################
 # Padding-less base64 encoding.
 ###########################################################################
 
-from base64 import urlsafe_b64encode, urlsafe_b64decode
+# Straight binascii rather than the base64 module which is slow to import.
+from binascii import a2b_base64, b2a_base64, Error as Base64Error
+
+_b64_identity = "".join(map(chr, range(256)))
+_b64_urlsafe = _b64_identity.replace("+", "-").replace("/", "_")
+_b64_standard = _b64_identity.replace("-", "+").replace("_", "/")
 
 def uri_b64encode(s):
-     return urlsafe_b64encode(s).strip('=')
+     return b2a_base64(s).rstrip('=\n').translate(_b64_urlsafe)
 
 def uri_b64decode(s):
-     return urlsafe_b64decode(s + '=' * (4 - len(s) % 4))
+     try:
+         return a2b_base64(s.translate(_b64_standard) + '=' * (4 - len(s) % 4))
+     except Base64Error, e:
+         raise TypeError(str(e))
+
+
+# SQLite's NOCASE collation only folds ASCII letters.
+_ascii_lower = dict((n, n + 32) for n in range(ord("A"), ord("Z") + 1))
+
+
+class SharedFolderQuery(object):
+    """
+    Drop-in replacement for SharedFolderIndex which pushes lookups down to
+    SQLite instead of loading the whole mount table, preferable for very
+    large mount tables when only a limited number of items are being
+    resolved (see load_shared_folders()). All candidate shared folders of a
+    batch of paths are looked up with one query (per MAX_QUERY_VARIABLES)
+    and the namespaces of a batch of URIs with another. Note that server
+    paths are matched with SQLite's (ASCII only) NOCASE collation.
+    """
+    def __init__(self, state=None):
+        self.state = state or DropboxState()
+        config = self.state.get_config(SNAPSHOT_CONFIG_KEYS)
+        self.root_ns = config["root_ns"]
+        self.dropbox_path = os.path.normpath(config["dropbox_path"])
+        self.dropbox_parts = fold_path(self.dropbox_path).split(os.sep)
+        self.namespaces = {}
+
+    def split_path(self, path):
+        """
+        Return the components of local ``path`` below the Dropbox folder
+        (preceded by an empty one) or None if it isn't inside. Compared
+        component by component, the Dropbox folder may be spelled in another
+        normalization form (or case) than ``path`` and thus have another
+        length.
+        """
+        parts = path.split(os.sep)
+        n = len(self.dropbox_parts)
+        if len(parts) <= n or [fold_path(part) for part in parts[:n]] != self.dropbox_parts:
+            return None
+        return [u""] + parts[n:]
+
+    def get_candidates(self, path):
+        """
+        Return the server paths of all folders containing local ``path``
+        (outermost first) paired with their number of path components.
+        """
+        parts = self.split_path(path)
+        if parts is None:
+            return []
+        return [(unicodedata.normalize("NFC", u"%s:%s" % (self.root_ns, u"/".join(parts[:n]))), n)
+                for n in range(2, len(parts) + 1)]
+
+    def map_paths(self, paths):
+        """
+        Return (namespace, relative path) of the innermost shared folder
+        containing each local path in ``paths`` or None if it isn't shared.
+        """
+        candidates = [self.get_candidates(path) for path in paths]
+        server_paths = set(server_path for items in candidates for (server_path, n) in items)
+        mounts = dict((server_path.translate(_ascii_lower), namespace) for (namespace, server_path)
+                      in self.state.find_mounts(server_paths))
+        results = []
+        for (path, items) in zip(paths, candidates):
+            for (server_path, n) in reversed(items):
+                namespace = mounts.get(server_path.translate(_ascii_lower))
+                if namespace is not None:
+                    parts = self.split_path(path)
+                    results.append((namespace, os.sep + os.sep.join(parts[n:]) if parts[n:] else u""))
+                    break
+            else:
+                results.append(None)
+        return results
+
+    def find_path(self, path):
+        return self.map_paths([path])[0]
+
+    def prefetch_namespaces(self, namespaces):
+        missing = set(namespaces) - set(self.namespaces)
+        if missing:
+            found = self.state.find_namespaces(missing)
+            for namespace in missing:
+                server_path = found.get(namespace)
+                if server_path is not None:
+                    server_path = os.path.normpath(
+                        server_path.replace("%s:" % self.root_ns, self.dropbox_path))
+                self.namespaces[namespace] = server_path
+
+    def find_namespace(self, namespace):
+        """
+        Return local path of shared folder ``namespace`` or None if missing.
+        """
+        self.prefetch_namespaces([namespace])
+        return self.namespaces[namespace]
+
+    def resolve_uris(self, uris):
+        namespaces = []
+        for uri in uris:
+            try:
+                namespaces.append(decode_dropbox_bundle(uri[len(PROTOCOL_URI_PREFIX):])[0])
+            except ValueError:
+                pass  # Reported by resolve_dropbox_items().
+        self.prefetch_namespaces(namespaces)
+        return [resolve_dropbox_items(self, uri) for uri in uris]
 
 
 ###########################################################################
-# Dropbox URI handling (for protocol handler).
+# Compact binary URI format (v2).
 ###########################################################################
+#
+# Version 1 URIs are simply the base64 encoded UTF-8 text "namespace|path".
+# Version 2 URIs are base64 encoded binary data:
+#
+#   u8:version (0x02)  varint:namespace  bytes:path
+#
+# where the namespace is an unsigned LEB128 varint and the path is UTF-8
+# with "/" separators in which common path tokens are replaced by the bytes
+# 0x01-0x1f (see URI_TOKENS, never reorder or change existing entries!).
+# Literal bytes 0x00-0x1f are escaped with a 0x00 prefix. Version 1 URIs
+# always start with an ASCII digit so both versions can be told apart.
+
+URI_VERSION = 2
+
+URI_TOKENS = [
+    "/Documents", "/Projects", "/Shared", "/Photos", "/Design", "/Marketing",
+    "/Reports", "/Archive", "/Assets", "/Images", "/Camera Uploads",
+    "/Screenshots", "/Clients", "/Final", "/Drafts", "/Invoices",
+    "Screenshot ", "Copy of ", "Untitled", "IMG_", " - ", "20",
+    ".pdf", ".jpg", ".png", ".docx", ".xlsx", ".pptx", ".txt", ".zip", ".mov",
+]
+
+_token_codes = [(token, chr(n + 1)) for (n, token) in enumerate(URI_TOKENS)]
+_token_codes.sort(key=lambda item: len(item[0]), reverse=True)
+_code_tokens = dict((code, token) for (token, code) in _token_codes)
+_code_tokens.update(("\x00" + chr(n), chr(n)) for n in range(0x20))
+
+_control_re = re.compile("[\x00-\x1f]")
+_code_re = re.compile("\x00[\x00-\x1f]|[\x01-\x1f]")
+_code_split_re = re.compile("([\x01-\x1f])")
+_varint_re = re.compile("[\x80-\xff]*[\x00-\x7f]")
 
-def explore_dropbox(shared_folders, uri):
-    data = uri[len(PROTOCOL_URI_PREFIX):]
-    uri_namespace, uri_path = uri_b64decode(data.encode("ascii")).decode("utf-8").split("|")
-    for (namespace, shared_path) in shared_folders:
-        if namespace == uri_namespace:
-            filename = os.path.join(shared_path, uri_path[1:])
-            if os.path.exists(filename):
-                logging.debug("Exploring: %s" % filename.encode("utf-8"))
-                platform.explore_path(filename)
-                break
+# There are only a handful of distinct namespaces in practice.
+_varint_cache = {}
+_namespace_cache = {}
+VARINT_CACHE_SIZE = 1024
+
+
+def pack_varint(n):
+    chunks = []
+    while n > 0x7f:
+        chunks.append(chr(0x80 | (n & 0x7f)))
+        n >>= 7
+    chunks.append(chr(n))
+    return "".join(chunks)
+
+
+def unpack_varint(data):
+    n = 0
+    for byte in reversed(data):
+        n = (n << 7) | (ord(byte) & 0x7f)
+    return n
+
+
+def pack_uri_v2(namespace, path):
+    varint = _varint_cache.get(namespace)
+    if varint is None:
+        if len(_varint_cache) >= VARINT_CACHE_SIZE:
+            _varint_cache.clear()
+        varint = _varint_cache[namespace] = pack_varint(int(namespace))
+    if os.sep != "/":
+        path = path.replace(os.sep, "/")
+    path = path.encode("utf-8")
+    if _control_re.search(path):
+        path = _control_re.sub(lambda m: "\x00" + m.group(0), path)
+    # Tokens and codes are disjoint (printable vs control bytes) so tokens can
+    # be replaced one by one (longest first), faster than a re.sub() callback.
+    for (token, code) in _token_codes:
+        if token in path:
+            path = path.replace(token, code)
+    return "\x02" + varint + path
+
+
+def unpack_uri_v2(data):
+    """
+    Return (namespace, path) of v2 URI ``data`` (raw bytes).
+    """
+    match = _varint_re.match(data, 1)
+    if match is None:
+        raise ValueError("Truncated namespace")
+    varint = match.group(0)
+    namespace = _namespace_cache.get(varint)
+    if namespace is None:
+        if len(_namespace_cache) >= VARINT_CACHE_SIZE:
+            _namespace_cache.clear()
+        namespace = _namespace_cache[varint] = unicode(unpack_varint(varint))
+    path = data[match.end():]
+    if "\x00" in path:
+        path = _code_re.sub(lambda m: _code_tokens[m.group(0)], path)
     else:
-        raise DropboxWarning("Could not locate shared file: %s" % filename.encode("utf-8"))
+        # One C level split at the codes, the codes end up at odd indexes.
+        parts = _code_split_re.split(path)
+        if len(parts) > 1:
+            parts[1::2] = [_code_tokens[code] for code in parts[1::2]]
+            path = "".join(parts)
+    path = path.decode("utf-8")
+    if os.sep != "/":
+        path = path.replace("/", os.sep)
+    return namespace, path
+
+
+###########################################################################
+# Bundle URIs (v3, multi-item selections).
+###########################################################################
+#
+# A selection of many items of the same shared folder is linked with one
+# bundle URI instead of one URI per item, the base64 encoded binary data:
+#
+#   u8:version (0x03)  varint:namespace  deflate:items
+#
+# where items is the raw deflated (no zlib header) UTF-8 text of the common
+# folder of all paths followed by every path relative to it, joined by NUL
+# bytes (which never occur in filenames). Bundles which would exceed
+# BUNDLE_URI_LIMIT are split into several smaller bundles.
+
+# Characters of URI data (without prefix), Internet Explorer doesn't open
+# URLs longer than 2083 characters (including the share URL prefix).
+BUNDLE_URI_LIMIT = 2000
+# Decompressed bytes, larger bundles are rejected as malformed.
+MAX_BUNDLE_SIZE = 4 << 20
+
+
+def common_folder(paths, sep=os.sep):
+    """
+    Return the innermost folder containing all ``paths`` ("" if they don't
+    share any folder besides the root).
+    """
+    prefix = os.path.commonprefix([path.rpartition(sep)[0] + sep for path in paths])
+    return prefix[:prefix.rfind(sep)]
+
+
+def pack_bundle(namespace, paths):
+    import zlib
+    paths = [path.replace(os.sep, "/").encode("utf-8") for path in paths]
+    folder = common_folder(paths, "/")
+    items = "\x00".join([folder] + [path[len(folder) + 1:] for path in paths])
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    return "\x03" + pack_varint(int(namespace)) + compressor.compress(items) + compressor.flush()
+
+
+def unpack_bundle(data):
+    """
+    Return (namespace, paths) of bundle URI ``data`` (raw bytes).
+    """
+    import zlib
+    match = _varint_re.match(data, 1)
+    if match is None:
+        raise ValueError("Truncated namespace")
+    namespace = unicode(unpack_varint(match.group(0)))
+    decompressor = zlib.decompressobj(-15)
+    try:
+        items = decompressor.decompress(data[match.end():], MAX_BUNDLE_SIZE)
+    except zlib.error, e:
+        raise ValueError("Malformed bundle: %s" % e)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Bundle exceeds %d bytes" % MAX_BUNDLE_SIZE)
+    items = items.decode("utf-8").split(u"\x00")
+    if len(items) < 2:
+        raise ValueError("Empty bundle")
+    folder = items.pop(0)
+    # Only the shared folder itself (path "") is not below the common folder.
+    return namespace, [(folder + u"/" + item if item else folder).replace("/", os.sep)
+                       for item in items]
+
+
+def encode_dropbox_bundle(namespace, paths, limit=BUNDLE_URI_LIMIT):
+    """
+    Return a list of (URI, paths) tuples linking ``paths`` (duplicates
+    removed) in shared folder ``namespace`` with as few bundle URIs (without
+    protocol prefix) of at most ``limit`` characters as practical. Single
+    items (and v1 namespaces) get plain URIs.
+    """
+    if len(paths) == 1 or not namespace.isdigit():
+        return [(encode_dropbox_uri(namespace, path), [path]) for path in paths]
+    # Sorted so that items of a folder end up in the same bundle. The size
+    # of a bundle grows about linearly with its number of items so a bundle
+    # which is too large is retried with proportionally fewer items and the
+    # next bundle starts out with the number of items which fit last.
+    paths = sorted(set(paths))
+    bundles, start, size = [], 0, len(paths)
+    while start < len(paths):
+        chunk = paths[start:start + size]
+        if len(chunk) == 1:
+            data = encode_dropbox_uri(namespace, chunk[0])
+        else:
+            data = uri_b64encode(pack_bundle(namespace, chunk))
+            if len(data) > limit:
+                size = max(1, min(len(chunk) - 1, len(chunk) * limit * 9 // (len(data) * 10)))
+                continue
+        bundles.append((data, chunk))
+        start += len(chunk)
+    return bundles
+
+
+def decode_dropbox_bundle(data):
+    """
+    Return (namespace, paths) for the URI ``data`` (without protocol prefix)
+    which is either a bundle or a single item URI in any format version.
+    Raises ValueError if malformed.
+    """
+    try:
+        raw = uri_b64decode(str(data))
+        if raw[:1] == "\x03":
+            return unpack_bundle(raw)
+    except (TypeError, UnicodeError), e:
+        raise ValueError("Malformed Dropbox URI: %s" % e)
+    uri_namespace, uri_path = decode_dropbox_uri(data)
+    return uri_namespace, [uri_path]
+
+
+###########################################################################
+# Dropbox URI handling (for protocol handler).
+###########################################################################
+
+def find_shared_folder(index, namespace, path):
+    shared_path = index.find_namespace(namespace)
+    if shared_path is None or not os.path.isdir(shared_path):
+        raise DropboxWarning("Could not locate shared folder of: %s" % path.encode("utf-8"))
+    return shared_path
+
+
+def resolve_dropbox_items(index, uri):
+    """
+    Map ``uri`` (which may also be a bundle URI) back to the list of local
+    filenames of its items using the shared folder ``index``. Items which
+    have been moved or renamed since are located via the name index of their
+    shared folder (see fileindex.py), failing that we settle for the nearest
+    ancestor which still exists. Raises DropboxWarning if not even the
+    shared folder can be located.
+    """
+    uri_namespace, uri_paths = decode_dropbox_bundle(uri[len(PROTOCOL_URI_PREFIX):])
+    shared_path = find_shared_folder(index, uri_namespace, uri_paths[0])
+    return [locate_item(uri_namespace, shared_path, path) for path in uri_paths]
 
 
-def encode_dropbox_uri(namespace, path):
+def locate_item(namespace, shared_path, path):
+    rel_path = path.replace("/", os.sep)
+    filename = shared_path + rel_path
+    if os.path.exists(filename):
+        return filename
+    import fileindex
+    moved = fileindex.locate(namespace, shared_path, rel_path)
+    if moved is not None:
+        logging.debug("Located moved item: %s", moved)
+        return moved
+    while not os.path.exists(filename):
+        filename = os.path.dirname(filename)
+    logging.debug("Falling back to ancestor: %s", filename)
+    return filename
+
+
+def group_by_folder(filenames):
+    """
+    Group ``filenames`` by parent folder, returns a list of (folder, items)
+    tuples in order of first appearance with duplicate items removed.
+    """
+    folders, groups, seen = [], {}, set()
+    for filename in filenames:
+        if filename in seen:
+            continue
+        seen.add(filename)
+        folder = os.path.dirname(filename)
+        if folder not in groups:
+            folders.append(folder)
+            groups[folder] = []
+        groups[folder].append(filename)
+    return [(folder, groups[folder]) for folder in folders]
+
+
+def explore_paths(filenames):
+    """
+    Reveal ``filenames`` using one file browser action per parent folder.
+    """
+    for (folder, items) in group_by_folder(filenames):
+        logging.debug("Exploring: %d items in %s", len(items), folder)
+        platform.explore_paths(folder, items)
+
+
+def encode_dropbox_uri(namespace, path, version=URI_VERSION):
+    """
+    Return URI (without protocol prefix) for ``path`` in shared folder
+    ``namespace`` using URI format ``version`` (1 or 2).
+    """
+    if version == 2 and namespace.isdigit():
+        return uri_b64encode(pack_uri_v2(namespace, path))
     data = u"%s|%s" % (namespace, path)
     return uri_b64encode(data.encode("utf-8"))
 
 
+def decode_dropbox_uri(data):
+    """
+    Inverse of encode_dropbox_uri(), returns (namespace, path) for the URI
+    ``data`` (without protocol prefix) in any format version. Raises
+    ValueError if malformed.
+    """
+    try:
+        data = uri_b64decode(str(data))
+        if data[:1] == "\x02":
+            return unpack_uri_v2(data)
+        if data[:1] == "\x03":
+            raise ValueError("Bundle URI (see decode_dropbox_bundle())")
+        if data[:1] < " ":
+            raise ValueError("Unsupported URI version")
+        uri_namespace, uri_path = data.decode("utf-8").split("|", 1)
+    except (TypeError, UnicodeError, IndexError, KeyError), e:
+        raise ValueError("Malformed Dropbox URI: %s" % e)
+    return uri_namespace, uri_path
+
+
+def is_bundle_uri(arg):
+    """
+    Return True if ``arg`` is a (valid looking) bundle URI.
+    """
+    if not is_valid_dropbox_uri(arg):
+        return False
+    try:
+        return uri_b64decode(arg[len(PROTOCOL_URI_PREFIX):len(PROTOCOL_URI_PREFIX) + 4])[:1] == "\x03"
+    except TypeError:
+        return False
+
+
 def is_valid_dropbox_uri(arg):
     if arg.startswith(PROTOCOL_URI_PREFIX):
         uri = arg[len(PROTOCOL_URI_PREFIX):]
-        return re.match(r"^[a-z0-9_\-]+$", uri, re.I) != None
+        return re.match(r"[a-z0-9_\-]+\Z", uri, re.I) != None
     else:
         return False
 
 
+###########################################################################
+# Batch URI decoding (link audits).
+###########################################################################
+
+_b64_invalid_re = re.compile(r"[^a-zA-Z0-9_\-]")
+_b64_fill = ["", "", "AA", "A"]
+
+
+def decode_dropbox_uris(uris):
+    """
+    Validate and decode a batch of ``uris`` (with protocol prefix) at once,
+    returns (namespaces, paths, valid) columns where invalid rows are flagged
+    in ``valid`` (and have None namespace and path) instead of raising. The
+    path of a bundle URI is the tuple of the paths of all of its items.
+
+    Instead of one base64 decode per URI the whole batch is validated with a
+    single regex scan and decoded with a single a2b_base64() call: every URI
+    is filled up to a multiple of 4 characters with "A" (zero bits) and the
+    decoded blob is sliced at known offsets. Likewise the UTF-8 decoding of
+    all v1 rows and the token expansion and UTF-8 decoding of all v2 rows
+    are done on one joined blob per format. Rows only fall back to one by
+    one processing if the batch contains invalid characters or UTF-8 (or v2
+    rows with escaped control bytes).
+    """
+    count = len(uris)
+    skip = len(PROTOCOL_URI_PREFIX)
+    datas = [uri[skip:] if uri[:skip] == PROTOCOL_URI_PREFIX else "" for uri in uris]
+    # No separator, the scan only looks for characters outside the alphabet.
+    if _b64_invalid_re.search("".join(datas)) is not None:
+        datas = [data if _b64_invalid_re.search(data) is None else "" for data in datas]
+    datas = [data if len(data) % 4 != 1 else "" for data in datas]
+    blob = str("".join([data + _b64_fill[len(data) % 4] for data in datas]))
+    decoded = a2b_base64(blob.translate(_b64_standard))
+
+    # Slice the rows out of the blob and sort them by format version.
+    rows, valid = [None] * count, [False] * count
+    namespaces, paths = [None] * count, [None] * count
+    v1_rows, v2_rows = [], []
+    offset = 0
+    for n in xrange(count):
+        size = len(datas[n])
+        if not size:
+            continue
+        row = rows[n] = decoded[offset:offset + size * 3 // 4]
+        offset += (size + 3) // 4 * 3
+        kind = row[:1]
+        if kind >= " ":
+            v1_rows.append(n)
+        elif kind == "\x02":
+            v2_rows.append(n)
+        elif kind == "\x03":
+            try:
+                (namespaces[n], bundle_paths) = unpack_bundle(row)
+            except (ValueError, UnicodeError):
+                continue
+            paths[n] = tuple(bundle_paths)
+        else:
+            continue
+        valid[n] = True
+    _decode_v1_rows(rows, v1_rows, namespaces, paths, valid)
+    _decode_v2_rows(rows, v2_rows, namespaces, paths, valid)
+    return namespaces, paths, valid
+
+
+def _decode_joined(blob, count):
+    """
+    Return the list of ``count`` texts joined by NUL bytes in UTF-8 ``blob``
+    or None if any of them is malformed (or contains NUL bytes itself).
+    """
+    try:
+        texts = blob.decode("utf-8").split(u"\x00")
+    except UnicodeDecodeError:
+        return None
+    return texts if len(texts) == count else None
+
+
+def _decode_v1_rows(rows, indexes, namespaces, paths, valid):
+    texts = _decode_joined("\x00".join([rows[n] for n in indexes]), len(indexes))
+    for (i, n) in enumerate(indexes):
+        try:
+            text = texts[i] if texts is not None else rows[n].decode("utf-8")
+        except UnicodeError:
+            valid[n] = False
+            continue
+        namespace, sep, path = text.partition(u"|")
+        if sep:
+            namespaces[n], paths[n] = namespace, path
+        else:
+            valid[n] = False
+
+
+def _decode_v2_rows(rows, indexes, namespaces, paths, valid):
+    clean, bodies = [], []
+    for n in indexes:
+        row = rows[n]
+        match = _varint_re.match(row, 1)
+        if match is None:
+            valid[n] = False
+            continue
+        body = row[match.end():]
+        if "\x00" in body:
+            # Escaped control bytes, rare enough to be decoded one by one.
+            try:
+                namespaces[n], paths[n] = unpack_uri_v2(row)
+            except (ValueError, UnicodeError, KeyError):
+                valid[n] = False
+            continue
+        varint = match.group(0)
+        namespace = _namespace_cache.get(varint)
+        if namespace is None:
+            if len(_namespace_cache) >= VARINT_CACHE_SIZE:
+                _namespace_cache.clear()
+            namespace = _namespace_cache[varint] = unicode(unpack_varint(varint))
+        namespaces[n] = namespace
+        clean.append(n)
+        bodies.append(body)
+    # Expand the tokens of all rows at once (codes are 0x01-0x1f, NUL is free
+    # to separate rows).
+    parts = _code_split_re.split("\x00".join(bodies))
+    parts[1::2] = [_code_tokens[code] for code in parts[1::2]]
+    texts = _decode_joined("".join(parts), len(bodies))
+    for (i, n) in enumerate(clean):
+        try:
+            path = texts[i] if texts is not None else unpack_uri_v2(rows[n])[1]
+        except (ValueError, UnicodeError, KeyError):
+            namespaces[n] = None
+            valid[n] = False
+            continue
+        if os.sep != "/":
+            path = path.replace("/", os.sep)
+        paths[n] = path
+
+
+###########################################################################
+# Argument vetting.
+###########################################################################
+#
+# Selections of thousands of files on network shares are expensive to stat,
+# so each distinct path is checked for existence exactly once and (for large
+# selections) on a bounded pool of threads, the GIL is released while they
+# wait on the file system.
+
+STAT_JOBS = 16
+PARALLEL_STAT_THRESHOLD = 32
+
+# Debounce window (seconds) for coalescing launches on Windows and Mac OS X.
+BURST_WINDOW = 0.1
+
+
+def check_paths(paths, exists=os.path.exists, jobs=STAT_JOBS):
+    """
+    Return {path: exists} for the distinct ``paths``, checked by ``exists``
+    on up to ``jobs`` threads.
+    """
+    pending = list(set(paths))
+    if len(pending) < PARALLEL_STAT_THRESHOLD or jobs <= 1:
+        return dict((path, exists(path)) for path in pending)
+    found = {}
+    items = iter(pending)
+
+    def worker():
+        for path in items:
+            found[path] = exists(path)
+    threads = [threading.Thread(target=worker) for n in range(min(jobs, len(pending)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return found
+
+
+def vet_arguments(args, exists=os.path.exists, jobs=STAT_JOBS):
+    """
+    Split command-line ``args`` into (uris, paths) where paths are the
+    absolute and normalized paths of existing items, both in input order.
+    """
+    cwd = os.getcwdu()
+    uris, candidates = [], []
+    for arg in args:
+        if is_valid_dropbox_uri(arg):
+            uris.append(arg)
+        else:
+            candidates.append((arg, os.path.normpath(os.path.join(cwd, arg))))
+    found = check_paths([path for (arg, path) in candidates], exists, jobs)
+    paths = []
+    for (arg, path) in candidates:
+        if found[path]:
+            paths.append(path)
+        else:
+            logging.debug("Invalid argument: %s", arg)
+    return uris, paths
+
+
+def get_burst_window(args):
+    """
+    Return debounce window (seconds) used to coalesce launches linking
+    ``args`` with concurrent ones (see burst.py) or 0 if disabled. Only link
+    creation is coalesced, by default on Windows and Mac OS X only, and the
+    window can be set via DROPBOX_URI_BURST_WINDOW (milliseconds, 0 = off).
+    """
+    if all(is_valid_dropbox_uri(arg) for arg in args):
+        return 0
+    if os.environ.get("DROPBOX_URI_BURST_WINDOW"):
+        return float(os.environ["DROPBOX_URI_BURST_WINDOW"]) / 1000.0
+    if os.environ.get("DROPBOX_URI_PLATFORM"):
+        return 0
+    return BURST_WINDOW
+
+
 ###########################################################################
 # Dropbox URI creation/lookup.
 ###########################################################################
 
-def main(rootdir, is_frozen, script_path):
+def get_shared_folders(lookups=1):
+    """
+    Prefer a running resolver daemon (if any) and fallback to loading the
+    Dropbox mount table in-process for ``lookups`` items.
+    """
+    import daemon
+    lookup = daemon.connect()
+    if lookup is None:
+        lookup = load_shared_folders(lookups)
+    return lookup
+
+
+def load_shared_folders(lookups=1):
+    """
+    Load the mount table into a SharedFolderIndex unless it is so large that
+    querying SQLite on demand for ``lookups`` items is cheaper (see
+    SharedFolderQuery), pass None if the number of items isn't known.
+    """
+    if (lookups is not None and lookups <= LAZY_MAX_LOOKUPS and
+        get_dropbox_mount_count() > LAZY_MOUNT_THRESHOLD):
+        return SharedFolderQuery()
+    return SharedFolderIndex(get_dropbox_shared_folders())
+
+
+###########################################################################
+# Dialogs.
+###########################################################################
+#
+# Warnings and errors are shown by a detached process (see the platform's
+# show_message_detached()) so that we exit right away instead of keeping the
+# process, its log writer and DB connections around until the user clicks
+# OK. Concurrent launches tend to fail alike, so a dialog identical to one
+# shown by any process within DIALOG_DEDUP_WINDOW seconds is skipped. The
+# window only spans a burst of launches (see burst.py, followers go solo
+# after FORWARD_TIMEOUT seconds), a later failure is a separate user action
+# which deserves its own dialog. Set DROPBOX_URI_DIALOGS to "modal" to wait
+# for dialogs or "off" to only log.
+
+DIALOG_DEDUP_WINDOW = 2.0
+
+
+def claim_dialog(level, title, message):
+    """
+    Return True unless the same dialog has been claimed (by any process)
+    within the last DIALOG_DEDUP_WINDOW seconds. Dialogs which can't be
+    claimed (e.g. the cache folder isn't writable) are always shown.
+    """
+    import errno
+    import hashlib
+    key = hashlib.sha1(u"\0".join([level, title, message]).encode("utf-8")).hexdigest()
     try:
-        platform.setup(PROGRAM_TITLE, rootdir, is_frozen, script_path)
+        filename = platform.get_cache_file(os.path.join("dialogs", key))
+        dirname = os.path.dirname(filename)
+        try:
+            os.makedirs(dirname)
+        except OSError, e:
+            # Created by a concurrent launch failing the same way.
+            if e.errno != errno.EEXIST:
+                raise
+        now = time.time()
+        for name in os.listdir(dirname):
+            try:
+                if now - os.stat(os.path.join(dirname, name)).st_mtime >= DIALOG_DEDUP_WINDOW:
+                    os.remove(os.path.join(dirname, name))
+            except OSError:
+                pass
+        os.close(os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except (IOError, OSError), e:
+        if getattr(e, "errno", None) == errno.EEXIST:
+            return False
+        logging.warning("Could not claim dialog: %s", e)
+        return True
+
+
+def show_dialog(level, message):
+    """
+    Show ``level`` ("info", "warning" or "error") ``message`` to the user.
+    """
+    mode = os.environ.get("DROPBOX_URI_DIALOGS", "detached")
+    if mode == "off":
+        logging.debug("%s %s", level.capitalize(), message)
+        return
+    if not claim_dialog(level, PROGRAM_TITLE, message):
+        logging.debug("Skipping duplicate dialog: %s", message)
+        return
+    if mode == "modal":
+        getattr(platform, "show_%s_message" % level)(PROGRAM_TITLE, message)
+    else:
+        platform.show_message_detached(level, PROGRAM_TITLE, message)
+
 
-        shared_folders = get_dropbox_shared_folders()
+###########################################################################
+# Embeddable resolver API.
+###########################################################################
+
+def get_dropbox_state_files():
+    return snapshot.get_source_files(
+        [platform.get_dropbox_dbfile(filename)
+         for filename in ("config.db", "filecache.db")])
+
+
+class DropboxURIResolver(object):
+    """
+    Creates and resolves links without any UI for tools embedding us (and
+    for main() and the resolver daemon). The shared folders are loaded by
+    ``load`` (an in-memory SharedFolderIndex by default) once and only
+    reloaded when the Dropbox databases have changed since. All methods are
+    safe to call from many threads at once with the default ``load``.
+    """
+    def __init__(self, load=None):
+        self.load = load or (lambda: SharedFolderIndex(get_dropbox_shared_folders()))
+        self.sources = get_dropbox_state_files()
+        self.lock = threading.Lock()
+        self.fingerprint = None
+        self.shared_folders = None
+        self.get_shared_folders()
 
-        clipboard_html, clipboard_text = [], []
+    def get_shared_folders(self):
+        """
+        Return the shared folder lookup, reloaded if the state has changed.
+        """
+        fingerprint = snapshot.get_fingerprint(self.sources)
+        if fingerprint != self.fingerprint:
+            with self.lock:
+                if fingerprint != self.fingerprint:
+                    logging.debug("Loading Dropbox state")
+                    self.shared_folders = self.load()
+                    self.fingerprint = fingerprint
+        return self.shared_folders
 
-        for arg in platform.get_argv(script_path):
-            if is_valid_dropbox_uri(arg):
-                explore_dropbox(shared_folders, arg)
+    def encode_many(self, paths):
+        """
+        Return a dict per local path in ``paths`` with its ``path``, shared
+        folder ``namespace``, ``rel_path`` within it and link (``uri`` and
+        share ``url``), or with an ``error`` if it isn't in a shared folder.
+        """
+        results = []
+        for (path, match) in zip(paths, self.get_shared_folders().map_paths(paths)):
+            if match is None:
+                results.append({"path": path, "error": "Not in a shared folder"})
                 continue
-            if not os.path.exists(arg):
-                logging.debug("Invalid argument: %s" % arg.encode("utf-8"))
+            (namespace, rel_path) = match
+            data = encode_dropbox_uri(namespace, rel_path)
+            results.append({"path": path, "namespace": namespace, "rel_path": rel_path,
+                            "uri": PROTOCOL_URI_PREFIX + data, "url": SHARE_URL_PREFIX + data})
+        return results
+
+    def encode_bundles(self, paths):
+        """
+        Like encode_many() but links the items of each shared folder with
+        as few bundle URIs as practical, returns a dict per link with its
+        ``namespace``, local ``paths``, ``rel_paths``, ``uri`` and ``url``
+        and a dict with an ``error`` per path which isn't in a shared folder.
+        """
+        results, groups, namespaces = [], {}, []
+        for (path, match) in zip(paths, self.get_shared_folders().map_paths(paths)):
+            if match is None:
+                results.append({"path": path, "error": "Not in a shared folder"})
                 continue
-            for (namespace, shared_path) in shared_folders:
-                if arg.lower().startswith(shared_path):
-                    rel_path = arg[len(shared_path):]
-                    uri = encode_dropbox_uri(namespace, rel_path)
-                    clipboard_html.append(u"<a href='http://www.sharedropbox.com/%s'>%s</a>" % (uri, rel_path))
-                    clipboard_text.append("http://www.sharedropbox.com/%s" % uri)
-                    break
+            (namespace, rel_path) = match
+            if namespace not in groups:
+                namespaces.append(namespace)
+                groups[namespace] = {}
+            groups[namespace].setdefault(rel_path, path)
+        for namespace in namespaces:
+            local_paths = groups[namespace]
+            for (data, rel_paths) in encode_dropbox_bundle(namespace, list(local_paths)):
+                results.append({"namespace": namespace, "rel_paths": rel_paths,
+                                "paths": [local_paths[rel_path] for rel_path in rel_paths],
+                                "uri": PROTOCOL_URI_PREFIX + data, "url": SHARE_URL_PREFIX + data})
+        return results
+
+    def resolve_many(self, uris):
+        """
+        Return a dict per link in ``uris`` with its ``uri`` and the local
+        ``filenames`` of its items (plus ``filename`` unless it is a bundle
+        URI) or with an ``error`` if it can't be resolved.
+        """
+        shared_folders = self.get_shared_folders()
+        try:
+            resolved = zip(uris, shared_folders.resolve_uris(uris))
+        except (DropboxWarning, ValueError):
+            # Resolve one by one to tell which links failed.
+            resolved = []
+            for uri in uris:
+                try:
+                    resolved.append((uri, shared_folders.resolve_uris([uri])[0]))
+                except (DropboxWarning, ValueError), e:
+                    resolved.append((uri, e))
+        results = []
+        for (uri, filenames) in resolved:
+            if isinstance(filenames, Exception):
+                results.append({"uri": uri, "error": str(filenames)})
+            elif len(filenames) == 1 and not is_bundle_uri(uri):
+                results.append({"uri": uri, "filename": filenames[0], "filenames": filenames})
             else:
-                raise DropboxWarning("You can only link to items in shared folders")
+                results.append({"uri": uri, "filenames": filenames})
+        return results
+
+
+###########################################################################
+# Application.
+###########################################################################
+
+def main(rootdir, is_frozen, script_path):
+    try:
+        with timing.span("total"):
+            run(rootdir, is_frozen, script_path)
+    finally:
+        try:
+            timing.save(platform.get_cache_file("timings.hist"))
+        except EnvironmentError:
+            logging.exception("Could not save timings")
+
+
+def get_link_title(link):
+    rel_paths = link["rel_paths"]
+    if len(rel_paths) == 1:
+        return rel_paths[0]
+    return u"%s (%d items)" % (common_folder(rel_paths) or os.sep, len(rel_paths))
+
+
+def link_arguments(args, resolver=None):
+    """
+    Open the items linked by the URIs among ``args`` and copy links to the
+    items among them to the clipboard, using ``resolver`` (the resolver
+    daemon passes its own) or the shared folders of get_shared_folders().
+    """
+    with timing.span("args"):
+        uris, paths = vet_arguments(args)
+
+    if not (uris or paths):
+        return
+
+    if resolver is None:
+        with timing.span("load"):
+            resolver = DropboxURIResolver(lambda: get_shared_folders(len(uris) + len(paths)))
+
+    if uris:
+        with timing.span("decode"):
+            resolved = resolver.resolve_many(uris)
+        for result in resolved:
+            if "error" in result:
+                raise DropboxWarning(result["error"])
+        with timing.span("explore"):
+            explore_paths([filename for result in resolved
+                           for filename in result["filenames"]])
 
-        if clipboard_html:
+    with timing.span("encode"):
+        links = resolver.encode_bundles(paths)
+    for link in links:
+        if "error" in link:
+            raise DropboxWarning("You can only link to items in shared folders")
+
+    if links:
+        with timing.span("clipboard"):
             platform.set_clipboard_html(
-                "<br>".join(clipboard_html),
-                "\n".join(clipboard_text))
+                "<br>".join(u"<a href='%s'>%s</a>" % (link["url"], get_link_title(link))
+                            for link in links),
+                "\n".join(link["url"] for link in links))
+
 
+def launch(rootdir, is_frozen, script_path):
+    platform.setup(PROGRAM_TITLE, rootdir, is_frozen, script_path)
+
+    args = platform.get_argv(script_path)
+    window = get_burst_window(args)
+    if window:
+        import burst
+        with timing.span("coalesce"):
+            leader = burst.coalesce(args, window)
+        if leader is None:
+            return
+        # Keep the burst lock until the clipboard has been written.
+        with leader as args:
+            link_arguments(args)
+    else:
+        link_arguments(args)
+
+
+def run(rootdir, is_frozen, script_path):
+    report_errors(launch, rootdir, is_frozen, script_path)
+
+
+def report_errors(func, *args):
+    """
+    Call ``func(*args)`` and show a dialog for warnings and unexpected errors.
+    """
+    try:
+        func(*args)
     except DropboxWarning, e:
-        platform.show_warning_message(PROGRAM_TITLE, str(e) + "!")
+        with timing.span("dialog"):
+            show_dialog("warning", str(e).decode("utf-8") + u"!")
     except (KeyboardInterrupt, SystemExit):
         pass
     except:
         import traceback
         stacktrace = traceback.format_exc()
-        platform.show_error_message(PROGRAM_TITLE, stacktrace)
         logging.exception("Unhandled exception")
+        with timing.span("dialog"):
+            show_dialog("error", stacktrace.decode("utf-8", "replace"))
 
 
 ###########################################################################
@@ -0,0 +1,281 @@
+import os, sys
+import logging
+import marshal
+import stat
+import threading
+import time
+
+import atomicfile
+from dropbox import platform, fold_path
+
+###########################################################################
+# Name and size index of shared folders (locating moved items).
+###########################################################################
+#
+# Links keep pointing at the path an item had when the link was made. When
+# that path is gone resolve_dropbox_items() asks locate() which looks the
+# item up by name in a persistent index of the shared folder instead of
+# walking the file system: a dict from folded item name to the paths
+# (relative to the shared folder) of all items with that name. Candidates
+# need the size the item had at its old path (remembered when the index
+# noticed it disappear) or at least one folder of the old path in common,
+# otherwise a link to a deleted item would reveal any other item which
+# happens to have its name (the nearest existing ancestor is a better
+# guess). Ties are broken by size and then by how much of the old path the
+# candidates share.
+#
+# The index is refreshed incrementally like the link index (treeindex.py),
+# only directories whose mtime changed are listed again, and only when a
+# lookup misses (the Dropbox client's file journal in filecache.db would know
+# about moves too, but its schema is undocumented and changes between client
+# versions). A move only touches the mtime of the directories involved, so a
+# refresh still has to stat every directory: paths which can't be found even
+# after a refresh are remembered for MISS_TTL seconds and looked up again
+# without one. Each shared folder is saved in a marshal file in the cache.
+
+FILEINDEX_VERSION = 1
+
+# Sizes of vanished files remembered per shared folder.
+REMOVED_SIZE = 10000
+
+# Paths not found after a refresh remembered per shared folder (and for how
+# many seconds they are not worth another refresh).
+MISS_SIZE = 10000
+MISS_TTL = 60.0
+
+
+def list_directory(path):
+    """
+    Return (subdirs, {filename: size}) of directory ``path`` (symlinks are
+    treated as files so that we never leave the shared folder).
+    """
+    dirs, files = [], {}
+    for name in os.listdir(path):
+        st = os.lstat(os.path.join(path, name))
+        if stat.S_ISDIR(st.st_mode):
+            dirs.append(name)
+        else:
+            files[name] = st.st_size
+    dirs.sort()
+    return dirs, files
+
+
+class FileIndex(object):
+    """
+    Directory listings (``listings``, keyed by path relative to ``root``) of
+    shared folder ``namespace`` located at ``root`` plus the name index over
+    all of their items (``names``, folded name to relative paths) and sizes
+    of recently removed files (``removed``, keyed by folded relative path)
+    and when paths which couldn't be found were looked up (``misses``). The
+    index is only accessed with its ``lock`` held and ``generation`` counts
+    its refreshes.
+    """
+    def __init__(self, namespace, root, data=None):
+        self.namespace = namespace
+        self.root = root
+        data = data or {}
+        self.listings = data.get("listings", {})
+        self.names = data.get("names", {})
+        self.removed = data.get("removed", {})
+        self.misses = data.get("misses", {})
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    def data(self):
+        return {"version": FILEINDEX_VERSION, "root": self.root, "listings": self.listings,
+                "names": self.names, "removed": self.removed, "misses": self.misses}
+
+    def add_item(self, rel_path, name):
+        self.names.setdefault(fold_path(name), []).append(rel_path)
+
+    def remove_item(self, rel_path, name, size=None):
+        key = fold_path(name)
+        paths = self.names.get(key)
+        if paths and rel_path in paths:
+            paths.remove(rel_path)
+            if not paths:
+                del self.names[key]
+        if size is not None:
+            if len(self.removed) >= REMOVED_SIZE:
+                self.removed.clear()
+            self.removed[fold_path(rel_path)] = size
+
+    def update_listing(self, rel_dir, listing):
+        """
+        Replace the listing of ``rel_dir`` and update the name index with the
+        items which appeared or disappeared since the old listing.
+        """
+        (old_dirs, old_files) = self.listings.get(rel_dir, (0, [], {}))[1:]
+        (mtime, dirs, files) = listing
+        for name in set(old_dirs) - set(dirs):
+            self.remove_item(rel_dir + os.sep + name, name)
+        for name in set(old_files) - set(files):
+            self.remove_item(rel_dir + os.sep + name, name, old_files[name])
+        for name in set(dirs) - set(old_dirs):
+            self.add_item(rel_dir + os.sep + name, name)
+        for name in set(files) - set(old_files):
+            self.add_item(rel_dir + os.sep + name, name)
+        self.listings[rel_dir] = listing
+
+    def remove_listing(self, rel_dir):
+        (mtime, dirs, files) = self.listings.pop(rel_dir)
+        for name in dirs:
+            self.remove_item(rel_dir + os.sep + name, name)
+        for (name, size) in files.items():
+            self.remove_item(rel_dir + os.sep + name, name, size)
+
+    def refresh(self):
+        """
+        Bring the index up-to-date, only directories whose mtime changed are
+        listed. Returns the number of listed directories.
+        """
+        changed, seen, level = 0, set(), [u""]
+        while level:
+            next_level = []
+            for rel_dir in level:
+                path = self.root + rel_dir
+                try:
+                    mtime = os.stat(path).st_mtime
+                    listing = self.listings.get(rel_dir)
+                    if listing is None or listing[0] != mtime:
+                        listing = (mtime,) + list_directory(path)
+                        self.update_listing(rel_dir, listing)
+                        changed += 1
+                except OSError, e:
+                    logging.debug("Skipping %s: %s", path, e)
+                    continue
+                seen.add(rel_dir)
+                next_level.extend(rel_dir + os.sep + name for name in listing[1])
+            level = next_level
+        for rel_dir in set(self.listings) - seen:
+            self.remove_listing(rel_dir)
+            changed += 1
+        self.generation += 1
+        return changed
+
+    def add_miss(self, rel_path):
+        if len(self.misses) >= MISS_SIZE:
+            self.misses.clear()
+        self.misses[fold_path(rel_path)] = time.time()
+
+    def is_recent_miss(self, rel_path):
+        return time.time() - self.misses.get(fold_path(rel_path), 0) < MISS_TTL
+
+    def find(self, rel_path):
+        """
+        Return the current relative path of the item which used to be located
+        at ``rel_path`` or None if the index doesn't know any candidate with
+        the same size or a folder in common.
+        """
+        candidates = self.names.get(fold_path(os.path.basename(rel_path)))
+        if not candidates:
+            return None
+        size = self.removed.get(fold_path(rel_path))
+        parts = fold_path(rel_path).split(os.sep)
+
+        def score(candidate):
+            shared = 0
+            for (a, b) in zip(parts, fold_path(candidate).split(os.sep)):
+                if a != b:
+                    break
+                shared += 1
+            if size is not None:
+                (rel_dir, _, name) = candidate.rpartition(os.sep)
+                listing = self.listings.get(rel_dir)
+                same_size = listing is not None and listing[2].get(name) == size
+            else:
+                same_size = False
+            return (same_size, shared)
+        best = max(candidates, key=score)
+        (same_size, shared) = score(best)
+        # Relative paths start with os.sep, the first (empty) part is shared
+        # by all of them.
+        if not same_size and shared < 2:
+            return None
+        return best
+
+    def find_existing(self, rel_path):
+        """
+        Like find() but only returns candidates which still exist.
+        """
+        found = self.find(rel_path)
+        if found is None or not os.path.exists(self.root + found):
+            return None
+        return found
+
+
+###########################################################################
+# Persistence and lookup.
+###########################################################################
+
+# File indexes loaded by this process (the resolver daemon keeps them around),
+# the lock only guards the dict, every FileIndex has a lock of its own which
+# locate() holds while looking up and refreshing it.
+indexes = {}
+lock = threading.Lock()
+
+
+def get_index_file(namespace):
+    return platform.get_cache_file(os.path.join("fileindex", "%s.index" % namespace))
+
+
+def load_index(namespace, root):
+    """
+    Return the FileIndex of shared folder ``namespace`` located at ``root``,
+    loaded from the cache (empty if missing, outdated or moved). Must be
+    called with the module lock held.
+    """
+    index = indexes.get(namespace)
+    if index is not None and index.root == root:
+        return index
+    data = None
+    try:
+        f = open(get_index_file(namespace), "rb")
+        try:
+            data = marshal.load(f)
+        finally:
+            f.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+    if (not isinstance(data, dict) or data.get("version") != FILEINDEX_VERSION
+        or data.get("root") != root):
+        data = None
+    index = indexes[namespace] = FileIndex(namespace, root, data)
+    return index
+
+
+def save_index(index):
+    filename = get_index_file(index.namespace)
+    try:
+        atomicfile.write(filename, marshal.dumps(index.data()))
+    except EnvironmentError, e:
+        logging.debug("Failed to write file index %s: %s", filename, e)
+
+
+def locate(namespace, root, rel_path):
+    """
+    Return the local filename of the item of shared folder ``namespace``
+    (located at ``root``) which used to be at ``rel_path`` or None. The index
+    is only refreshed (and saved) if it has no candidate which still exists,
+    wasn't refreshed by another thread meanwhile and ``rel_path`` didn't miss
+    within the last MISS_TTL seconds.
+    """
+    with lock:
+        index = load_index(namespace, root)
+        generation = index.generation
+    with index.lock:
+        found = index.find_existing(rel_path)
+        if found is None and generation == index.generation:
+            if index.is_recent_miss(rel_path):
+                return None
+            index.refresh()
+            found = index.find_existing(rel_path)
+            if found is None:
+                index.add_miss(rel_path)
+            save_index(index)
+        return root + found if found is not None else None
+
+
+###########################################################################
+# The End.
+###########################################################################
@@ -0,0 +1,80 @@
+import sys
+import itertools
+import json
+import optparse
+import re
+
+import dropbox
+
+###########################################################################
+# Audit shared links found in mail/chat archives and web server logs.
+###########################################################################
+#
+# Scans text (stdin or files) for "dropbox:" URIs and share URLs and writes
+# one JSON Lines row per link with its shared folder namespace and relative
+# path (bundle links list the "paths" of all of their items instead). Links
+# are decoded in large batches via dropbox.decode_dropbox_uris() and links
+# which can't be decoded are flagged instead of aborting:
+#
+#   zcat access.log.*.gz | python linkaudit.py > links.jsonl
+
+BATCH_SIZE = 50000
+
+# dropbox: URIs, share URLs and requests in the link web server's access log.
+LINK_RE = re.compile(r'(?:dropbox:|sharedropbox\.com/|"(?:GET|HEAD) /)([a-zA-Z0-9_\-]+)')
+
+
+def iter_links(lines):
+    """
+    Yield the URI (with protocol prefix) of every link found in ``lines``.
+    """
+    findall, prefix = LINK_RE.findall, dropbox.PROTOCOL_URI_PREFIX
+    for line in lines:
+        for data in findall(line):
+            yield prefix + data
+
+
+def audit_links(uris, batch_size=BATCH_SIZE):
+    """
+    Yield (uri, namespace, path, valid) for ``uris`` decoded in batches.
+    """
+    uris = iter(uris)
+    while True:
+        batch = list(itertools.islice(uris, batch_size))
+        if not batch:
+            break
+        namespaces, paths, valid = dropbox.decode_dropbox_uris(batch)
+        for row in itertools.izip(batch, namespaces, paths, valid):
+            yield row
+
+
+def write_jsonl(out, rows):
+    write = out.write
+    for (uri, namespace, path, valid) in rows:
+        if isinstance(path, tuple):
+            row = {"uri": uri, "namespace": namespace, "paths": path, "valid": valid}
+        else:
+            row = {"uri": uri, "namespace": namespace, "path": path, "valid": valid}
+        write("%s\n" % json.dumps(row))
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [FILE ...]")
+    (options, args) = parser.parse_args(argv[1:])
+    files = [open(filename, "rb") for filename in args] or [sys.stdin]
+    try:
+        lines = itertools.chain.from_iterable(files)
+        write_jsonl(sys.stdout, audit_links(iter_links(lines)))
+    finally:
+        for f in files:
+            if f is not sys.stdin:
+                f.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+
+###########################################################################
+# The End.
+###########################################################################
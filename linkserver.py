@@ -0,0 +1,179 @@
+import sys
+import json
+import optparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import dropbox
+
+###########################################################################
+# Local HTTP link resolution service.
+###########################################################################
+#
+# Serves http://<host>/<uri> directly instead of the Apache rewrite to
+# open.html (which loads jQuery from a CDN before bouncing to the dropbox:
+# protocol). Valid links are answered with a tiny page redirecting to the
+# protocol handler, or with the decoded link metadata as JSON if requested
+# via "?format=json" or an "Accept: application/json" header (responses vary
+# by Accept so caches must key on it). Connections are kept alive (HTTP/1.1)
+# and every response is written with a single send.
+#
+#   python linkserver.py --port 8080 [--resolve]
+#
+# Note: the stdlib server is used on purpose (Python 2 has no asyncio), one
+# thread per connection, see "python benchmark.py linkserver" for a load test.
+
+DEFAULT_PORT = 8080
+MAX_HEADERS = 100
+MAX_LINE_SIZE = 65536
+
+REDIRECT_PAGE = """\
+<!doctype html>
+<html><head><meta charset="utf-8"><title>Share Dropbox URI</title>
+<meta http-equiv="refresh" content="0;url=%(uri)s"></head>
+<body><a href="%(uri)s">Show the shared file/folder</a></body></html>
+"""
+
+NOT_FOUND_PAGE = """\
+<!doctype html>
+<html><head><meta charset="utf-8"><title>Share Dropbox URI</title></head>
+<body>Sorry, the shared Dropbox URI is not valid!</body></html>
+"""
+
+# Links never change so successful responses can be cached for good.
+CACHE_FOREVER = "public, max-age=31536000"
+
+
+def resolve_link(data, resolver=None):
+    """
+    Return JSON metadata (dict) for link ``data`` (URI without protocol
+    prefix) or None if it isn't a valid Dropbox URI. The local ``filename``
+    is included if a dropbox.DropboxURIResolver is available (bundle URIs
+    list ``paths`` and ``filenames`` instead).
+    """
+    uri = dropbox.PROTOCOL_URI_PREFIX + data
+    if not dropbox.is_valid_dropbox_uri(uri):
+        return None
+    try:
+        namespace, paths = dropbox.decode_dropbox_bundle(data)
+    except ValueError:
+        return None
+    info = {"uri": uri, "url": dropbox.SHARE_URL_PREFIX + data, "namespace": namespace}
+    bundle = dropbox.is_bundle_uri(uri)
+    if bundle:
+        info["paths"] = paths
+    else:
+        info["path"] = paths[0]
+    if resolver is not None:
+        filenames = resolver.resolve_many([uri])[0].get("filenames", [None] * len(paths))
+        if bundle:
+            info["filenames"] = filenames
+        else:
+            info["filename"] = filenames[0]
+    return info
+
+
+class RequestHeaders(dict):
+    """
+    Minimal (and much faster) stand-in for mimetools.Message, request headers
+    keyed by lowercase name.
+    """
+    def __init__(self, fp, seekable=0):
+        dict.__init__(self)
+        for n in range(MAX_HEADERS):
+            line = fp.readline(MAX_LINE_SIZE)
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            self[name.strip().lower()] = value.strip()
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+    getheader = get
+
+
+class LinkRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    MessageClass = RequestHeaders
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        info = resolve_link(path[1:], self.server.resolver)
+        want_json = ("format=json" in query.split("&") or
+                     "application/json" in self.headers.get("Accept", ""))
+        if want_json:
+            content_type = "application/json"
+            body = json.dumps(info if info else {"error": "Invalid Dropbox URI"})
+        elif info:
+            content_type = "text/html; charset=utf-8"
+            body = REDIRECT_PAGE % {"uri": info["uri"]}
+        else:
+            content_type = "text/html; charset=utf-8"
+            body = NOT_FOUND_PAGE
+        self.respond(200 if info else 404, content_type, body,
+                     CACHE_FOREVER if info and self.server.resolver is None else "no-cache")
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def respond(self, code, content_type, body, cache_control):
+        """
+        Write the complete response with a single write (no Nagle delays).
+        """
+        head = ("%s %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                "Cache-Control: %s\r\nVary: Accept\r\n%s\r\n" % (
+                    self.protocol_version, code, self.responses[code][0], content_type,
+                    len(body), cache_control,
+                    "Connection: close\r\n" if self.close_connection else ""))
+        self.wfile.write(head if self.command == "HEAD" else head + body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LinkServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server answering link requests, optionally resolving them
+    to local filenames via dropbox.DropboxURIResolver ``resolver``.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, resolver=None):
+        HTTPServer.__init__(self, address, LinkRequestHandler)
+        self.resolver = resolver
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--host", default="127.0.0.1", help="interface to listen on")
+    parser.add_option("-p", "--port", type="int", default=DEFAULT_PORT,
+                      help="port to listen on (0 picks a free port)")
+    parser.add_option("--resolve", action="store_true", default=False,
+                      help="include local filenames in JSON responses")
+    (options, args) = parser.parse_args(argv[1:])
+    # Serves any number of requests, reloaded whenever the Dropbox state changed.
+    resolver = (dropbox.DropboxURIResolver(lambda: dropbox.load_shared_folders(None))
+                if options.resolve else None)
+    server = LinkServer((options.host, options.port), resolver)
+    print "Serving on http://%s:%d/" % server.server_address
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+
+###########################################################################
+# The End.
+###########################################################################
@@ -0,0 +1,120 @@
+import atexit
+import logging
+import threading
+
+from collections import deque
+
+###########################################################################
+# Non-blocking logging (QueueHandler/QueueListener for Python 2).
+###########################################################################
+#
+# Log records are put on a queue by the logging call and written by a
+# background thread so that user-visible actions never wait on disk I/O or
+# log rotation. Records are formatted by the writer thread too, call sites
+# pass arguments (logging.debug("Exploring: %s", path)) instead of building
+# messages themselves so that nothing is formatted unless it is written.
+
+class RecordQueue(object):
+    """
+    Minimal single consumer queue, appending is a plain deque.append() and
+    the consumer drains everything queued per wake-up. Every put() signals
+    the consumer: checking for an empty queue first can't be done atomically
+    with the append and concurrent producers could both miss the wake-up.
+    """
+    def __init__(self):
+        self.records = deque()
+        self.ready = threading.Event()
+
+    def put(self, record):
+        self.records.append(record)
+        self.ready.set()
+
+    def drain(self):
+        """
+        Wait for and return all queued records.
+        """
+        self.ready.wait()
+        self.ready.clear()
+        records = []
+        while self.records:
+            records.append(self.records.popleft())
+        return records
+
+
+class QueueHandler(logging.Handler):
+    """
+    Handler which puts records on ``queue`` (like Python 3's QueueHandler
+    but records are handed over as is, we never leave the process).
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def emit(self, record):
+        try:
+            if record.exc_info:
+                # Render tracebacks right away, the frames won't stay around.
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put(record)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """
+    Background thread passing records from ``queue`` on to ``handlers``.
+    """
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.monitor, name="QueueListener")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def monitor(self):
+        while True:
+            for record in self.queue.drain():
+                if record is None:
+                    return
+                self.handle(record)
+
+    def stop(self, timeout=5.0):
+        """
+        Write all pending records and stop the background thread.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+        for handler in self.handlers:
+            handler.close()
+
+
+def start(handlers, logger=None):
+    """
+    Route records of ``logger`` (root logger by default) to ``handlers`` via
+    a background writer thread which is drained at exit. Returns the
+    QueueListener.
+    """
+    queue = RecordQueue()
+    listener = QueueListener(queue, *handlers)
+    (logger or logging.getLogger()).addHandler(QueueHandler(queue))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+###########################################################################
+# The End.
+###########################################################################
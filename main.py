@@ -1,25 +1,69 @@
 import os, sys
 import logging
-import logging.handlers
 
 ###########################################################################
 # Application entry-point.
 ###########################################################################
 
 def setup_logfile(rootdir, is_frozen, logname):
-    logging.getLogger().setLevel(logging.DEBUG)
+    """
+    Log to the console (when not frozen) and ``logname`` via a background
+    writer. The level and log file can be overridden by DROPBOX_URI_LOG_LEVEL
+    (e.g. "warning") and DROPBOX_URI_LOG_FILE ("none" disables the file),
+    DROPBOX_URI_LOG_QUEUE=0 writes synchronously instead.
+    """
+    level = os.environ.get("DROPBOX_URI_LOG_LEVEL", "debug").upper()
+    logging.getLogger().setLevel(getattr(logging, level, logging.DEBUG))
+    handlers = []
     if not is_frozen:
-        logging.getLogger().addHandler(logging.StreamHandler())
-    if sys.platform == "win32":
-        logfile = os.path.join(rootdir, logname)
-    elif sys.platform == "darwin":
-        logfile = os.path.join(os.path.expanduser("~/Library/Logs"), logname)
+        handlers.append(logging.StreamHandler())
+    logfile = os.environ.get("DROPBOX_URI_LOG_FILE")
+    if not logfile:
+        if sys.platform == "win32":
+            logfile = os.path.join(rootdir, logname)
+        elif sys.platform == "darwin":
+            logfile = os.path.join(os.path.expanduser("~/Library/Logs"), logname)
+        elif os.environ.get("DROPBOX_URI_PLATFORM"):
+            # Headless backends (servers) log to the console only.
+            logfile = "none"
+        else:
+            raise NotImplementedError("Unsupported platform")
+    if logfile != "none":
+        from logging.handlers import RotatingFileHandler
+        filelogger = RotatingFileHandler(
+            logfile, maxBytes=512*1024)
+        filelogger.setFormatter(logging.Formatter("%(asctime)s : %(message)s"))
+        handlers.append(filelogger)
+    if not handlers:
+        return
+    if os.environ.get("DROPBOX_URI_LOG_QUEUE", "1") != "0":
+        import logqueue
+        logqueue.start(handlers)
     else:
-        raise NotImplementedError("Unsupported platform")
-    filelogger = logging.handlers.RotatingFileHandler(
-        logfile, maxBytes=512*1024)
-    filelogger.setFormatter(logging.Formatter("%(asctime)s : %(message)s"))
-    logging.getLogger().addHandler(filelogger)
+        for handler in handlers:
+            logging.getLogger().addHandler(handler)
+
+
+def run_via_daemon(script_path):
+    """
+    Hand this launch over to a running resolver daemon (see daemon.py),
+    returns False if there is none (or it can't run launches). Only imports
+    the platform backend and the daemon client, the daemon takes care of
+    logging and showing dialogs.
+    """
+    import daemon
+    client = daemon.connect()
+    if client is None:
+        return False
+    try:
+        return client.run(daemon.platform.get_argv(script_path))
+    except (IOError, EOFError, RuntimeError), e:
+        # Never run it ourselves once sent, the daemon may be running it
+        # and we'd reveal and write the clipboard twice.
+        logging.getLogger().debug("Resolver daemon failed to acknowledge launch: %s", e)
+        return True
+    finally:
+        client.close()
 
 
 if __name__ == '__main__':
@@ -37,13 +81,27 @@ if __name__ == '__main__':
         else:
             script_path = os.path.join(rootdir, sys.argv[0])
 
-        setup_logfile(rootdir, is_frozen, 'dropbox_uri.log')
-
         os.chdir(rootdir)
 
-        import dropbox
+        commands = ("--daemon", "--dialog", "--timings")
+        if not any(command in sys.argv for command in commands) and run_via_daemon(script_path):
+            sys.exit(0)
 
-        dropbox.main(rootdir, is_frozen, script_path)
+        setup_logfile(rootdir, is_frozen, 'dropbox_uri.log')
+
+        if "--daemon" in sys.argv:
+            import daemon, dropbox
+            dropbox.platform.setup(dropbox.PROGRAM_TITLE, rootdir, is_frozen, script_path)
+            daemon.serve()
+        elif "--dialog" in sys.argv:
+            import dropbox
+            dropbox.platform.show_dialog_file(sys.argv[sys.argv.index("--dialog") + 1])
+        elif "--timings" in sys.argv:
+            import dropbox, timing
+            timing.dump(dropbox.platform.get_cache_file("timings.hist"))
+        else:
+            import dropbox
+            dropbox.main(rootdir, is_frozen, script_path)
     finally:
         pass
 
@@ -0,0 +1,121 @@
+import sys
+import atexit
+import json
+import logging
+import subprocess
+import threading
+
+###########################################################################
+# Long-lived helper process speaking a line-delimited protocol.
+###########################################################################
+#
+# Spawning osascript costs a process launch plus compiling the script for
+# every single action. Instead a worker is started on demand which compiles
+# its scripts once and then executes one command per line read on stdin:
+#
+#   -> ["reveal", "/Users/me/Dropbox/a.txt", "/Users/me/Dropbox/b.txt"]\n
+#   <- {}\n
+#   -> ["dialog", "Share Dropbox", "Oops!", 2, 30]\n
+#   <- {"error": "..."}\n
+#
+# Requests and replies are JSON (ASCII only), replies are an empty object on
+# success or carry an "error" message. The worker exits on end of input,
+# which we send once it has been idle for ``idle_timeout`` seconds (or when
+# we exit) and a new worker is spawned by the next call.
+
+IDLE_TIMEOUT = 60.0
+
+
+class WorkerError(RuntimeError):
+    """
+    Worker couldn't be started or died while handling a request.
+    """
+    pass
+
+
+class ScriptWorker(object):
+    """
+    Runs commands in worker process ``command`` (argument list) which is
+    started on demand, reused for all calls and shut down when idle.
+    """
+    def __init__(self, command, idle_timeout=IDLE_TIMEOUT):
+        self.command = command
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.proc = None
+        self.timer = None
+        self.spawned = 0
+        atexit.register(self.stop)
+
+    def start(self):
+        logging.debug("Starting worker: %s", self.command[0])
+        try:
+            self.proc = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, close_fds=sys.platform != "win32")
+        except OSError, e:
+            raise WorkerError("Could not start worker: %s" % e)
+        self.spawned += 1
+
+    def call(self, command, *args):
+        """
+        Run ``command`` with ``args`` in the worker and return its reply (a
+        dict). A worker which died in the meantime is restarted once.
+        """
+        request = json.dumps([command] + list(args)) + "\n"
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            for attempt in range(2):
+                if self.proc is None or self.proc.poll() is not None:
+                    self.start()
+                try:
+                    self.proc.stdin.write(request)
+                    self.proc.stdin.flush()
+                    reply = self.proc.stdout.readline()
+                except IOError:
+                    reply = ""
+                if reply:
+                    break
+                self._stop()
+            else:
+                raise WorkerError("Worker died handling: %s" % command)
+            self.timer = threading.Timer(self.idle_timeout, self.idle)
+            self.timer.args = (self.timer,)
+            self.timer.daemon = True
+            self.timer.start()
+        try:
+            return json.loads(reply)
+        except ValueError:
+            raise WorkerError("Malformed worker reply: %r" % reply)
+
+    def idle(self, timer):
+        with self.lock:
+            # Unless a call came in (and rescheduled us) just now.
+            if self.timer is timer:
+                self.timer = None
+                self._stop()
+
+    def _stop(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+            except IOError:
+                pass
+            self.proc.wait()
+            self.proc = None
+
+    def stop(self):
+        """
+        Shut the worker down (if running), the next call starts a new one.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self._stop()
+
+
+###########################################################################
+# The End.
+###########################################################################
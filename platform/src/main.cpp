@@ -270,6 +270,46 @@ extern "C"
         return -1;
     }
 
+    DLLEXPORT int explore_paths(const wchar_t* folder, const wchar_t** filenames, int count)
+    {
+        ::CoInitialize(NULL);
+
+        LPITEMIDLIST pidlFolder = NULL;
+
+        if (FAILED(::SHParseDisplayName(folder, NULL, &pidlFolder, 0, NULL)))
+        {
+            return -1;
+        }
+
+        std::vector<LPCITEMIDLIST> items;
+
+        for (int i = 0; i < count; i++)
+        {
+            LPITEMIDLIST pidl = NULL;
+
+            if (SUCCEEDED(::SHParseDisplayName(filenames[i], NULL, &pidl, 0, NULL)))
+            {
+                items.push_back(pidl);
+            }
+        }
+
+        HRESULT hRet = E_FAIL;
+
+        if (!items.empty())
+        {
+            hRet = ::SHOpenFolderAndSelectItems(pidlFolder, items.size(), &items[0], 0);
+        }
+
+        for (size_t i = 0; i < items.size(); i++)
+        {
+            ::CoTaskMemFree(const_cast<LPITEMIDLIST>(items[i]));
+        }
+
+        ::CoTaskMemFree(pidlFolder);
+
+        return SUCCEEDED(hRet) ? 0 : -1;
+    }
+
     DLLEXPORT int is_admin()
 	{
 		PSID AdministratorsGroup;
@@ -0,0 +1,196 @@
+import os, sys
+import logging
+
+###########################################################################
+# Headless backend (select with DROPBOX_URI_PLATFORM=headless).
+###########################################################################
+#
+# Runs the URI engine on servers (build and link-service hosts) without any
+# GUI. Instead of the clipboard, file browser and dialogs every action is
+# written as a line of text to ``output`` (stdout by default or the file
+# named by DROPBOX_URI_OUTPUT) or handed to a callback installed with
+# set_handler(). Dropbox databases are looked up in DROPBOX_URI_DBDIR and
+# fall back to ~/.dropbox like on Mac OS X. DROPBOX_URI_DIALOG_COMMAND can
+# name a stand-in for dialogs which is run instead of writing to stderr.
+
+output = None
+handlers = {}
+
+
+def set_output(target):
+    """
+    Write actions to ``target``, a file object or filename (appended to).
+    """
+    global output
+    if isinstance(target, basestring):
+        target = open(target, "ab")
+    output = target
+
+
+def set_handler(action, func):
+    """
+    Pass ``action`` ("clipboard", "explore" or "message") to ``func`` instead
+    of writing it to ``output``, unregisters the handler if ``func`` is None.
+    Clipboard handlers are called with (html, text), explore handlers with
+    (folder, filenames) and message handlers with (level, title, message).
+    """
+    if func is None:
+        handlers.pop(action, None)
+    else:
+        handlers[action] = func
+
+
+def get_output():
+    if output is None:
+        if os.environ.get("DROPBOX_URI_OUTPUT"):
+            set_output(os.environ["DROPBOX_URI_OUTPUT"])
+        else:
+            set_output(sys.stdout)
+    return output
+
+
+def write_lines(lines):
+    f = get_output()
+    f.write("".join(line.encode("utf-8") + "\n" for line in lines))
+    f.flush()
+
+
+###########################################################################
+# Module public interface.
+###########################################################################
+
+def get_dropbox_dbfile(filename):
+    """
+    Locate Dropbox SQLite database ``filename`` in DROPBOX_URI_DBDIR or in
+    users home folder.
+    """
+    dbdir = os.environ.get("DROPBOX_URI_DBDIR") or os.path.expanduser("~/.dropbox")
+    return os.path.normpath(os.path.join(dbdir, filename))
+
+
+def get_cache_file(filename):
+    """
+    Locate private cache file ``filename`` in users (XDG) cache folder.
+    """
+    cachedir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cachedir, "dropbox-uri", filename)
+
+
+def get_daemon_address():
+    """
+    Return the Unix domain socket address used by the resolver daemon.
+    """
+    return get_cache_file("daemon.sock")
+
+
+def set_clipboard_html(html, text):
+    """
+    Emit the generated links, one plain text link per line.
+    """
+    handler = handlers.get("clipboard")
+    if handler is not None:
+        handler(html, text)
+    else:
+        write_lines(text.splitlines())
+
+
+def get_argv(script=None):
+    """
+    Return sys.argv (as unicode) without the executable and ``script``.
+    """
+    if script:
+        script = os.path.abspath(os.path.normpath(script))
+    encoding = sys.getfilesystemencoding() or "utf-8"
+    argv = []
+    for arg in sys.argv:
+        a = arg.decode(encoding)
+        if script and os.path.abspath(os.path.normpath(a)) == script:
+            continue
+        if a.endswith(sys.executable):
+            continue
+        argv.append(a)
+    return argv
+
+
+def explore_path(filename):
+    explore_paths(os.path.dirname(filename), [filename])
+
+
+def explore_paths(folder, filenames):
+    """
+    Emit resolved ``filenames`` (located in ``folder``), one per line.
+    """
+    handler = handlers.get("explore")
+    if handler is not None:
+        handler(folder, filenames)
+    else:
+        write_lines(filenames)
+
+
+def get_dialog_command(level, title, message):
+    """
+    Return the stand-in dialog command (DROPBOX_URI_DIALOG_COMMAND, passed
+    the level, title and message) or None if messages go to stderr.
+    """
+    if not os.environ.get("DROPBOX_URI_DIALOG_COMMAND"):
+        return None
+    import shlex
+    return shlex.split(os.environ["DROPBOX_URI_DIALOG_COMMAND"]) + [
+        level, title.encode("utf-8"), message.encode("utf-8")]
+
+
+def show_message(level, title, message):
+    logging.debug("%s %s", level.capitalize(), message)
+    handler = handlers.get("message")
+    command = get_dialog_command(level, title, message)
+    if handler is not None:
+        handler(level, title, message)
+    elif command is not None:
+        import subprocess
+        subprocess.call(command)
+    else:
+        sys.stderr.write("%s: %s\n" % (level, message.encode("utf-8")))
+
+
+def show_message_detached(level, title, message):
+    """
+    Like show_message() but a stand-in dialog command is left running.
+    """
+    command = get_dialog_command(level, title, message)
+    if command is None or handlers.get("message") is not None:
+        return show_message(level, title, message)
+    logging.debug("%s %s", level.capitalize(), message)
+    import subprocess
+    devnull = open(os.devnull, "r+b")
+    try:
+        subprocess.Popen(command, stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True)
+    finally:
+        devnull.close()
+
+
+def show_info_message(title, message):
+    show_message("info", title, message)
+
+
+def show_warning_message(title, message):
+    show_message("warning", title, message)
+
+
+def show_error_message(title, message):
+    show_message("error", title, message)
+
+
+def is_admin():
+    """
+    Returns True if process is running as root.
+    """
+    return hasattr(os, "getuid") and os.getuid() == 0
+
+
+def setup(title, rootdir, is_frozen, script_path=None):
+    pass
+
+
+###########################################################################
+# The End.
+###########################################################################
@@ -1,30 +1,144 @@
 import os, sys
 import logging
+import re
 import subprocess
-import shutil
 
 ###########################################################################
 # Helper scripts.
 ###########################################################################
 
 FINDER_SELECT_SCRIPT = """\
-on run {filename}
-    set filepath to POSIX file filename
+on run filenames
+    set filepaths to {}
+    repeat with filename in filenames
+        set end of filepaths to POSIX file (filename as text)
+    end repeat
     tell application "Finder"
-        reveal filepath
+        reveal filepaths
         activate
     end tell
 end run
 """
 
 ALERT_DIALOG_SCRIPT = """\
-tell application "Finder"
-    delay 0
-    activate
-    display dialog "%(message)s" with title "%(title)s" buttons {"OK"} default button 1 with icon %(icon)s giving up after %(timeout)d
-end tell
+on run {dialogTitle, dialogMessage, dialogIcon, dialogTimeout}
+    tell application "Finder"
+        delay 0
+        activate
+        display dialog dialogMessage with title dialogTitle buttons {"OK"} default button 1 with icon (dialogIcon as integer) giving up after (dialogTimeout as integer)
+    end tell
+end run
 """
 
+# Keep osascript command lines well below ARG_MAX (256KB on Mac OS X).
+MAX_SCRIPT_ARGS_SIZE = 128 * 1024
+
+HELPER_SCRIPTS = {
+    "reveal" : FINDER_SELECT_SCRIPT,
+    "dialog" : ALERT_DIALOG_SCRIPT,
+}
+
+# Worker (see osaworker.py) compiling the helper scripts (passed as arguments
+# in the order of WORKER_SCRIPTS) once and running them on request.
+WORKER_SCRIPTS = ["reveal", "dialog"]
+
+WORKER_SCRIPT = """\
+ObjC.import("Foundation");
+ObjC.import("OSAKit");
+
+function run(argv) {
+    var names = %s;
+    var language = $.OSALanguage.languageForName("AppleScript");
+    var scripts = {};
+    for (var i = 0; i < names.length; i++) {
+        scripts[names[i]] = $.OSAScript.alloc.initWithSourceLanguage(argv[i], language);
+        if (!scripts[names[i]].compileAndReturnError(null)) {
+            throw new Error("Could not compile " + names[i]);
+        }
+    }
+    var stdin = $.NSFileHandle.fileHandleWithStandardInput;
+    var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+    var buffer = "";
+    while (true) {
+        var end = buffer.indexOf("\\n");
+        if (end < 0) {
+            var data = stdin.availableData;
+            if (data.length == 0) {
+                return;
+            }
+            buffer += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+            continue;
+        }
+        var request = JSON.parse(buffer.slice(0, end));
+        buffer = buffer.slice(end + 1);
+        var reply = {};
+        var script = scripts[request[0]];
+        var error = Ref();
+        if (!script) {
+            reply.error = "Unknown command: " + request[0];
+        } else if (script.executeHandlerWithNameArgumentsError("run", [request.slice(1)], error).isNil()) {
+            reply.error = String(ObjC.deepUnwrap(error[0]));
+        }
+        stdout.writeData($(JSON.stringify(reply) + "\\n").dataUsingEncoding($.NSUTF8StringEncoding));
+    }
+}
+""" % repr(WORKER_SCRIPTS).replace("'", '"')
+
+DIALOG_ICONS = {"stop": 0, "note": 1, "caution": 2}
+
+_worker = None
+
+
+def get_worker():
+    """
+    Return the AppleScript worker, DROPBOX_URI_OSA_WORKER can name a stand-in
+    command (it is passed the helper scripts as arguments as well).
+    """
+    global _worker
+    if _worker is None:
+        import osaworker
+        if os.environ.get("DROPBOX_URI_OSA_WORKER"):
+            import shlex
+            command = shlex.split(os.environ["DROPBOX_URI_OSA_WORKER"])
+        else:
+            command = ["osascript", "-l", "JavaScript", "-e", WORKER_SCRIPT]
+        _worker = osaworker.ScriptWorker(command + [HELPER_SCRIPTS[name] for name in WORKER_SCRIPTS])
+    return _worker
+
+
+def run_script(name, args):
+    """
+    Run helper script ``name`` with ``args`` (its run handler parameters) in
+    the AppleScript worker, falling back to a one-off osascript if the worker
+    is unavailable.
+    """
+    import osaworker
+    try:
+        reply = get_worker().call(name, *args)
+        if reply.get("error"):
+            logging.debug("Helper script %s failed: %s", name, reply["error"])
+        return
+    except osaworker.WorkerError, e:
+        logging.debug("AppleScript worker unavailable: %s", e)
+    encoding = sys.getfilesystemencoding()
+    batch, size = [], 0
+    for arg in args:
+        arg = arg.encode(encoding) if isinstance(arg, unicode) else str(arg)
+        if name == "reveal" and batch and size + len(arg) > MAX_SCRIPT_ARGS_SIZE:
+            _spawn_script(name, batch)
+            batch, size = [], 0
+        batch.append(arg)
+        size += len(arg) + 1
+    _spawn_script(name, batch)
+
+
+def _spawn_script(name, args):
+    p = subprocess.Popen(["osascript", "-"] + args,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    p.communicate(HELPER_SCRIPTS[name])
+
+
 ###########################################################################
 # Utilities.
 ###########################################################################
@@ -34,12 +148,98 @@ def show_message_box(title, message, icon=1, timeout=30):
     Display a simple alert dialog with ``title`` and ``message`` and an
     optional icon ('stop' or 'caution') and ``timeout`` limit in seconds.
     """
-    p = subprocess.Popen(["osascript", "-"], stdin=subprocess.PIPE,
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = p.communicate(ALERT_DIALOG_SCRIPT %
-                                   dict(title=title.replace('"', '\\"'),
-                                        message=message.replace('"', '\\"'),
-                                        icon=icon, timeout=timeout))
+    run_script("dialog", [title, message, DIALOG_ICONS.get(icon, icon), timeout])
+
+
+###########################################################################
+# HTML to RTF conversion (clipboard).
+###########################################################################
+#
+# Only handles the subset of HTML we generate ourselves, i.e. text, <a> links
+# and <br> line breaks, every other tag is dropped (keeping its text). The
+# output is pure 7-bit RTF with \uN escapes so it can be handed to pbcopy
+# as is without spawning textutil for the conversion.
+
+RTF_HEADER = ("{\\rtf1\\ansi\\ansicpg1252\\uc1\\deff0"
+              "{\\fonttbl{\\f0\\fswiss\\fcharset0 Helvetica;}}\n"
+              "\\f0\\fs24 ")
+RTF_FOOTER = "}"
+
+HTML_TOKEN_RE = re.compile(r"""<a\s[^>]*?href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]*))[^>]*>"""
+                           r"""|(</a\s*>)|(<br\s*/?>)|<[^>]*>|([^<]+|<)""", re.I)
+HTML_ENTITY_RE = re.compile(r"&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z]+[0-9]*);")
+RTF_SPECIAL_RE = re.compile(u"[\\\\{}\"]|[^\x20-\x7e]")
+
+
+def _unescape_entity(match):
+    import htmlentitydefs
+    name = match.group(1)
+    try:
+        if name[:2] in ("#x", "#X"):
+            return unichr(int(name[2:], 16))
+        if name[0] == "#":
+            return unichr(int(name[1:]))
+        return unichr(htmlentitydefs.name2codepoint[name])
+    except (KeyError, ValueError, OverflowError):
+        return match.group(0)
+
+
+def _escape_rtf_char(match):
+    c = match.group(0)
+    if c in u'\\{}':
+        return u"\\" + c
+    if c == u'"':
+        return u"\\'22"
+    if c == u"\t":
+        return u"\\tab "
+    if c in u"\r\n":
+        return u" "
+    code = ord(c)
+    if code < 0x20 or code == 0x7f:
+        return u""
+    if 0x10000 <= code:
+        # Wide Python builds: split astral characters into surrogate pairs.
+        code -= 0x10000
+        return u"\\u%d?\\u%d?" % (0xd800 + (code >> 10) - 0x10000,
+                                  0xdc00 + (code & 0x3ff) - 0x10000)
+    return u"\\u%d?" % (code if code < 0x8000 else code - 0x10000)
+
+
+def rtf_escape(text):
+    """
+    Return unicode ``text`` as 7-bit RTF text (``str``).
+    """
+    return RTF_SPECIAL_RE.sub(_escape_rtf_char, text).encode("ascii")
+
+
+def html_to_rtf(html):
+    """
+    Convert ``html`` (unicode, anchors and line breaks only) to a RTF document
+    (``str``) with clickable hyperlinks.
+    """
+    chunks = [RTF_HEADER]
+    append = chunks.append
+    unescape = lambda s: HTML_ENTITY_RE.sub(_unescape_entity, s) if "&" in s else s
+    in_link = False
+    for (dquoted, squoted, unquoted, end_link, line_break, text) in HTML_TOKEN_RE.findall(html):
+        if text:
+            append(rtf_escape(unescape(text)))
+        elif line_break:
+            append("\\line\n")
+        elif end_link:
+            if in_link:
+                append("}}")
+                in_link = False
+        elif dquoted or squoted or unquoted:
+            if in_link:
+                append("}}")
+            href = unescape(dquoted or squoted or unquoted)
+            append('{\\field{\\*\\fldinst{HYPERLINK "%s"}}{\\fldrslt ' % rtf_escape(href))
+            in_link = True
+    if in_link:
+        append("}}")
+    append(RTF_FOOTER)
+    return "".join(chunks)
 
 
 ###########################################################################
@@ -53,24 +253,31 @@ def get_dropbox_dbfile(filename):
     return os.path.normpath(os.path.join(os.path.expanduser("~/.dropbox"), filename))
 
 
+def get_cache_file(filename):
+    """
+    Locate private cache file ``filename`` in users cache folder.
+    """
+    return os.path.join(os.path.expanduser("~/Library/Caches/DropboxURI"), filename)
+
+
+def get_daemon_address():
+    """
+    Return the Unix domain socket address used by the resolver daemon.
+    """
+    return os.path.expanduser("~/Library/Caches/DropboxURI.sock")
+
+
 def set_clipboard_html(html, text):
     """
     Set global clipboard content to `html` (encoded as raw HTML text) as well
     as `text` which is intended to be a unicode fallback for handlers which
     don't support HTML clipboard content.
     """
-    p = subprocess.Popen("textutil -stdin -inputencoding utf-8 -format html -convert rtf -encoding utf-8 -stdout",
+    # pbcopy recognizes the RTF header and stores the data as rich text.
+    p = subprocess.Popen(["pbcopy"],
                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, shell=True)
-    stdout, stderr = p.communicate(html.encode("utf-8"))
-
-    rtf = stdout.decode("utf-8")
-
-    p = subprocess.Popen("pbcopy",
-                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, shell=True)
-    stdout, stderr = p.communicate(rtf.encode("utf-8"))
-
+                         stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate(html_to_rtf(html))
 
 
 def get_argv(script=None):
@@ -87,10 +294,8 @@ def get_argv(script=None):
     argv = []
     for i in range(len(sys.argv)):
         a = sys.argv[i].decode(sys.getfilesystemencoding())
-        if os.path.exists(a):
-            a = os.path.abspath(os.path.normpath(a))
-            if a == script:
-                continue
+        if script and os.path.abspath(os.path.normpath(a)) == script:
+            continue
         if a.endswith(sys.executable):
             continue
         argv.append(a)
@@ -101,18 +306,22 @@ def explore_path(filename):
     """
     Open the OS file browser and navigate/select the `filename` resource.
     """
-    filename = filename.encode(sys.getfilesystemencoding())
-    p = subprocess.Popen(["osascript", "-", filename],
-                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    stdout, stderr = p.communicate(FINDER_SELECT_SCRIPT)
+    explore_paths(os.path.dirname(filename), [filename])
+
+
+def explore_paths(folder, filenames):
+    """
+    Open a single OS file browser window for `folder` with all `filenames`
+    (items located in `folder`) selected.
+    """
+    run_script("reveal", filenames)
 
 
 def show_info_message(title, message):
     """
     Show simple modal OS specific messagebox/dialog with info message.
     """
-    logging.debug("Info %s" % message.encode("utf-8"))
+    logging.debug("Info %s", message)
     show_message_box(title, message)
 
 
@@ -120,7 +329,7 @@ def show_warning_message(title, message):
     """
     Show simple modal OS specific messagebox/dialog with warning message.
     """
-    logging.debug("Warning %s" % message.encode("utf-8"))
+    logging.debug("Warning %s", message)
     show_message_box(title, message, icon="caution")
 
 
@@ -128,10 +337,28 @@ def show_error_message(title, message):
     """
     Show simple modal OS specific messagebox/dialog with error message.
     """
-    logging.debug("Error %s" % message.encode("utf-8"))
+    logging.debug("Error %s", message)
     show_message_box(title, message, icon="stop")
 
 
+def show_message_detached(level, title, message):
+    """
+    Show ``level`` ("info", "warning" or "error") dialog from a detached
+    osascript and return right away, the dialog outlives us.
+    """
+    logging.debug("%s %s", level.capitalize(), message)
+    command = ["osascript"]
+    for line in ALERT_DIALOG_SCRIPT.splitlines():
+        command.extend(["-e", line])
+    icon = DIALOG_ICONS[{"info": "note", "warning": "caution", "error": "stop"}[level]]
+    devnull = open(os.devnull, "r+b")
+    try:
+        subprocess.Popen(command + [title.encode("utf-8"), message.encode("utf-8"), str(icon), "30"],
+                         stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True)
+    finally:
+        devnull.close()
+
+
 def is_admin():
     """
     Returns True if process is running with admin privileges (UAC or root).
@@ -145,34 +372,68 @@ def is_admin():
 
 MIN_OSX_VER = 10.6
 
-from platform import mac_ver
+
+def get_setup_fingerprint(app, workflow_script):
+    """
+    Return a fingerprint of the installed Automator workflow (its path, the
+    .app it was patched for and its mtime/size) or None if not installed.
+    """
+    try:
+        st = os.stat(workflow_script)
+    except OSError:
+        return None
+    return "%s\n%s\n%r\n%d\n" % (workflow_script.encode("utf-8"), app.encode("utf-8"),
+                                   st.st_mtime, st.st_size)
+
 
 def setup(title, rootdir, is_frozen, script_path=None):
     if is_frozen:
         app = os.path.abspath(os.path.join(rootdir, "../../"))
         target = os.path.join(os.path.expanduser("~/Library/Services/Copy Dropbox URI.workflow"))
         workflow_script = os.path.join(target, "Contents/document.wflow")
-        # Pass 1: check if workflow exists and points to correct .app
-        if os.path.exists(target):
-            if open(workflow_script, "rt").read().find(app) == -1:
-                logging.debug("Automator workflow path incorrect, deleting")
-                shutil.rmtree(target)
-            else:
-                logging.debug("Automator workflow up-to-date")
-        # Pass 2: possible install or re-install workflow if out-of-date
-        if not os.path.exists(target):
-            osx_ver = float(".".join(mac_ver()[0].split(".")[:2])) # "x.y.z" -> float(x.y)
-            if osx_ver >= MIN_OSX_VER:
-                logging.debug("Installing Automator workflow on %s" % osx_ver)
-                source = os.path.join(rootdir, "../Resources/Copy Dropbox URI.workflow")
-                shutil.copytree(source, target)
-                # Patch the workflow script to point to the correct .app
-                logging.debug("Patching workflow -> %s" % app.encode("utf-8"))
-                content = open(workflow_script, "rt").read()
-                open(workflow_script, "wt").write(content.replace("/Applications/DropboxURI.app", app))
-                show_info_message(title, "Successfully installed plugin!")
-            else:
-                show_error_message("Sorry, Mac OS X %s is not supported!" % osx_ver)
+        # Pass 0: skip all checks if nothing changed since the last launch
+        fingerprint_file = get_cache_file("setup.fingerprint")
+        fingerprint = get_setup_fingerprint(app, workflow_script)
+        try:
+            if fingerprint is not None and open(fingerprint_file, "rb").read() == fingerprint:
+                return
+        except IOError:
+            pass
+        install_workflow(title, rootdir, app, target, workflow_script)
+        fingerprint = get_setup_fingerprint(app, workflow_script)
+        if fingerprint is not None:
+            try:
+                if not os.path.exists(os.path.dirname(fingerprint_file)):
+                    os.makedirs(os.path.dirname(fingerprint_file))
+                open(fingerprint_file, "wb").write(fingerprint)
+            except (IOError, OSError), e:
+                logging.debug("Failed to save setup fingerprint: %s", e)
+
+
+def install_workflow(title, rootdir, app, target, workflow_script):
+    import shutil
+    from platform import mac_ver
+    # Pass 1: check if workflow exists and points to correct .app
+    if os.path.exists(target):
+        if open(workflow_script, "rt").read().find(app) == -1:
+            logging.debug("Automator workflow path incorrect, deleting")
+            shutil.rmtree(target)
+        else:
+            logging.debug("Automator workflow up-to-date")
+    # Pass 2: possible install or re-install workflow if out-of-date
+    if not os.path.exists(target):
+        osx_ver = float(".".join(mac_ver()[0].split(".")[:2])) # "x.y.z" -> float(x.y)
+        if osx_ver >= MIN_OSX_VER:
+            logging.debug("Installing Automator workflow on %s", osx_ver)
+            source = os.path.join(rootdir, "../Resources/Copy Dropbox URI.workflow")
+            shutil.copytree(source, target)
+            # Patch the workflow script to point to the correct .app
+            logging.debug("Patching workflow -> %s", app)
+            content = open(workflow_script, "rt").read()
+            open(workflow_script, "wt").write(content.replace("/Applications/DropboxURI.app", app))
+            show_info_message(title, "Successfully installed plugin!")
+        else:
+            show_error_message("Sorry, Mac OS X %s is not supported!" % osx_ver)
 
 
 ###########################################################################
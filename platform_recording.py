@@ -0,0 +1,116 @@
+import os, sys
+import logging
+
+###########################################################################
+# Recording stand-in backend (select with DROPBOX_URI_PLATFORM=recording).
+###########################################################################
+#
+# Implements the same interface as platform_mac and platform_win32 but never
+# touches the UI, every call which would spawn a helper process or show UI is
+# appended to ``calls`` instead. Dropbox databases are looked up in
+# ~/.dropbox just like on Mac OS X which makes it possible to exercise the
+# whole program (and count helper launches) on any platform.
+
+calls = []
+
+
+def record(name, *args):
+    logging.debug("Recorded %s", name)
+    calls.append((name, args))
+
+
+def reset():
+    """
+    Forget all recorded calls.
+    """
+    del calls[:]
+
+
+def count(name):
+    """
+    Return number of recorded calls to ``name``.
+    """
+    return len([call for call in calls if call[0] == name])
+
+
+###########################################################################
+# Module public interface.
+###########################################################################
+
+def get_dropbox_dbfile(filename):
+    """
+    Locate Dropbox SQLite database ``filename`` in users home folder.
+    """
+    return os.path.normpath(os.path.join(os.path.expanduser("~/.dropbox"), filename))
+
+
+def get_cache_file(filename):
+    """
+    Locate private cache file ``filename`` in users home folder.
+    """
+    return os.path.join(os.path.expanduser("~/.dropbox-uri"), filename)
+
+
+def get_daemon_address():
+    """
+    Return the Unix domain socket address used by the resolver daemon.
+    """
+    return get_cache_file("daemon.sock")
+
+
+def set_clipboard_html(html, text):
+    record("set_clipboard_html", html, text)
+
+
+def get_argv(script=None):
+    """
+    Return sys.argv (as unicode) without the executable and ``script``.
+    """
+    if script:
+        script = os.path.abspath(os.path.normpath(script))
+    argv = []
+    for arg in sys.argv:
+        a = arg.decode(sys.getfilesystemencoding() or "utf-8")
+        if script and os.path.abspath(os.path.normpath(a)) == script:
+            continue
+        if a.endswith(sys.executable):
+            continue
+        argv.append(a)
+    return argv
+
+
+def explore_path(filename):
+    record("explore_path", filename)
+
+
+def explore_paths(folder, filenames):
+    record("explore_paths", folder, filenames)
+
+
+def show_info_message(title, message):
+    record("show_info_message", title, message)
+
+
+def show_warning_message(title, message):
+    record("show_warning_message", title, message)
+
+
+def show_error_message(title, message):
+    record("show_error_message", title, message)
+
+
+def show_message_detached(level, title, message):
+    record("show_message_detached", level, title, message)
+
+
+def is_admin():
+    return False
+
+
+def setup(title, rootdir, is_frozen, script_path=None):
+    pass
+
+
+###########################################################################
+# The End.
+###########################################################################
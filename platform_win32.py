@@ -4,7 +4,7 @@ import os, sys
 # Wrap shared library interfacting with OS.
 ###########################################################################
 
-from ctypes import CDLL, c_int, c_wchar_p
+from ctypes import CDLL, POINTER, c_int, c_wchar_p
 
 shared_lib = "platform.dll"
 
@@ -37,6 +37,13 @@ _explore_path = CDLL(shared_lib).explore_path
 _explore_path.restype = c_int
 _explore_path.argtypes = [c_wchar_p] # filename
 
+_explore_paths = CDLL(shared_lib).explore_paths
+_explore_paths.restype = c_int
+_explore_paths.argtypes = [
+    c_wchar_p,            # folder
+    POINTER(c_wchar_p),   # filenames
+    c_int]                # count
+
 _show_info_message = CDLL(shared_lib).show_info_message
 _show_info_message.restype = c_int
 _show_info_message.argtypes = [
@@ -158,6 +165,20 @@ def get_dropbox_dbfile(filename):
     return db_path
 
 
+def get_cache_file(filename):
+    """
+    Locate private cache file ``filename`` in application data folder.
+    """
+    return os.path.normpath(os.path.join(os.path.expandvars("%APPDATA%/DropboxURI"), filename))
+
+
+def get_daemon_address():
+    """
+    Return the named pipe address used by the resolver daemon.
+    """
+    return r"\\.\pipe\DropboxURI-%s" % os.environ.get("USERNAME", "default")
+
+
 def set_clipboard_html(html, text):
     """
     Set global clipboard content to `html` (encoded as raw HTML text) as well
@@ -181,10 +202,8 @@ def get_argv(script=None):
     argv = []
     for i in range(_get_unicode_argc()):
         a = _get_unicode_argv(i)
-        if os.path.exists(a):
-            a = os.path.abspath(os.path.normpath(a))
-            if a == script:
-                continue
+        if script and os.path.abspath(os.path.normpath(a)) == script:
+            continue
         if a.endswith(sys.executable):
             continue
         argv.append(a)
@@ -198,6 +217,14 @@ def explore_path(filename):
     return _explore_path(filename)
 
 
+def explore_paths(folder, filenames):
+    """
+    Open a single OS file browser window for `folder` with all `filenames`
+    (items located in `folder`) selected.
+    """
+    return _explore_paths(folder, (c_wchar_p * len(filenames))(*filenames), len(filenames))
+
+
 def show_info_message(title, message):
     """
     Show simple modal OS specific messagebox/dialog with info message.
@@ -219,6 +246,48 @@ def show_error_message(title, message):
     return _show_error_message(title, message)
 
 
+# Process creation flags for dialogs outliving us.
+DETACHED_PROCESS = 0x00000008
+CREATE_NEW_PROCESS_GROUP = 0x00000200
+
+
+def show_message_detached(level, title, message):
+    """
+    Show ``level`` ("info", "warning" or "error") message box from a detached
+    instance of ourselves (main.py --dialog) and return right away.
+    """
+    import json, tempfile, subprocess
+    dirname = os.path.dirname(get_cache_file("dialog"))
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    fd, filename = tempfile.mkstemp(prefix="dialog-", suffix=".json", dir=dirname)
+    try:
+        os.write(fd, json.dumps({"level": level, "title": title, "message": message}))
+    finally:
+        os.close(fd)
+    command = [sys.executable]
+    if not hasattr(sys, "frozen"):
+        command.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"))
+    subprocess.Popen(command + ["--dialog", filename], close_fds=True,
+                     creationflags=DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP)
+
+
+def show_dialog_file(filename):
+    """
+    Show (and remove) message box saved by show_message_detached().
+    """
+    import json
+    f = open(filename, "rb")
+    try:
+        dialog = json.load(f)
+    finally:
+        f.close()
+    os.remove(filename)
+    {"info": show_info_message,
+     "warning": show_warning_message,
+     "error": show_error_message}[dialog["level"]](dialog["title"], dialog["message"])
+
+
 def is_admin():
     """
     Returns True if process is running with admin privileges (UAC).
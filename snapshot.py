@@ -0,0 +1,194 @@
+import os, sys
+import logging
+import mmap
+import struct
+
+import atomicfile
+
+###########################################################################
+# Compact binary snapshot of the Dropbox state (config + mount table).
+###########################################################################
+#
+# Concurrent launches (Automator services, SendTo) read the snapshot via mmap
+# instead of opening the live Dropbox SQLite files while the client is busy
+# writing to them. The snapshot records the (mtime, size) of every source DB
+# (and its WAL file) and is only rebuilt, atomically, when any of them change.
+# Reading it is no faster than a warm read of the SQLite files (see "python
+# benchmark.py snapshot"), the point is staying off the client's DB locks.
+#
+# Layout (little-endian):
+#
+#   header       "DBXS" u32:version u32:sources
+#   sources      f64:mtime i64:size (for each source file, -1 if missing)
+#   config       u32:count (str:key str:value)*
+#   mounts       u32:count (str:namespace str:server_path)*
+#
+# where str is u32:length followed by UTF-8 encoded data.
+
+SNAPSHOT_MAGIC = "DBXS"
+SNAPSHOT_VERSION = 1
+
+_header = struct.Struct("<4sII")
+_source = struct.Struct("<dq")
+_count = struct.Struct("<I")
+
+
+def get_source_files(dbfiles):
+    """
+    Return all files whose state determines if the snapshot is stale, the
+    SQLite ``dbfiles`` as well as their write-ahead logs.
+    """
+    sources = []
+    for dbfile in dbfiles:
+        sources.extend([dbfile, dbfile + "-wal"])
+    return sources
+
+
+def get_fingerprint(sources):
+    fingerprint = []
+    for filename in sources:
+        try:
+            st = os.stat(filename)
+            fingerprint.append((st.st_mtime, st.st_size))
+        except OSError:
+            fingerprint.append((-1.0, -1))
+    return fingerprint
+
+
+def _pack_str(s):
+    data = unicode(s).encode("utf-8")
+    return _count.pack(len(data)) + data
+
+
+def _unpack_str(buf, offset):
+    (length,) = _count.unpack_from(buf, offset)
+    offset += _count.size
+    return buf[offset:offset+length].decode("utf-8"), offset + length
+
+
+def pack(fingerprint, config, mounts):
+    """
+    Serialize ``config`` (dict) and ``mounts`` (list of (namespace,
+    server_path) tuples) stamped with the source ``fingerprint``.
+    """
+    chunks = [_header.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(fingerprint))]
+    chunks.extend(_source.pack(mtime, size) for (mtime, size) in fingerprint)
+    chunks.append(_count.pack(len(config)))
+    for (key, value) in sorted(config.items()):
+        chunks.append(_pack_str(key) + _pack_str(value))
+    chunks.append(_count.pack(len(mounts)))
+    for (namespace, server_path) in mounts:
+        chunks.append(_pack_str(namespace) + _pack_str(server_path))
+    return "".join(chunks)
+
+
+def unpack_fingerprint(buf):
+    """
+    Return the source fingerprint stored in ``buf`` or None if ``buf`` isn't
+    a snapshot we understand.
+    """
+    if len(buf) < _header.size:
+        return None
+    magic, version, count = _header.unpack_from(buf, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    return [_source.unpack_from(buf, _header.size + n * _source.size)
+            for n in range(count)]
+
+
+def _unpack_config(buf):
+    (count,) = _header.unpack_from(buf, 0)[2:]
+    offset = _header.size + count * _source.size
+    config = {}
+    (count,) = _count.unpack_from(buf, offset)
+    offset += _count.size
+    for n in range(count):
+        key, offset = _unpack_str(buf, offset)
+        config[key], offset = _unpack_str(buf, offset)
+    return config, offset
+
+
+def unpack_mount_count(buf):
+    """
+    Return number of mounts in snapshot ``buf`` without deserializing them.
+    """
+    config, offset = _unpack_config(buf)
+    return _count.unpack_from(buf, offset)[0]
+
+
+def unpack(buf):
+    """
+    Deserialize snapshot ``buf`` and return (config, mounts).
+    """
+    config, offset = _unpack_config(buf)
+    mounts = []
+    (count,) = _count.unpack_from(buf, offset)
+    offset += _count.size
+    for n in range(count):
+        namespace, offset = _unpack_str(buf, offset)
+        server_path, offset = _unpack_str(buf, offset)
+        mounts.append((namespace, server_path))
+    return config, mounts
+
+
+def write(filename, data):
+    """
+    Atomically replace ``filename`` with ``data``, readers either see the old
+    or the new snapshot but never a partial one.
+    """
+    atomicfile.write(filename, data)
+
+
+def _map(filename, fingerprint, func):
+    """
+    Return ``func(buf)`` for the mmap'ed snapshot ``filename`` or None if it
+    is missing or out of sync with ``fingerprint``.
+    """
+    try:
+        f = open(filename, "rb")
+    except IOError:
+        return None
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if unpack_fingerprint(buf) != fingerprint:
+                return None
+            return func(buf)
+        finally:
+            buf.close()
+    finally:
+        f.close()
+
+
+def peek_mount_count(filename, dbfiles):
+    """
+    Return number of mounts recorded in snapshot ``filename`` or None if the
+    snapshot isn't in sync with ``dbfiles``.
+    """
+    return _map(filename, get_fingerprint(get_source_files(dbfiles)), unpack_mount_count)
+
+
+def load(filename, dbfiles, rebuild):
+    """
+    Return (config, mounts) from snapshot ``filename`` if it is still in sync
+    with ``dbfiles`` otherwise call ``rebuild()`` to read them from the
+    databases and refresh the snapshot.
+    """
+    fingerprint = get_fingerprint(get_source_files(dbfiles))
+    state = _map(filename, fingerprint, unpack)
+    if state is not None:
+        return state
+    logging.debug("Rebuilding Dropbox state snapshot")
+    config, mounts = rebuild()
+    try:
+        write(filename, pack(fingerprint, config, mounts))
+    except (IOError, OSError), e:
+        logging.debug("Failed to write snapshot %s: %s", filename, e)
+    return config, mounts
+
+
+###########################################################################
+# The End.
+###########################################################################
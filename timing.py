@@ -0,0 +1,175 @@
+import os, sys
+import math
+import time
+
+import atomicfile
+
+###########################################################################
+# Phase timings and persistent latency histograms.
+###########################################################################
+#
+# The main phases of every invocation (loading the mount table, mapping
+# arguments, encoding, decoding, exploring, writing the clipboard and
+# showing dialogs) are timed with span():
+#
+#   with timing.span("encode"):
+#       ...
+#
+# Spans of the same phase are summed per invocation and save() merges them
+# into a histogram file shared by all invocations, buckets are logarithmic
+# (four per doubling, ~19% resolution) so that the file stays tiny no matter
+# how many samples it has seen. Once a phase has seen HISTORY_SIZE samples
+# all of its counts are halved, older invocations thereby fade out and the
+# percentiles follow the recent behaviour. Dump with:
+#
+#   python main.py --timings
+
+HEADER = "# dropbox-uri timings 1\n"
+BUCKETS_PER_DOUBLING = 4
+HISTORY_SIZE = 10000
+
+if sys.platform == "win32":
+    timer = time.clock
+else:
+    timer = time.time
+
+# Seconds spent per phase in this invocation.
+phases = {}
+
+
+class span(object):
+    """
+    Context manager adding the time spent in its block to phase ``name``.
+    """
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        phases[self.name] = phases.get(self.name, 0.0) + (timer() - self.start)
+
+
+def bucket(seconds):
+    """
+    Histogram bucket for ``seconds``, bucket 0 holds everything up to 1us.
+    """
+    us = seconds * 1e6
+    if us <= 1.0:
+        return 0
+    return int(math.ceil(math.log(us, 2) * BUCKETS_PER_DOUBLING))
+
+
+def bucket_limit(b):
+    """
+    Upper bound (in seconds) of the durations in bucket ``b``.
+    """
+    return 2.0 ** (float(b) / BUCKETS_PER_DOUBLING) / 1e6
+
+
+def read(filename):
+    """
+    Return the histograms in ``filename`` as {phase: {bucket: count}}.
+    """
+    histograms = {}
+    try:
+        f = open(filename, "rb")
+    except IOError:
+        return histograms
+    try:
+        lines = f.read().splitlines()
+    finally:
+        f.close()
+    if not lines or lines[0] != HEADER.rstrip("\n"):
+        return histograms
+    for line in lines[1:]:
+        try:
+            name, _, counts = line.partition("\t")
+            histograms[name] = dict(map(int, item.split(":")) for item in counts.split(","))
+        except ValueError:
+            continue
+    return histograms
+
+
+def write(filename, histograms):
+    """
+    Atomically replace ``filename`` with ``histograms`` (see read()).
+    """
+    lines = [HEADER]
+    for (name, counts) in sorted(histograms.items()):
+        if counts:
+            lines.append("%s\t%s\n" % (name, ",".join("%d:%d" % item
+                                                      for item in sorted(counts.items()))))
+    atomicfile.write(filename, "".join(lines))
+
+
+def merge(histograms, samples):
+    """
+    Add ``samples`` ({phase: seconds}) to ``histograms``, halving all counts
+    of phases which have seen more than HISTORY_SIZE samples.
+    """
+    for (name, seconds) in samples.items():
+        counts = histograms.setdefault(name, {})
+        b = bucket(seconds)
+        counts[b] = counts.get(b, 0) + 1
+        if sum(counts.itervalues()) > HISTORY_SIZE:
+            for b in counts.keys():
+                counts[b] //= 2
+                if not counts[b]:
+                    del counts[b]
+    return histograms
+
+
+def save(filename):
+    """
+    Merge the phases timed by this invocation into histogram ``filename``,
+    concurrent invocations may overwrite each other's samples (never the
+    file) which is fine for statistics.
+    """
+    global phases
+    if not phases:
+        return
+    samples, phases = phases, {}
+    write(filename, merge(read(filename), samples))
+
+
+def percentile(counts, p):
+    """
+    Return upper bound (seconds) of the ``p`` (0-100) percentile in ``counts``.
+    """
+    total = sum(counts.itervalues())
+    seen = 0
+    for b in sorted(counts):
+        seen += counts[b]
+        if seen * 100.0 >= total * p:
+            return bucket_limit(b)
+    return 0.0
+
+
+def summary(histograms):
+    """
+    Return {phase: {"count", "p50", "p95", "p99"}} with percentiles in ms.
+    """
+    return dict((name, {"count": sum(counts.itervalues()),
+                        "p50": round(percentile(counts, 50) * 1000.0, 3),
+                        "p95": round(percentile(counts, 95) * 1000.0, 3),
+                        "p99": round(percentile(counts, 99) * 1000.0, 3)})
+                for (name, counts) in histograms.items() if counts)
+
+
+def dump(filename, out=sys.stdout):
+    """
+    Write the percentiles of histogram ``filename`` to ``out`` as JSON.
+    """
+    import json
+    json.dump(summary(read(filename)), out, indent=2, sort_keys=True)
+    out.write("\n")
+
+
+###########################################################################
+# The End.
+###########################################################################
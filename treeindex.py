@@ -0,0 +1,306 @@
+import os, sys
+import cgi
+import json
+import logging
+import marshal
+import optparse
+import stat
+
+from multiprocessing.pool import ThreadPool
+
+import atomicfile
+import dropbox
+from dropbox import platform
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+###########################################################################
+# Incremental link index of whole shared folders.
+###########################################################################
+#
+# Walks shared folders level by level, listing the directories of each level
+# in parallel on a thread pool, and emits the Dropbox URI of every file and
+# folder as JSON or as a browsable HTML page. A manifest remembers the listing
+# of every directory together with its mtime and its rendered output rows so
+# that re-runs only have to stat each directory; unchanged directories are
+# never listed or encoded again (the output is reassembled from their rows)
+# and when no directory changed at all the output isn't even regenerated.
+# Shared folders nested inside a walked folder are skipped, their items
+# belong to (and are linked via) their own namespace.
+
+MANIFEST_VERSION = 2
+DEFAULT_JOBS = 8
+
+
+def list_directory(path):
+    """
+    Return (subdirs, files) names of directory ``path`` (symlinks are treated
+    as files so that we never leave the shared folder).
+    """
+    dirs, files = [], []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            if stat.S_ISDIR(os.lstat(os.path.join(path, name)).st_mode):
+                dirs.append(name)
+            else:
+                files.append(name)
+    dirs.sort()
+    files.sort()
+    return dirs, files
+
+
+class TreeIndex(object):
+    """
+    Directory listings (keyed by path relative to ``root``) of folder ``root``
+    located at ``prefix`` within the shared folder ``namespace``, each
+    listing is (mtime, subdirs, files, rows) with the output rows rendered by
+    ``render`` (None until rendered). Listings are reused from ``manifest``
+    (a previous run's ``listings``) and subdirectories in ``mounts`` (folded
+    local paths of shared folders) are not walked.
+    """
+    def __init__(self, namespace, root, prefix=u"", manifest=None, render=None, mounts=()):
+        self.namespace = namespace
+        self.root = root
+        self.prefix = prefix
+        self.manifest = manifest or {}
+        self.render = render
+        self.mounts = mounts
+        self.listings = {}
+        self.changed = 0
+
+    def scan(self, rel_path):
+        """
+        Return (rel_path, listing, changed) where listing is (mtime, subdirs,
+        files, rows) of ``rel_path``, reusing the manifest entry if the
+        directory mtime hasn't changed since the last run.
+        """
+        path = self.root + rel_path
+        try:
+            mtime = os.stat(path).st_mtime
+            cached = self.manifest.get(rel_path)
+            if cached is not None and cached[0] == mtime:
+                return rel_path, cached, False
+            dirs, files = list_directory(path)
+        except OSError, e:
+            logging.debug("Skipping %s: %s", path, e)
+            return rel_path, None, True
+        return rel_path, (mtime, dirs, files, None), True
+
+    def is_mount(self, rel_path):
+        return dropbox.fold_path(self.root + rel_path) in self.mounts
+
+    def walk(self, pool):
+        level = [u""]
+        while level:
+            next_level = []
+            for (rel_path, listing, changed) in pool.imap_unordered(self.scan, level, 64):
+                self.changed += changed
+                if listing is None:
+                    continue
+                self.listings[rel_path] = listing
+                for name in listing[1]:
+                    if not self.is_mount(rel_path + os.sep + name):
+                        next_level.append(rel_path + os.sep + name)
+            level = next_level
+        # Directories which disappeared since the last run also count as
+        # changes (the listing of their parent changed as well).
+        self.changed += len(set(self.manifest) - set(self.listings))
+
+    def iter_items(self, rel_path):
+        """
+        Yield (relative path, is_dir, uri) for directory ``rel_path`` (unless
+        it's the root) and its files in sorted order.
+        """
+        encode, namespace, prefix = dropbox.encode_dropbox_uri, self.namespace, self.prefix
+        if rel_path:
+            yield rel_path, True, encode(namespace, prefix + rel_path)
+        for name in self.listings[rel_path][2]:
+            item = rel_path + os.sep + name
+            yield item, False, encode(namespace, prefix + item)
+
+    def iter_rows(self):
+        """
+        Yield the output rows of every directory in sorted order, only
+        directories without rows (listed by this run) are rendered.
+        """
+        for rel_path in sorted(self.listings):
+            (mtime, dirs, files, rows) = self.listings[rel_path]
+            if rows is None:
+                rows = self.render(self, rel_path)
+                self.listings[rel_path] = (mtime, dirs, files, rows)
+            yield rows
+
+
+###########################################################################
+# Manifest and output.
+###########################################################################
+
+def load_manifest(filename):
+    """
+    Return the manifest saved in ``filename``, a dict with the namespace,
+    prefix, format and directory listings (see TreeIndex) of each walked
+    folder (``folders``) and the output settings of the last run
+    (``output``).
+    """
+    empty = {"version": MANIFEST_VERSION, "folders": {}, "output": None}
+    try:
+        f = open(filename, "rb")
+    except IOError:
+        return empty
+    try:
+        manifest = marshal.load(f)
+    except (EOFError, ValueError, TypeError):
+        return empty
+    finally:
+        f.close()
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return empty
+    return manifest
+
+
+def save_manifest(filename, data):
+    atomicfile.write(filename, marshal.dumps(data))
+
+
+def render_json(tree, rel_path):
+    return ",\n".join(json.dumps({
+        "path": tree.root + item, "folder": is_dir, "namespace": tree.namespace,
+        "uri": uri, "url": dropbox.SHARE_URL_PREFIX + uri})
+        for (item, is_dir, uri) in tree.iter_items(rel_path))
+
+
+def write_json(out, trees):
+    out.write("[\n")
+    out.write(",\n".join(rows for tree in trees for rows in tree.iter_rows() if rows))
+    out.write("\n]\n")
+
+
+HTML_HEADER = """\
+<!doctype html>
+<html>
+<head>
+  <meta http-equiv="content-type" content="text/html; charset=utf-8">
+  <title>Share Dropbox URI index</title>
+</head>
+<body>
+"""
+
+HTML_FOOTER = """\
+</body>
+</html>
+"""
+
+
+def render_html(tree, rel_path):
+    return "".join(("<li><a href='%s%s'>%s%s</a></li>\n" % (
+        dropbox.SHARE_URL_PREFIX, uri, cgi.escape(item),
+        os.sep if is_dir else u"")).encode("utf-8")
+        for (item, is_dir, uri) in tree.iter_items(rel_path))
+
+
+def write_html(out, trees):
+    out.write(HTML_HEADER)
+    for tree in trees:
+        out.write("<h1>%s</h1>\n<ul>\n" % cgi.escape(tree.root).encode("utf-8"))
+        for rows in tree.iter_rows():
+            out.write(rows)
+        out.write("</ul>\n")
+    out.write(HTML_FOOTER)
+
+
+# Format: (row renderer, writer).
+WRITERS = {
+    "json" : (render_json, write_json),
+    "html" : (render_html, write_html),
+}
+
+
+def build(folders, output, fmt="html", manifest_file=None, jobs=DEFAULT_JOBS):
+    """
+    (Re)build the link index of shared ``folders`` (all shared folders if
+    empty) into ``output``. Returns the number of directories which had to be
+    listed (zero if nothing changed since the last run).
+    """
+    index = dropbox.SharedFolderIndex(dropbox.get_dropbox_shared_folders())
+    mounts = set(dropbox.fold_path(path) for path in index.namespaces.values())
+    roots = []
+    for folder in folders or sorted(index.namespaces.values()):
+        folder = os.path.abspath(os.path.normpath(folder))
+        match = index.find_path(folder)
+        if match is None:
+            raise dropbox.DropboxWarning("Not a shared folder: %s" % folder.encode("utf-8"))
+        roots.append((match[0], folder, match[1]))
+
+    manifest_file = manifest_file or platform.get_cache_file("treeindex.manifest")
+    manifest = load_manifest(manifest_file)
+
+    (render, write) = WRITERS[fmt]
+    trees = []
+    pool = ThreadPool(jobs)
+    try:
+        for (namespace, root, prefix) in roots:
+            cached = manifest["folders"].get(root)
+            if cached is None:
+                listings = None
+            elif cached[:3] == (namespace, prefix, fmt):
+                listings = cached[3]
+            else:
+                # Rendered for another namespace or format, only keep the
+                # listings themselves.
+                listings = dict((rel_path, listing[:3] + (None,))
+                                for (rel_path, listing) in cached[3].items())
+            tree = TreeIndex(namespace, root, prefix, listings, render, mounts)
+            tree.walk(pool)
+            trees.append(tree)
+    finally:
+        pool.close()
+        pool.join()
+
+    changed = sum(tree.changed for tree in trees)
+    settings = (os.path.abspath(output), fmt, [tree.root for tree in trees])
+    if changed or manifest["output"] != settings or not os.path.exists(output):
+        f = open(output, "wb")
+        try:
+            write(f, trees)
+        finally:
+            f.close()
+        manifest["folders"].update((tree.root, (tree.namespace, tree.prefix, fmt, tree.listings))
+                                   for tree in trees)
+        manifest["output"] = settings
+        save_manifest(manifest_file, manifest)
+    return changed
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [options] -o FILE [SHARED FOLDER ...]")
+    parser.add_option("-o", "--output", help="write index to FILE")
+    parser.add_option("-f", "--format", choices=sorted(WRITERS), default="html",
+                      help="output format: html (default) or json")
+    parser.add_option("-m", "--manifest", help="manifest used for incremental runs")
+    parser.add_option("-j", "--jobs", type="int", default=DEFAULT_JOBS,
+                      help="number of directories listed in parallel")
+    (options, args) = parser.parse_args(argv[1:])
+    if not options.output:
+        parser.error("missing --output")
+    encoding = sys.getfilesystemencoding() or "utf-8"
+    changed = build([arg.decode(encoding) for arg in args], options.output,
+                    options.format, options.manifest, options.jobs)
+    logging.debug("Link index built, %d directories changed", changed)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+
+###########################################################################
+# The End.
+###########################################################################